@@ -0,0 +1,29 @@
+from django.core.management.base import NoArgsCommand, CommandError
+from django.conf import settings
+
+if "jogging" in settings.INSTALLED_APPS:
+	from jogging import logging
+else:
+	logging = None
+
+from condottieri_common.models import RankingEntry
+
+class Command(NoArgsCommand):
+	"""
+	This command rebuilds all the materialized rankings from the scores and
+	the profiles. The rankings are kept up to date incrementally, so it only
+	has to be run once, after creating the tables.
+	"""
+	help = "Rebuilds all the materialized rankings"
+
+	def handle_noargs(self, **options):
+		msg = "Rebuilding rankings\n"
+		c = RankingEntry.objects.rebuild_scores()
+		msg += "%s score entries created\n" % c
+		c = RankingEntry.objects.rebuild_hall_of_fame()
+		msg += "%s hall of fame entries created\n" % c
+
+		if logging:
+			logging.info(msg)
+		else:
+			print msg
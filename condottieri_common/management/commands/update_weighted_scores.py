@@ -1,4 +1,5 @@
-from datetime import datetime, timedelta
+from datetime import datetime
+from optparse import make_option
 
 from django.core.management.base import NoArgsCommand, CommandError
 from django.conf import settings
@@ -8,49 +9,51 @@ if "jogging" in settings.INSTALLED_APPS:
 else:
 	logging = None
 
-from condottieri_common.models import Server
-import condottieri_profiles.models as profiles
+from condottieri_common.models import Server, RankingEntry
+import condottieri_common.scoring as scoring
 import machiavelli.models as machiavelli
 
-deval = settings.SCORE_DEVALUATION
-threshold = timedelta(30 * settings.DEVALUATION_MONTHS)
-
 
 class Command(NoArgsCommand):
 	"""
-	This command calculates the weighted scores of all the profiles.
+	This command calculates the weighted scores of the profiles that have
+	changed since the last update. With --full, all the profiles are
+	calculated.
 	"""
 	help = "Calculates the weighted scores of all the profiles"
+	option_list = NoArgsCommand.option_list + (
+		make_option('--full', action='store_true', dest='full', default=False,
+			help='Calculate the scores of all the profiles'),
+	)
 
 	def handle_noargs(self, **options):
 		## check first if the ranking is outdated
 		server = Server.objects.get()
-		if not server.ranking_outdated:
+		if not server.ranking_outdated and not options.get('full'):
 			return
 
-		profile_list = profiles.CondottieriProfile.objects.filter(total_score__gt=0)
-		last_game = machiavelli.Game.objects.order_by('-finished')[0]
-		now = last_game.finished
+		finished = machiavelli.Game.objects.filter(finished__isnull=False).order_by('-finished')
+		now = finished[0].finished
+		## the reference date used in the previous update
+		previous = None
+		if not options.get('full') and server.ranking_last_update:
+			try:
+				previous = finished.filter(finished__lte=server.ranking_last_update)[0].finished
+			except IndexError:
+				pass
 		msg = "Recalculating weighted scores\n"
 		msg += "Reference date: %s\n" % now
-		msg += "Found %s profiles\n" % profile_list.count()
-		c = 0
-		for p in profile_list:
-			scores = machiavelli.Score.objects.filter(user=p.user)
-			weighted = 0
-			for s in scores:
-				age = now - s.created_at
-				if age <= threshold:
-					months = age.days / 30
-				else:
-					months = threshold.days / 30
-				factor = 1.0 - ( months * deval )
-				w = s.points * factor
-				weighted += w
-			p.weighted_score = int(round(weighted))
-			p.save()
-			c += 1
-		msg += "Processed %s profiles\n" % c
+		msg += "Previous reference date: %s\n" % previous
+		engine = scoring.WeightedScoreEngine(now, previous, server.ranking_last_update)
+		engine.run()
+		msg += engine.report()
+
+		if previous is None:
+			c = RankingEntry.objects.rebuild_hall_of_fame()
+			msg += "Hall of fame rebuilt with %s profiles\n" % c
+		else:
+			c = RankingEntry.objects.update_hall_of_fame(engine.profile_scores())
+			msg += "%s profiles moved in the hall of fame\n" % c
 
 		server.ranking_last_update = datetime.now()
 		server.ranking_outdated = False
@@ -61,4 +64,3 @@ class Command(NoArgsCommand):
 			logging.info(msg)
 		else:
 			print msg
-
@@ -20,8 +20,11 @@
 
 """
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
 
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 
@@ -30,7 +33,9 @@ if "jogging" in settings.INSTALLED_APPS:
 else:
 	logging = None
 
-from machiavelli.signals import game_finished
+from machiavelli.signals import game_finished, scores_assigned
+from machiavelli.models import Game, Score
+from condottieri_profiles.models import CondottieriProfile
 
 class Server(models.Model):
 	""" Defines core attributes for the whole site """
@@ -54,3 +59,205 @@ def outdate_ranking(sender, **kwargs):
 		server.save()
 
 game_finished.connect(outdate_ranking)
+
+##
+## Materialized rankings
+##
+
+## maximum number of ids in an IN clause
+UPDATE_CHUNK = 500
+
+RANKING_FAME = 'fame'
+RANKING_USER = 'user'
+RANKING_SCENARIO = 'scenario'
+RANKING_COUNTRY = 'country'
+
+RANKING_KINDS = (
+	(RANKING_FAME, _('Hall of fame')),
+	(RANKING_USER, _('User')),
+	(RANKING_SCENARIO, _('Scenario')),
+	(RANKING_COUNTRY, _('Country')),
+)
+
+class RankingEntryManager(models.Manager):
+	def insert(self, kind, group_id, object_id, points):
+		""" Adds an entry to a ranking, shifting the dense ranks of the entries
+		with less points if needed.
+
+		The ranks are read and then shifted without locking the rows, so two
+		inserts in the same ranking at the same time may leave duplicated or
+		missing ranks. Scores are only inserted when a game finishes, so this
+		is rare; the ``rebuild_rankings`` command builds all the rankings
+		again from the scores and profiles, and repairs them. """
+		entries = self.filter(kind=kind, group_id=group_id)
+		try:
+			rank = entries.filter(points=points).values_list('rank', flat=True)[0]
+		except IndexError:
+			higher = entries.filter(points__gt=points).aggregate(Max('rank'))['rank__max']
+			rank = (higher or 0) + 1
+			entries.filter(points__lt=points).update(rank=F('rank') + 1)
+		self.create(kind=kind, group_id=group_id, object_id=object_id,
+					points=points, rank=rank)
+	insert = transaction.commit_on_success(insert)
+
+	def remove(self, kind, group_id, object_id):
+		""" Deletes an entry from a ranking, closing the gap that it leaves in
+		the dense ranks. """
+		entries = self.filter(kind=kind, group_id=group_id)
+		try:
+			entry = entries.get(object_id=object_id)
+		except ObjectDoesNotExist:
+			return
+		entry.delete()
+		if not entries.filter(points=entry.points).exists():
+			entries.filter(points__lt=entry.points).update(rank=F('rank') - 1)
+	remove = transaction.commit_on_success(remove)
+
+	def rebuild(self, kind, group_id, rows):
+		""" Replaces all the entries in a ranking. ``rows`` is an iterable of
+		(object_id, points) tuples. """
+		rows = sorted(rows, key=lambda r: (-r[1], r[0]))
+		values = []
+		rank = 0
+		last_points = None
+		for object_id, points in rows:
+			if points != last_points:
+				rank += 1
+				last_points = points
+			values.append((kind, group_id, object_id, points, rank))
+		self.filter(kind=kind, group_id=group_id).delete()
+		if values:
+			qn = connection.ops.quote_name
+			sql = "INSERT INTO %s (%s, %s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s, %%s)" % (
+				qn(self.model._meta.db_table), qn('kind'), qn('group_id'),
+				qn('object_id'), qn('points'), qn('rank'))
+			cursor = connection.cursor()
+			cursor.executemany(sql, values)
+			transaction.set_dirty()
+		return len(values)
+	rebuild = transaction.commit_on_success(rebuild)
+
+	def move(self, kind, group_id, object_id, points):
+		""" Changes the points of an entry, keeping the dense ranks of the
+		ranking """
+		self.remove(kind, group_id, object_id)
+		self.insert(kind, group_id, object_id, points)
+
+	def update_hall_of_fame(self, rows):
+		""" Moves the profiles whose weighted score has changed in the hall of
+		fame. ``rows`` is an iterable of (profile id, weighted score) tuples.
+		Returns the number of moved entries. """
+		rows = dict(rows)
+		current = {}
+		ids = rows.keys()
+		for i in range(0, len(ids), UPDATE_CHUNK):
+			current.update(self.filter(kind=RANKING_FAME, group_id=0,
+							object_id__in=ids[i:i + UPDATE_CHUNK]).values_list('object_id', 'points'))
+		count = 0
+		for profile_id, points in rows.items():
+			if current.get(profile_id) != points:
+				self.move(RANKING_FAME, 0, profile_id, points)
+				count += 1
+		return count
+
+	def rebuild_hall_of_fame(self):
+		""" Rebuilds the ranking of profiles by weighted score """
+		rows = CondottieriProfile.objects.values_list('id', 'weighted_score')
+		return self.rebuild(RANKING_FAME, 0, rows)
+
+	def rebuild_scores(self):
+		""" Rebuilds the rankings of scores by user, scenario and country """
+		groups = {}
+		for s in Score.objects.values('id', 'points', 'user', 'game__scenario', 'country'):
+			row = (s['id'], s['points'])
+			groups.setdefault((RANKING_USER, s['user']), []).append(row)
+			groups.setdefault((RANKING_SCENARIO, s['game__scenario']), []).append(row)
+			groups.setdefault((RANKING_COUNTRY, s['country']), []).append(row)
+		for kind in (RANKING_USER, RANKING_SCENARIO, RANKING_COUNTRY):
+			self.filter(kind=kind).delete()
+		count = 0
+		for (kind, group_id), rows in groups.items():
+			count += self.rebuild(kind, group_id, rows)
+		return count
+
+	def position(self, kind, group_id, object_id):
+		""" Returns the dense rank of an object in a ranking, or None """
+		try:
+			return self.filter(kind=kind, group_id=group_id,
+							object_id=object_id).values_list('rank', flat=True)[0]
+		except IndexError:
+			return None
+
+class RankingEntry(models.Model):
+	""" A RankingEntry is the materialized position of a Score (in the rankings
+	by user, scenario and country) or a CondottieriProfile (in the hall of
+	fame). Entries are ordered by points, and ties are broken by object id, so
+	that the rankings can be paginated by key. """
+	kind = models.CharField(max_length=8, choices=RANKING_KINDS)
+	## id of the user, scenario or country; 0 in the hall of fame
+	group_id = models.PositiveIntegerField(default=0)
+	## id of the Score or the CondottieriProfile
+	object_id = models.PositiveIntegerField()
+	points = models.IntegerField()
+	rank = models.PositiveIntegerField()
+
+	objects = RankingEntryManager()
+
+	class Meta:
+		ordering = ['-points', 'object_id']
+		## the second constraint is redundant, but it creates the index used
+		## by the keyset pagination
+		unique_together = (('kind', 'group_id', 'object_id'),
+						('kind', 'group_id', 'points', 'object_id'),)
+
+	def __unicode__(self):
+		return "%s %s: %s (%s)" % (self.kind, self.group_id, self.object_id, self.rank)
+
+## the scenario of a game never changes, so it is only looked up once
+_game_scenarios = {}
+
+def game_scenario_id(game_id):
+	""" Returns the id of the scenario of a game """
+	try:
+		return _game_scenarios[game_id]
+	except KeyError:
+		scenario_id = Game.objects.filter(id=game_id).values_list('scenario', flat=True)[0]
+		_game_scenarios[game_id] = scenario_id
+		return scenario_id
+
+def rank_new_score(sender, instance, created, **kw):
+	if isinstance(instance, Score) and created:
+		RankingEntry.objects.insert(RANKING_USER, instance.user_id, instance.pk, instance.points)
+		RankingEntry.objects.insert(RANKING_SCENARIO, game_scenario_id(instance.game_id),
+									instance.pk, instance.points)
+		RankingEntry.objects.insert(RANKING_COUNTRY, instance.country_id, instance.pk, instance.points)
+
+post_save.connect(rank_new_score, sender=Score)
+
+def rank_game_scores(sender, **kw):
+	""" Ranks the scores of a game, that are created in bulk """
+	for s in Score.objects.filter(game=sender).values('id', 'points', 'user', 'game__scenario', 'country'):
+		RankingEntry.objects.insert(RANKING_USER, s['user'], s['id'], s['points'])
+		RankingEntry.objects.insert(RANKING_SCENARIO, s['game__scenario'], s['id'], s['points'])
+		RankingEntry.objects.insert(RANKING_COUNTRY, s['country'], s['id'], s['points'])
+
+scores_assigned.connect(rank_game_scores)
+
+def unrank_score(sender, instance, **kw):
+	if isinstance(instance, Score):
+		for e in RankingEntry.objects.filter(object_id=instance.pk).exclude(kind=RANKING_FAME):
+			RankingEntry.objects.remove(e.kind, e.group_id, e.object_id)
+
+post_delete.connect(unrank_score, sender=Score)
+
+def rank_new_profile(sender, instance, created, **kw):
+	if isinstance(instance, CondottieriProfile) and created:
+		RankingEntry.objects.insert(RANKING_FAME, 0, instance.pk, instance.weighted_score)
+
+post_save.connect(rank_new_profile, sender=CondottieriProfile)
+
+def unrank_profile(sender, instance, **kw):
+	if isinstance(instance, CondottieriProfile):
+		RankingEntry.objects.remove(RANKING_FAME, 0, instance.pk)
+
+post_delete.connect(unrank_profile, sender=CondottieriProfile)
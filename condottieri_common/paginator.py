@@ -0,0 +1,105 @@
+## Copyright (c) 2011 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module defines a paginator for the materialized rankings. Instead of
+an offset, each page is defined by the key (points and object id) of the
+entry before or after it, so that the database reads only the rows of the
+page.
+
+"""
+
+from django.db.models import Q
+
+class InvalidKey(Exception):
+	pass
+
+def parse_key(key):
+	""" Returns a tuple (points, object_id) from a key string """
+	try:
+		points, object_id = key.split('_')
+		return int(points), int(object_id)
+	except ValueError:
+		raise InvalidKey('The key is not valid')
+
+def make_key(entry):
+	return "%s_%s" % (entry.points, entry.object_id)
+
+class KeysetPaginator(object):
+	def __init__(self, entries, per_page):
+		""" ``entries`` is a queryset of ``RankingEntry`` objects """
+		self.entries = entries
+		self.per_page = per_page
+
+	def page(self, after=None, before=None):
+		""" Returns the page that follows the key ``after`` or precedes the
+		key ``before``. If no key is given, returns the first page. """
+		if after:
+			points, object_id = parse_key(after)
+			entries = self.entries.filter(Q(points__lt=points) |
+							Q(points=points, object_id__gt=object_id))
+		elif before:
+			points, object_id = parse_key(before)
+			entries = self.entries.filter(Q(points__gt=points) |
+							Q(points=points, object_id__lt=object_id))
+		else:
+			entries = self.entries
+		if before:
+			entries = list(entries.order_by('points', '-object_id')[:self.per_page + 1])
+			more = len(entries) > self.per_page
+			entries = entries[:self.per_page]
+			entries.reverse()
+			return KeysetPage(entries, has_previous=more, has_next=True)
+		entries = list(entries.order_by('-points', 'object_id')[:self.per_page + 1])
+		more = len(entries) > self.per_page
+		return KeysetPage(entries[:self.per_page], has_previous=bool(after), has_next=more)
+
+class KeysetPage(object):
+	def __init__(self, entries, has_previous, has_next):
+		self.entries = entries
+		## object_list is set by the view with the ranked objects
+		self.object_list = entries
+		self._has_previous = has_previous and len(entries) > 0
+		self._has_next = has_next and len(entries) > 0
+
+	def __repr__(self):
+		return '<Page of %s entries>' % len(self.entries)
+
+	def has_previous(self):
+		return self._has_previous
+
+	def has_next(self):
+		return self._has_next
+
+	def has_other_pages(self):
+		return self.has_previous() or self.has_next()
+
+	def previous_key(self):
+		return make_key(self.entries[0])
+
+	def next_key(self):
+		return make_key(self.entries[-1])
+
+	def first_rank(self):
+		if self.entries:
+			return self.entries[0].rank
+		return None
+
+	def last_rank(self):
+		if self.entries:
+			return self.entries[-1].rank
+		return None
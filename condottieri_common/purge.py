@@ -0,0 +1,95 @@
+## Copyright (c) 2011 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module deletes old rows in batches, so that the cleaning commands
+never load a whole table in memory.
+
+The rows are deleted in ranges of primary keys. Optionally, each range is
+saved to a gzipped JSON file before it is deleted.
+
+"""
+
+import gzip
+import os
+from optparse import make_option
+
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Min, Max
+
+## default number of primary keys in each batch
+CHUNK_SIZE = 1000
+
+PURGE_OPTIONS = (
+	make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+		help='Only count the rows that would be deleted'),
+	make_option('--chunk-size', type='int', dest='chunk_size', default=CHUNK_SIZE,
+		help='Number of primary keys in each batch'),
+	make_option('--archive', dest='archive', default=None,
+		help='Directory where each batch is saved before deleting it'),
+)
+
+def archive_chunk(objects, path):
+	""" Saves ``objects`` to a gzipped JSON file """
+	fd = gzip.open(path, 'wb')
+	try:
+		serializers.serialize('json', objects, stream=fd)
+	finally:
+		fd.close()
+
+def delete_chunk(queryset):
+	queryset.delete()
+delete_chunk = transaction.commit_on_success(delete_chunk)
+
+def purge(queryset, name, chunk_size=CHUNK_SIZE, dry_run=False, archive=None,
+		expand=None):
+	""" Deletes the rows in ``queryset`` in batches of ``chunk_size`` primary
+	keys. Returns a tuple with the number of rows to delete and the number
+	of deleted rows, that is 0 if ``dry_run`` is True. ``name`` is used in
+	the names of the archived files.
+
+	``expand`` is an optional function that returns the objects to be
+	archived for each batch, such as the related rows that will be deleted
+	in cascade. """
+	total = queryset.count()
+	if dry_run or total == 0:
+		return total, 0
+	bounds = queryset.aggregate(Min('pk'), Max('pk'))
+	low = bounds['pk__min']
+	deleted = 0
+	while low <= bounds['pk__max']:
+		high = low + chunk_size
+		chunk = queryset.filter(pk__gte=low, pk__lt=high)
+		count = chunk.count()
+		if count > 0:
+			if archive:
+				path = os.path.join(archive, "%s-%s-%s.json.gz" % (name, low, high - 1))
+				if expand:
+					archive_chunk(expand(chunk), path)
+				else:
+					archive_chunk(chunk, path)
+			delete_chunk(chunk)
+			deleted += count
+		low = high
+	return total, deleted
+
+def report(name, total, deleted, dry_run=False):
+	""" Returns a line with the result of ``purge`` """
+	if dry_run:
+		return "%s %s would be deleted" % (total, name)
+	return "Deleted %s of %s %s" % (deleted, total, name)
@@ -0,0 +1,65 @@
+## Copyright (c) 2011 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module keeps a sorted array with the distinct weighted scores of the
+profiles, so that the position of a user in the hall of fame is found with a
+binary search instead of a query. The position is the dense rank, the same
+that the hall of fame shows in ``RankingEntry.rank``.
+
+The array is built again only when the ranking of the server is updated. It
+is shared by all the processes through the cache, and each process keeps its
+own copy while the ranking does not change.
+
+"""
+
+from array import array
+from bisect import bisect_right
+
+from django.core.cache import cache
+
+from condottieri_profiles.models import CondottieriProfile
+
+CACHE_KEY = 'ranking_index'
+## seconds that the array is kept in the cache
+CACHE_TIMEOUT = 7*24*60*60
+
+## copy of the array in this process, with the version that it belongs to
+_local = {'version': None, 'scores': None}
+
+def get_scores(version):
+	""" Returns the sorted array of distinct weighted scores for the given
+	version of the ranking. ``version`` is the time of the last ranking
+	update. """
+	if _local['version'] == version:
+		return _local['scores']
+	cached = cache.get(CACHE_KEY)
+	if cached and cached[0] == version:
+		scores = cached[1]
+	else:
+		scores = array('l', CondottieriProfile.objects.order_by('weighted_score').values_list('weighted_score', flat=True).distinct())
+		cache.set(CACHE_KEY, (version, scores), CACHE_TIMEOUT)
+	_local['version'] = version
+	_local['scores'] = scores
+	return scores
+
+def get_position(score, version):
+	""" Returns the position in the hall of fame of a profile with the given
+	weighted score: one more than the number of distinct higher scores, as
+	the dense ranks of the hall of fame. """
+	scores = get_scores(version)
+	return len(scores) - bisect_right(scores, score) + 1
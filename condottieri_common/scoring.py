@@ -0,0 +1,152 @@
+## Copyright (c) 2011 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module calculates the weighted scores of the profiles.
+
+The weighted score of a user is the sum of the points of all his scores, each
+one devaluated by ``SCORE_DEVALUATION`` for each month of age, up to
+``DEVALUATION_MONTHS`` months. The age is measured from a reference date (the
+date of the last finished game), so the weighted score only changes when the
+user gets a new score or when one of his scores gets a month older.
+
+"""
+
+from datetime import timedelta
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from condottieri_profiles.models import CondottieriProfile
+from machiavelli.models import Score
+
+## maximum number of ids in an UPDATE query
+UPDATE_CHUNK = 500
+
+def months_old(created_at, reference):
+	""" Returns the devaluation bucket (age in months, up to
+	DEVALUATION_MONTHS) of a score """
+	if created_at is None or reference is None:
+		return 0
+	return min((reference - created_at).days / 30, settings.DEVALUATION_MONTHS)
+
+class WeightedScoreEngine(object):
+	""" Calculates the weighted scores of the users that have changed since
+	the previous reference date. If ``previous`` is None, all the users are
+	calculated. """
+
+	def __init__(self, reference, previous=None, last_update=None):
+		self.reference = reference
+		self.previous = previous
+		self.last_update = last_update
+		self.timing = []
+		self.loaded = 0
+		self.changed = 0
+		self.updates = 0
+		## {user id: weighted score} of the recalculated users
+		self.weighted = {}
+
+	def _lap(self, step, start):
+		now = time.time()
+		self.timing.append((step, now - start))
+		return now
+
+	def changed_users(self):
+		""" Returns the ids of the users that have a score created after the
+		last update, or a score that is in another bucket with the new
+		reference date. A score is moved to bucket ``m`` if it is at least
+		``m`` months old with the new reference date, but not with the
+		previous one. """
+		changed = Q()
+		if self.last_update:
+			changed |= Q(created_at__gt=self.last_update)
+		for m in range(1, settings.DEVALUATION_MONTHS + 1):
+			age = timedelta(days=30 * m)
+			changed |= Q(created_at__gt=self.previous - age,
+						created_at__lte=self.reference - age)
+		return list(Score.objects.filter(changed).order_by().values_list('user',
+																flat=True).distinct())
+
+	def load(self):
+		""" Returns a dictionary {user_id: {bucket: points}} with the points
+		of the changed users grouped by age bucket. Only the scores of the
+		changed users are read, unless there is no previous reference date. """
+		if self.previous is None:
+			querysets = [Score.objects.all()]
+		else:
+			user_ids = self.changed_users()
+			querysets = [Score.objects.filter(user__id__in=user_ids[i:i + UPDATE_CHUNK])
+						for i in range(0, len(user_ids), UPDATE_CHUNK)]
+		buckets = {}
+		for scores in querysets:
+			for user_id, points, created_at in scores.values_list('user', 'points', 'created_at'):
+				self.loaded += 1
+				bucket = months_old(created_at, self.reference)
+				user_buckets = buckets.setdefault(user_id, {})
+				user_buckets[bucket] = user_buckets.get(bucket, 0) + points
+		self.changed = len(buckets)
+		return buckets
+
+	def calculate(self, buckets):
+		""" Returns a dictionary {weighted score: [user ids]} """
+		deval = settings.SCORE_DEVALUATION
+		result = {}
+		for user_id, user_buckets in buckets.items():
+			weighted = sum([(1.0 - b * deval) * p for b, p in user_buckets.items()])
+			result.setdefault(int(round(weighted)), []).append(user_id)
+		return result
+
+	def write(self, weighted):
+		""" Updates the profiles, with one query for each weighted score and
+		chunk of users """
+		for score, user_ids in weighted.items():
+			for user_id in user_ids:
+				self.weighted[user_id] = score
+			for i in range(0, len(user_ids), UPDATE_CHUNK):
+				chunk = user_ids[i:i + UPDATE_CHUNK]
+				CondottieriProfile.objects.filter(user__id__in=chunk).update(weighted_score=score)
+				self.updates += 1
+	write = transaction.commit_on_success(write)
+
+	def run(self):
+		start = time.time()
+		buckets = self.load()
+		start = self._lap("load", start)
+		weighted = self.calculate(buckets)
+		start = self._lap("calculate", start)
+		self.write(weighted)
+		self._lap("write", start)
+
+	def profile_scores(self):
+		""" Returns a list of (profile id, weighted score) tuples with the
+		recalculated profiles """
+		rows = []
+		user_ids = self.weighted.keys()
+		for i in range(0, len(user_ids), UPDATE_CHUNK):
+			rows.extend(CondottieriProfile.objects.filter(user__id__in=user_ids[i:i + UPDATE_CHUNK]
+										).values_list('id', 'weighted_score'))
+		return rows
+
+	def report(self):
+		""" Returns a string with the results and timing of the last run """
+		msg = "Loaded %s scores\n" % self.loaded
+		msg += "Recalculated %s users with %s update queries\n" % (self.changed, self.updates)
+		for step, seconds in self.timing:
+			msg += "%s: %.3f s\n" % (step, seconds)
+		return msg
@@ -99,3 +99,11 @@ admin.site.register(CountryEvent, CountryEventAdmin)
 admin.site.register(DisasterEvent, DisasterEventAdmin)
 admin.site.register(IncomeEvent, IncomeEventAdmin)
 admin.site.register(ExpenseEvent, ExpenseEventAdmin)
+
+class CompactEventAdmin(admin.ModelAdmin):
+	ordering = ['-year']
+	list_per_page = 20
+	list_display = ('game', 'classname', '__unicode__', 'year', 'season', 'phase')
+	list_filter = ('game', 'classname', 'year', 'season', 'phase')
+
+admin.site.register(CompactEvent, CompactEventAdmin)
@@ -2,16 +2,32 @@ from datetime import datetime, timedelta
 
 from django.core.management.base import NoArgsCommand, CommandError
 
+from condottieri_common.purge import purge, report, PURGE_OPTIONS
+
 #from machiavelli import models
 from condottieri_events import models
 
 AGE=30*24*60*60
 
+def with_concrete_events(events):
+	""" Returns the base events and their child events, to be archived. The
+	child events are loaded with one query for each event class. """
+	events = list(events)
+	ids = {}
+	for e in events:
+		ids.setdefault(e.classname, []).append(e.pk)
+	concrete = {}
+	for classname, pks in ids.items():
+		event_class = getattr(models, classname)
+		concrete.update(event_class.objects.in_bulk(pks))
+	return events + [concrete[e.pk] for e in events if e.pk in concrete]
+
 class Command(NoArgsCommand):
 	"""
 This script deletes all events in finished games that are older than AGE days.
 	"""
 	help = 'This command deletes all events in finished games that are older than AGE days.'
+	option_list = NoArgsCommand.option_list + PURGE_OPTIONS
 
 	def handle_noargs(self, **options):
 		age = timedelta(0, AGE)
@@ -20,5 +36,13 @@ This script deletes all events in finished games that are older than AGE days.
 		old_events = models.BaseEvent.objects.filter(game__phase__exact=models.PHINACTIVE,
 									game__slots__exact=0,
 									game__last_phase_change__lt=threshold)
-		print "%s events will be deleted" % len(old_events)
-		old_events.delete()
+		total, deleted = purge(old_events, "events", options['chunk_size'],
+							options['dry_run'], options['archive'],
+							expand=with_concrete_events)
+		print report("events", total, deleted, options['dry_run'])
+		old_compact = models.CompactEvent.objects.filter(game__phase__exact=models.PHINACTIVE,
+									game__slots__exact=0,
+									game__last_phase_change__lt=threshold)
+		total, deleted = purge(old_compact, "compact_events", options['chunk_size'],
+							options['dry_run'], options['archive'])
+		print report("compact events", total, deleted, options['dry_run'])
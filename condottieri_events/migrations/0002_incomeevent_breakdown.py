@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'IncomeEvent.control'
+        db.add_column('condottieri_events_incomeevent', 'control',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'IncomeEvent.occupation'
+        db.add_column('condottieri_events_incomeevent', 'occupation',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'IncomeEvent.garrisons'
+        db.add_column('condottieri_events_incomeevent', 'garrisons',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'IncomeEvent.variable'
+        db.add_column('condottieri_events_incomeevent', 'variable',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'IncomeEvent.control'
+        db.delete_column('condottieri_events_incomeevent', 'control')
+
+        # Deleting field 'IncomeEvent.occupation'
+        db.delete_column('condottieri_events_incomeevent', 'occupation')
+
+        # Deleting field 'IncomeEvent.garrisons'
+        db.delete_column('condottieri_events_incomeevent', 'garrisons')
+
+        # Deleting field 'IncomeEvent.variable'
+        db.delete_column('condottieri_events_incomeevent', 'variable')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'condottieri_events.baseevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'BaseEvent'},
+            'classname': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'game': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Game']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'phase': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'season': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'year': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'condottieri_events.compactevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'unique_together': "(('game', 'year', 'season', 'phase', 'id'),)", 'object_name': 'CompactEvent'},
+            'classname': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'game': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Game']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'payload': ('django.db.models.fields.TextField', [], {'default': "''"}),
+            'phase': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'season': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'year': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'condottieri_events.controlevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'ControlEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"})
+        },
+        'condottieri_events.conversionevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'ConversionEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'after': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'before': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']", 'null': 'True', 'blank': 'True'})
+        },
+        'condottieri_events.countryevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'CountryEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"}),
+            'message': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'condottieri_events.disasterevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'DisasterEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'message': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'condottieri_events.disbandevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'DisbandEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']", 'null': 'True', 'blank': 'True'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'condottieri_events.expenseevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'ExpenseEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']", 'null': 'True', 'blank': 'True'}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"}),
+            'ducats': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'type': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'unit_type': ('django.db.models.fields.CharField', [], {'max_length': '1', 'null': 'True', 'blank': 'True'})
+        },
+        'condottieri_events.incomeevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'IncomeEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'control': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"}),
+            'ducats': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'garrisons': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'occupation': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'variable': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'condottieri_events.movementevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'MovementEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']", 'null': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'movement_destination'", 'to': "orm['machiavelli.Area']"}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'movement_origin'", 'to': "orm['machiavelli.Area']"}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'condottieri_events.newunitevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'NewUnitEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'condottieri_events.orderevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'OrderEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'conversion': ('django.db.models.fields.CharField', [], {'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']"}),
+            'destination': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'event_destination'", 'null': 'True', 'to': "orm['machiavelli.Area']"}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'event_origin'", 'to': "orm['machiavelli.Area']"}),
+            'subcode': ('django.db.models.fields.CharField', [], {'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'subconversion': ('django.db.models.fields.CharField', [], {'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'subdestination': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'event_subdestination'", 'null': 'True', 'to': "orm['machiavelli.Area']"}),
+            'suborigin': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'event_suborigin'", 'null': 'True', 'to': "orm['machiavelli.Area']"}),
+            'subtype': ('django.db.models.fields.CharField', [], {'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'condottieri_events.retreatevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'RetreatEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']", 'null': 'True', 'blank': 'True'}),
+            'destination': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'retreat_destination'", 'to': "orm['machiavelli.Area']"}),
+            'origin': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'retreat_origin'", 'to': "orm['machiavelli.Area']"}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'condottieri_events.standoffevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'StandoffEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'condottieri_events.unitevent': {
+            'Meta': {'ordering': "['-year', '-season', '-id']", 'object_name': 'UnitEvent', '_ormbases': ['condottieri_events.BaseEvent']},
+            'area': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Area']"}),
+            'baseevent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['condottieri_events.BaseEvent']", 'unique': 'True', 'primary_key': 'True'}),
+            'country': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Country']", 'null': 'True', 'blank': 'True'}),
+            'message': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'machiavelli.area': {
+            'Meta': {'ordering': "('code',)", 'object_name': 'Area'},
+            'borders': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'borders_rel_+'", 'to': "orm['machiavelli.Area']"}),
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '5'}),
+            'control_income': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'garrison_income': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'has_city': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'has_port': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_coast': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_fortified': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_sea': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'name': ('machiavelli.fields.AutoTranslateField', [], {'unique': 'True', 'max_length': '25'})
+        },
+        'machiavelli.country': {
+            'Meta': {'object_name': 'Country'},
+            'can_excommunicate': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'css_class': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '20'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('machiavelli.fields.AutoTranslateField', [], {'unique': 'True', 'max_length': '20'}),
+            'special_units': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['machiavelli.SpecialUnit']", 'symmetrical': 'False'}),
+            'static_name': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '20'})
+        },
+        'machiavelli.game': {
+            'Meta': {'object_name': 'Game'},
+            'cities_to_win': ('django.db.models.fields.PositiveIntegerField', [], {'default': '15'}),
+            'comment': ('django.db.models.fields.TextField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'created_by': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'fast': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_phase_change': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'map_outdated': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'phase': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0', 'null': 'True', 'blank': 'True'}),
+            'private': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'scenario': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['machiavelli.Scenario']"}),
+            'season': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'slots': ('django.db.models.fields.SmallIntegerField', [], {'default': '0'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '20'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'time_limit': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'visible': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'year': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'machiavelli.scenario': {
+            'Meta': {'object_name': 'Scenario'},
+            'cities_to_win': ('django.db.models.fields.PositiveIntegerField', [], {'default': '15'}),
+            'enabled': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '16'}),
+            'number_of_players': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'start_year': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'title': ('machiavelli.fields.AutoTranslateField', [], {'max_length': '128'})
+        },
+        'machiavelli.specialunit': {
+            'Meta': {'object_name': 'SpecialUnit'},
+            'cost': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'loyalty': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'power': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'static_title': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'title': ('machiavelli.fields.AutoTranslateField', [], {'max_length': '50'})
+        }
+    }
+
+    complete_apps = ['condottieri_events']
\ No newline at end of file
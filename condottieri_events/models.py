@@ -20,8 +20,12 @@
 
 """
 
+import threading
+
 ## django
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import Q
+from django.utils import simplejson
 from django.utils.translation import ugettext_lazy as _
 
 ## machiavelli
@@ -33,6 +37,10 @@ if "jogging" in settings.INSTALLED_APPS:
 else:
 	logging = None
 
+## EVENTS_BACKEND can be 'tables', to save each event in the table of its
+## class, or 'compact', to save all the events in the CompactEvent table
+EVENTS_BACKEND = getattr(settings, 'EVENTS_BACKEND', 'tables')
+
 
 class BaseEvent(models.Model):
 	"""
@@ -46,6 +54,9 @@ BaseEvent is the parent class for all kind of game events.
 	
 	def get_concrete(self):
 		""" Gets the name of the child class of this BaseEvent """
+		if not type(self) is BaseEvent:
+			## this is already a child event
+			return self
 		return self.__getattribute__(self.classname.lower())
 
 	def unit_string(self, type, area):
@@ -89,15 +100,214 @@ BaseEvent is the parent class for all kind of game events.
 		abstract = False
 		ordering = ['-year', '-season', '-id']
 
+## Area and Country objects, that never change, to render the compact events
+_board_cache = {}
+
+def get_board_object(model, id):
+	if not model in _board_cache:
+		_board_cache[model] = dict([(o.pk, o) for o in model.objects.all()])
+	return _board_cache[model].get(id)
+
+def encode_payload(event_class, fields):
+	""" Returns a compact string with the values of the child event fields.
+	Model instances are saved as their ids. """
+	payload = {}
+	for name, value in fields.items():
+		field = event_class._meta.get_field(name)
+		if isinstance(field, models.ForeignKey):
+			if value is not None:
+				value = value.pk
+		payload[field.attname] = value
+	return simplejson.dumps(payload, separators=(',', ':'))
+
+class CompactEvent(models.Model):
+	"""
+CompactEvent stores any kind of event in a single row, with the name of the
+event class and the values of its fields encoded in ``payload``. It has the
+same interface as BaseEvent, so it can be used by the same templates.
+	"""
+	game = models.ForeignKey(Game)
+	year = models.PositiveIntegerField()
+	season = models.PositiveIntegerField(choices=SEASONS)
+	phase = models.PositiveIntegerField(choices=GAME_PHASES)
+	classname = models.CharField(max_length=32, editable=False)
+	payload = models.TextField(default="")
+
+	class Meta:
+		ordering = ['-year', '-season', '-id']
+		## Django cannot define an index on several columns, but this
+		## constraint creates the index used to get the events of a season
+		unique_together = (('game', 'year', 'season', 'phase', 'id'),)
+
+	def get_concrete(self):
+		""" Returns an unsaved instance of the event class, with the values of
+		the payload. Areas and countries are taken from memory. """
+		if not hasattr(self, '_concrete'):
+			event_class = globals()[self.classname]
+			fields = {}
+			for attname, value in simplejson.loads(self.payload).items():
+				fields[str(attname)] = value
+			event = event_class(game_id=self.game_id, year=self.year,
+								season=self.season, phase=self.phase,
+								classname=self.classname, **fields)
+			for field in event_class._meta.fields:
+				if isinstance(field, models.ForeignKey) and field.rel.to in (Area, Country):
+					value = getattr(event, field.attname)
+					if value is not None:
+						setattr(event, field.get_cache_name(),
+								get_board_object(field.rel.to, value))
+			self._concrete = event
+		return self._concrete
+
+	def season_class(self):
+		return self.get_concrete().season_class()
+
+	def event_class(self):
+		return self.get_concrete().event_class()
+
+	def country_class(self):
+		return self.get_concrete().country_class()
+
+	def color_output(self):
+		return self.get_concrete().color_output()
+
+	def __unicode__(self):
+		return unicode(self.get_concrete())
+
+## events logged while a phase is being processed, that are saved together
+## when the processing ends
+_buffer = threading.local()
+
 def log_event(event_class, game, **kwargs):
-	""" Creates a new BaseEvent and its child event. """
+	""" Creates a new BaseEvent and its child event, or a CompactEvent. If
+	the phase of the game is being processed, the event is kept in the buffer.
+	"""
+	if getattr(_buffer, 'game_id', None) == game.pk:
+		_buffer.events.append((event_class, game, game.year, game.season,
+								game.phase, kwargs))
+		return
 	try:
-		event = event_class(game=game, year=game.year, season=game.season, phase=game.phase, **kwargs)
+		if EVENTS_BACKEND == 'compact':
+			classname = kwargs.pop('classname', event_class.__name__)
+			event = CompactEvent(game=game, year=game.year, season=game.season,
+								phase=game.phase, classname=classname,
+								payload=encode_payload(event_class, kwargs))
+		else:
+			event = event_class(game=game, year=game.year, season=game.season, phase=game.phase, **kwargs)
 		event.save()
 	except:
 		if logging:
 			logging.info("Error in log_event")
 
+def save_buffered_events(events):
+	""" Saves a list of buffered events in a single transaction. Compact
+	events are inserted with a single query. """
+	if EVENTS_BACKEND == 'compact':
+		values = []
+		for event_class, game, year, season, phase, kwargs in events:
+			classname = kwargs.pop('classname', event_class.__name__)
+			values.append((game.pk, year, season, phase, classname,
+							encode_payload(event_class, kwargs)))
+		qn = connection.ops.quote_name
+		sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(CompactEvent._meta.db_table),
+				", ".join([qn(c) for c in ('game_id', 'year', 'season', 'phase',
+											'classname', 'payload')]),
+				", ".join(["%s"] * 6))
+		cursor = connection.cursor()
+		cursor.executemany(sql, values)
+		transaction.set_dirty()
+	else:
+		for event_class, game, year, season, phase, kwargs in events:
+			event = event_class(game=game, year=year, season=season, phase=phase, **kwargs)
+			event.save()
+save_buffered_events = transaction.commit_on_success(save_buffered_events)
+
+def start_event_buffer(sender, **kwargs):
+	assert isinstance(sender, Game), "sender must be a Game"
+	_buffer.game_id = sender.pk
+	_buffer.events = []
+
+phase_processing_started.connect(start_event_buffer)
+
+def flush_event_buffer(sender, **kwargs):
+	assert isinstance(sender, Game), "sender must be a Game"
+	events = getattr(_buffer, 'events', [])
+	_buffer.game_id = None
+	_buffer.events = []
+	if events:
+		try:
+			save_buffered_events(events)
+		except:
+			if logging:
+				logging.info("Error saving %s buffered events" % len(events))
+
+## the events are saved before the new phase is saved and published, so that
+## the clients that reload the game see them
+phase_processed.connect(flush_event_buffer)
+## phases that end without results only need to clear the buffer
+phase_processing_finished.connect(flush_event_buffer)
+## the processing of a phase is not a single transaction, so the changes made
+## before a failure are kept, and so must be their events
+phase_processing_failed.connect(flush_event_buffer)
+
+def game_events(game):
+	""" Returns a queryset with the events of ``game`` in the configured
+	backend """
+	if EVENTS_BACKEND == 'compact':
+		return game.compactevent_set.all()
+	return game.baseevent_set.all()
+
+def _buffered_event_exists(event_class, game, **kwargs):
+	""" Returns True if an event of ``event_class`` with the given field
+	values is waiting in the buffer of ``game`` """
+	if getattr(_buffer, 'game_id', None) != game.pk:
+		return False
+	for buffered_class, g, year, season, phase, values in _buffer.events:
+		if buffered_class != event_class:
+			continue
+		found = True
+		for attname, value in kwargs.items():
+			if attname in values:
+				v = values[attname]
+			elif attname.endswith('_id') and attname[:-3] in values:
+				v = getattr(values[attname[:-3]], 'pk', None)
+			else:
+				v = None
+			if v != value:
+				found = False
+				break
+		if found:
+			return True
+	return False
+
+def event_exists(event_class, game, **kwargs):
+	""" Returns True if ``game`` has an event of ``event_class`` with the
+	given field values, either saved or in the buffer of the phase being
+	processed. Model instances must be given as ids, with the attribute names
+	of the fields (e.g. ``area_id``). """
+	if _buffered_event_exists(event_class, game, **kwargs):
+		return True
+	if EVENTS_BACKEND == 'compact':
+		## each value is looked for in the payload, as it is encoded by
+		## encode_payload and followed by the next field or the end of the
+		## payload, and the candidates are checked once decoded
+		events = game.compactevent_set.filter(classname=event_class.__name__)
+		for attname, value in kwargs.items():
+			fragment = simplejson.dumps({attname: value}, separators=(',', ':'))[1:-1]
+			events = events.filter(Q(payload__contains=fragment + ',') |
+								Q(payload__contains=fragment + '}'))
+		for event in events:
+			concrete = event.get_concrete()
+			found = True
+			for attname, value in kwargs.items():
+				if getattr(concrete, attname) != value:
+					found = False
+					break
+			if found:
+				return True
+		return False
+	return event_class.objects.filter(game=game, **kwargs).exists()
+
 class NewUnitEvent(BaseEvent):
 	""" Event triggered when a new unit is placed in the map. """
 
@@ -682,6 +892,11 @@ class IncomeEvent(BaseEvent):
 	""" Event triggered when a country receives income """
 	country = models.ForeignKey(Country)
 	ducats = models.PositiveIntegerField()
+	## ducats from each source of income
+	control = models.PositiveIntegerField(default=0)
+	occupation = models.PositiveIntegerField(default=0)
+	garrisons = models.PositiveIntegerField(default=0)
+	variable = models.PositiveIntegerField(default=0)
 
 	def event_class(self):
 		return "income-event"
@@ -694,10 +909,15 @@ class IncomeEvent(BaseEvent):
 
 def log_income(sender, **kwargs):
 	assert isinstance(sender, Player), "sender must be a Player"
+	breakdown = kwargs.get('breakdown') or {}
 	log_event(IncomeEvent, sender.game,
 					classname="IncomeEvent",
 					country=sender.country,
-					ducats=kwargs['ducats'])
+					ducats=kwargs['ducats'],
+					control=breakdown.get('control', 0),
+					occupation=breakdown.get('occupation', 0),
+					garrisons=breakdown.get('garrisons', 0),
+					variable=breakdown.get('variable', 0))
 
 income_raised.connect(log_income)
 
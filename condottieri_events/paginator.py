@@ -19,10 +19,19 @@
 """ This module defines a paginator, inspired on django.core.paginator, that
 paginates the Events by season and year.
 
+The events of a season never change once the season is over, so the paginator
+can keep the rendered list of events of past seasons in the cache.
 """
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
+## seconds that the rendered events of a past season are kept in the cache
+SEASON_CACHE_TIMEOUT = getattr(settings, 'SEASON_CACHE_TIMEOUT', 30*24*60*60)
+
 SEASONS = {
 	1: _('Spring'),
 	2: _('Summer'),
@@ -30,6 +39,26 @@ SEASONS = {
 }
 
 
+def page_cache_key(cache_prefix, year, season, language):
+	return "%s_log-%s-%s-%s" % (cache_prefix, year, season, language)
+
+def clear_cache(cache_prefix, first, last):
+	""" Deletes the cached pages of the seasons from ``first`` to ``last``,
+	both (year, season) tuples, in all the languages of the site. It must be
+	called when the events of past seasons change (e.g. a game is restored
+	to a previous turn). """
+	keys = []
+	year, season = first
+	while (year, season) <= last:
+		for code, name in settings.LANGUAGES:
+			keys.append(page_cache_key(cache_prefix, year, season, code))
+		if season == 3:
+			year, season = year + 1, 1
+		else:
+			season += 1
+	if keys:
+		cache.delete_many(keys)
+
 class InvalidPage(Exception):
 	pass
 
@@ -46,10 +75,14 @@ class EmptyPage(InvalidPage):
 	pass
 
 class SeasonPaginator(object):
-	def __init__(self, object_list):
+	def __init__(self, object_list, cache_prefix=None, open_season=None):
+		""" If ``cache_prefix`` is given, the rendered pages are cached. Only
+		the pages older than ``open_season``, a (year, season) tuple, are
+		cached. If ``open_season`` is None, all the pages are cached. """
 		self.object_list = object_list
-		self._newest_year = self._oldest_year = None
-		self._newest_season = None
+		self.cache_prefix = cache_prefix
+		self.open_season = open_season
+		self._bounds = None
 		self._oldest_season = 1 ## oldest season is always spring
 
 	def validate_date(self, year, season):
@@ -79,39 +112,51 @@ class SeasonPaginator(object):
 		else:
 			year, season = self.validate_date(year, season)
 		object_list = self.object_list.filter(year=year, season=season)
-		if object_list.count() <= 0:
+		page = Page(object_list, year, season, self)
+		if not page.output():
 			raise EmptyPage('No events for this date.')
-		return Page(object_list, year, season, self)
+		return page
+
+	def cache_key(self, year, season):
+		""" Returns the cache key for the given page, or None if the page
+		must not be cached. """
+		if self.cache_prefix is None:
+			return None
+		if not self.open_season is None and (year, season) >= self.open_season:
+			return None
+		return page_cache_key(self.cache_prefix, year, season,
+							translation.get_language())
+
+	def _get_bounds(self):
+		""" Returns a tuple (newest year, newest season, oldest year) from a
+		single aggregate query. """
+		if self._bounds is None:
+			table = connection.ops.quote_name(self.object_list.model._meta.db_table)
+			bounds = self.object_list.order_by().extra(select={
+				'newest': 'MAX(%(t)s.year * 10 + %(t)s.season)' % {'t': table},
+				'oldest': 'MIN(%(t)s.year)' % {'t': table},
+				}).values('newest', 'oldest')[0]
+			if bounds['newest'] is None:
+				## there are no seasons yet
+				self._bounds = (None, None, None)
+			else:
+				newest = int(bounds['newest'])
+				self._bounds = (newest / 10, newest % 10, int(bounds['oldest']))
+		return self._bounds
 
 	def _get_newest_year(self):
 		""" Returns the most recent year in the events queryset """
-		if self._newest_year is None:
-			try:
-				self._newest_year = self.object_list[0].year
-			except IndexError:
-				pass
-		return self._newest_year
+		return self._get_bounds()[0]
 	newest_year = property(_get_newest_year)
 
 	def _get_oldest_year(self):
 		""" Returns the oldest year in the events queryset """
-		if self._oldest_year is None:
-			try:
-				self._oldest_year = self.object_list.reverse()[0].year
-			except IndexError:
-				pass
-		return self._oldest_year
+		return self._get_bounds()[2]
 	oldest_year = property(_get_oldest_year)
 
 	def _get_newest_season(self):
 		""" Returns the most recent season in the events queryset """
-		if self._newest_season is None:
-			try:
-				self._newest_season = self.object_list[0].season
-			except IndexError:
-				## there are no seasons yet
-				pass
-		return self._newest_season
+		return self._get_bounds()[1]
 	newest_season = property(_get_newest_season)
 
 	def _get_oldest_season(self):
@@ -119,6 +164,35 @@ class SeasonPaginator(object):
 		return self._oldest_season
 	oldest_season = property(_get_oldest_season)
 
+class ArchiveSeasonPaginator(SeasonPaginator):
+	""" Paginates a list of archived events, that are dictionaries with the
+	keys ``year``, ``season`` and ``output``, newest first. """
+
+	def page(self, year=None, season=None):
+		"Returns a Page object for the given year and season."
+		if year is None or season is None:
+			year = self.newest_year
+			season = self.newest_season
+		else:
+			year, season = self.validate_date(year, season)
+		output = u"".join([e['output'] for e in self.object_list
+							if e['year'] == year and e['season'] == season])
+		if not output:
+			raise EmptyPage('No events for this date.')
+		page = Page([], year, season, self)
+		page._output = output
+		return page
+
+	def _get_bounds(self):
+		if self._bounds is None:
+			if not self.object_list:
+				self._bounds = (None, None, None)
+			else:
+				newest = max([(e['year'], e['season']) for e in self.object_list])
+				oldest = min([e['year'] for e in self.object_list])
+				self._bounds = (newest[0], newest[1], oldest)
+		return self._bounds
+
 class Page(object):
 	def __init__(self, object_list, year, season, paginator):
 		self.object_list = object_list
@@ -129,10 +203,24 @@ class Page(object):
 			self.season_name = SEASONS[season]
 		else:
 			self.season_name = None
+		self._output = None
 
 	def __repr__(self):
 		return '<Page for %s %s>' % (self.year, self.season)
 
+	def output(self):
+		""" Returns the html list items of the events in the page, taking
+		them from the cache if the season is over. """
+		if self._output is None:
+			key = self.paginator.cache_key(self.year, self.season)
+			if key:
+				self._output = cache.get(key)
+			if self._output is None:
+				self._output = u"".join([e.color_output() for e in self.object_list])
+				if key and self._output:
+					cache.set(key, self._output, SEASON_CACHE_TIMEOUT)
+		return self._output
+
 	def has_next(self):
 		if self.year > self.paginator.oldest_year:
 			return True
@@ -21,7 +21,8 @@ from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 
 from messages import models as messages
-from machiavelli.models import Player, SEASONS
+from machiavelli.models import Player, SEASONS, touch_game_state
+from machiavelli.broker import publish
 from machiavelli.signals import government_overthrown
 
 if "notification" in settings.INSTALLED_APPS:
@@ -55,6 +56,20 @@ def notify_new_letter(sender, instance, created, **kw):
 
 models.signals.post_save.connect(notify_new_letter, sender=Letter)
 
+def touch_game_state_on_letter(sender, instance, created, **kw):
+	""" A new letter changes the game page of the recipient """
+	if isinstance(instance, Letter) and created:
+		touch_game_state(instance.recipient_player.game_id)
+
+models.signals.post_save.connect(touch_game_state_on_letter, sender=Letter)
+
+def publish_new_letter(sender, instance, created, **kw):
+	if isinstance(instance, Letter) and created:
+		publish(instance.recipient_player.game_id, "letter",
+				recipient_id=instance.recipient_id)
+
+models.signals.post_save.connect(publish_new_letter, sender=Letter)
+
 def update_letter_users(sender, **kwargs):
 	assert isinstance(sender, Player), "sender must be a Player"
 	Letter.objects.filter(sender_player=sender).update(sender=sender.user)
@@ -11,3 +11,9 @@ class CondottieriProfileAdmin(admin.ModelAdmin):
 	inlines = [SpokenLanguageInline, ]
 
 admin.site.register(CondottieriProfile, CondottieriProfileAdmin)
+
+class KarmaChangeAdmin(admin.ModelAdmin):
+	list_display = ('profile', 'delta', 'reason', 'created_at')
+	list_filter = ('reason',)
+
+admin.site.register(KarmaChange, KarmaChangeAdmin)
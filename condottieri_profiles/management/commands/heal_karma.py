@@ -1,6 +1,5 @@
 from django.core.management.base import NoArgsCommand, CommandError
 from django.conf import settings
-from django.db.models import F
 
 from jogging import logging
 
@@ -19,14 +18,9 @@ join a game.
 	help = 'This command heals the users that have less than the minimum karma to join a game.'
 
 	def handle_noargs(self, **options):
-		to_heal = models.CondottieriProfile.objects.filter(karma__lt=settings.KARMA_TO_JOIN)
-		for profile in to_heal:
-			profile.karma += 2
-			profile.save()
-			if profile.karma >= settings.KARMA_TO_JOIN:
-				if notification:
-					notification.send([profile.user,], "karma_healed", {}, True)
-		msg = "Healed karma to %s users" % len(to_heal)
-		if len(to_heal) > 0:
+		count, healed = models.CondottieriProfile.objects.heal_karma(2, settings.KARMA_TO_JOIN)
+		if notification and len(healed) > 0:
+			notification.queue(healed, "karma_healed", {}, True)
+		msg = "Healed karma to %s users" % count
+		if count > 0:
 			logging.info(msg)
-		
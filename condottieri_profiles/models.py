@@ -21,8 +21,11 @@ profiles hold more information related to the game, such as scores, and karma.
 
 """
 
-from django.db import models
+from datetime import datetime
+
+from django.db import models, connection, transaction
 from django.db.models.signals import post_save
+from django.dispatch import Signal
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
@@ -39,6 +42,61 @@ KARMA_MAXIMUM = getattr(settings, 'KARMA_MAXIMUM', 200)
 BONUS_TIME = getattr(settings, 'BONUS_TIME', 0.2)
 KARMA_TO_JOIN = getattr(settings, 'KARMA_TO_JOIN', 50)
 
+## karma_adjusted is sent by a CondottieriProfile when its karma changes
+karma_adjusted = Signal(providing_args=["delta"])
+
+class CondottieriProfileManager(models.Manager):
+	def _adjust_karma(self, where, params, k, reason):
+		""" Adds ``k`` karma to the profiles matching the sql ``where``
+		condition, keeping it between KARMA_MINIMUM and KARMA_MAXIMUM, and
+		records the change for each profile. Both things are done with a
+		single query each, so concurrent changes are never lost. """
+		qn = connection.ops.quote_name
+		table = qn(self.model._meta.db_table)
+		karma = qn('karma')
+		cursor = connection.cursor()
+		cursor.execute("INSERT INTO %s (%s, %s, %s, %s) SELECT %s, %%s, %%s, %%s FROM %s WHERE %s" % (
+				qn(KarmaChange._meta.db_table), qn('profile_id'), qn('delta'),
+				qn('reason'), qn('created_at'), qn('id'), table, where),
+				[k, reason, connection.ops.value_to_db_datetime(datetime.now())] + params)
+		cursor.execute("UPDATE %(t)s SET %(k)s = CASE WHEN %(k)s + %%s > %%s THEN %%s WHEN %(k)s + %%s < %%s THEN %%s ELSE %(k)s + %%s END WHERE %(w)s" % {
+				't': table, 'k': karma, 'w': where},
+				[k, KARMA_MAXIMUM, KARMA_MAXIMUM, k, KARMA_MINIMUM, KARMA_MINIMUM, k] + params)
+		transaction.set_dirty()
+		return cursor.rowcount
+
+	def adjust_karma(self, ids, k, reason=''):
+		""" Adds or substracts some karma to the profiles with the given ids """
+		if not ids:
+			return 0
+		where = "%s IN (%s)" % (connection.ops.quote_name('id'), ", ".join(["%s"] * len(ids)))
+		return self._adjust_karma(where, list(ids), k, reason)
+	adjust_karma = transaction.commit_on_success(adjust_karma)
+
+	def adjust_user_karma(self, user_ids, k, reason=''):
+		""" Adds or substracts some karma to the profiles of the users with
+		the given ids, with a single query for all of them, and sends
+		``karma_adjusted`` for each profile """
+		if not user_ids:
+			return 0
+		where = "%s IN (%s)" % (connection.ops.quote_name('user_id'),
+								", ".join(["%s"] * len(user_ids)))
+		count = self._adjust_karma(where, list(user_ids), k, reason)
+		for profile in self.filter(user__id__in=user_ids):
+			karma_adjusted.send(sender=profile, delta=k)
+		return count
+	adjust_user_karma = transaction.commit_on_success(adjust_user_karma)
+
+	def heal_karma(self, k, threshold=KARMA_TO_JOIN):
+		""" Adds ``k`` karma to all the profiles below ``threshold``. Returns a
+		tuple with the number of healed profiles and the list of users that
+		reach the threshold. """
+		healed = list(self.filter(karma__lt=threshold, karma__gte=threshold - k).values_list('user', flat=True))
+		where = "%s < %%s" % connection.ops.quote_name('karma')
+		count = self._adjust_karma(where, [threshold], k, 'heal')
+		return count, User.objects.filter(id__in=healed)
+	heal_karma = transaction.commit_on_success(heal_karma)
+
 
 class CondottieriProfile(models.Model):
 	""" Defines the actual profile for a Condottieri user.
@@ -62,6 +120,8 @@ class CondottieriProfile(models.Model):
 	overthrows = models.PositiveIntegerField(default=0, editable=False)
 	""" Number of times that the player has been overthrown """
 
+	objects = CondottieriProfileManager()
+
 	def __unicode__(self):
 		return self.user.username
 
@@ -87,17 +147,13 @@ class CondottieriProfile(models.Model):
 		else:	
 			return 0
 	
-	def adjust_karma(self, k):
+	def adjust_karma(self, k, reason=''):
 		""" Adds or substracts some karma to the total """
 		if not isinstance(k, int):
 			return
-		new_karma = self.karma + k
-		if new_karma > KARMA_MAXIMUM:
-			new_karma = KARMA_MAXIMUM
-		elif new_karma < KARMA_MINIMUM:
-			new_karma = KARMA_MINIMUM
-		self.karma = new_karma
-		self.save()
+		CondottieriProfile.objects.adjust_karma([self.pk], k, reason)
+		self.karma = CondottieriProfile.objects.filter(pk=self.pk).values_list('karma', flat=True)[0]
+		karma_adjusted.send(sender=self, delta=k)
 
 	def overthrow(self):
 		""" Add 1 to the overthrows counter of the profile """
@@ -119,6 +175,20 @@ def create_profile(sender, instance=None, **kwargs):
 
 post_save.connect(create_profile, sender=User)
 
+class KarmaChange(models.Model):
+	""" Records each change in the karma of a profile """
+	profile = models.ForeignKey(CondottieriProfile)
+	delta = models.IntegerField()
+	""" Karma added or substracted, before limiting the total """
+	reason = models.CharField(max_length=20, blank=True, default='')
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		ordering = ['-created_at',]
+
+	def __unicode__(self):
+		return "%s: %s (%s)" % (self.profile, self.delta, self.reason)
+
 class SpokenLanguage(models.Model):
 	""" Defines a language that a User understands """
 	code = models.CharField(_("language"), max_length=8, choices=global_settings.LANGUAGES)
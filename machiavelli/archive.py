@@ -0,0 +1,249 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module moves finished games to cold storage.
+
+Each archived game is saved in a single zip file, with the results, the
+events, the turn logs and the final map. The events are rendered in each of
+the site languages, and each language is stored in its own member, so that
+a view only reads and parses the members that it shows. Once the file is
+written, the events and turn logs of the game are deleted from the database.
+The views read the archive instead of the tables when a game has been
+archived.
+
+The members of the archive are:
+
+* ``game.json``: the archive version, the game and its scores.
+* ``events.json``: the class and the field values of each event.
+* ``events-<language>.json``: the output of the events in a language.
+* ``turnlogs.json``: the turn logs.
+* ``map.png``: the final map, if it exists.
+
+Games archived by older versions, in a gzipped JSON file, can still be read.
+"""
+
+import base64
+import gzip
+import os
+import zipfile
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import simplejson, translation
+
+from machiavelli.graphics import MAPSDIR
+
+ARCHIVE_DIR = getattr(settings, 'GAME_ARCHIVE_DIR',
+					os.path.join(settings.PROJECT_ROOT, 'machiavelli/media/machiavelli/archive'))
+
+## the archive format version, in case it has to change
+ARCHIVE_VERSION = 2
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def archive_path(game_id):
+	return os.path.join(ARCHIVE_DIR, "game-%s.zip" % game_id)
+
+def legacy_archive_path(game_id):
+	""" Path of the archives written by the version 1 of the format """
+	return os.path.join(ARCHIVE_DIR, "game-%s.json.gz" % game_id)
+
+def is_archived(game):
+	""" Returns True if ``game`` has been archived """
+	return os.path.exists(archive_path(game.pk)) or \
+		os.path.exists(legacy_archive_path(game.pk))
+
+def event_fields(event):
+	""" Returns a dictionary with the field values of an event """
+	fields = {}
+	for f in event._meta.fields:
+		fields[f.attname] = f.value_to_string(event)
+	return fields
+
+def serialize_game(game):
+	""" Returns a dictionary {member name: content} with all the data to be
+	archived """
+	members = {}
+	info = {
+		'version': ARCHIVE_VERSION,
+		'game': {
+			'id': game.pk,
+			'slug': game.slug,
+			'scenario': game.scenario_id,
+			'year': game.year,
+			'season': game.season,
+			'started': game.started and game.started.strftime(TIMESTAMP_FORMAT),
+			'finished': game.finished and game.finished.strftime(TIMESTAMP_FORMAT),
+		},
+		'scores': [],
+	}
+	for s in game.score_set.all():
+		info['scores'].append({'user': s.user_id,
+							'country': s.country_id,
+							'points': s.points,
+							'cities': s.cities,
+							'position': s.position})
+	members['game.json'] = simplejson.dumps(info)
+	## the events are rendered in every language, so that reading them does
+	## not need the event tables
+	languages = [code for code, name in settings.LANGUAGES]
+	current = translation.get_language()
+	events = []
+	outputs = dict([(code, []) for code in languages])
+	from condottieri_events.models import game_events
+	for event in game_events(game):
+		concrete = event.get_concrete()
+		events.append({'year': event.year,
+					'season': event.season,
+					'phase': event.phase,
+					'classname': event.classname,
+					'fields': event_fields(concrete)})
+		for code in languages:
+			translation.activate(code)
+			outputs[code].append({'year': event.year,
+								'season': event.season,
+								'phase': event.phase,
+								'output': event.color_output()})
+	translation.activate(current)
+	members['events.json'] = simplejson.dumps(events)
+	for code in languages:
+		members['events-%s.json' % code] = simplejson.dumps(outputs[code])
+	turnlogs = []
+	for log in game.turnlog_set.all():
+		turnlogs.append({'year': log.year,
+						'season': log.season,
+						'phase': log.phase,
+						'timestamp': log.timestamp.strftime(TIMESTAMP_FORMAT),
+						'log': log.log})
+	members['turnlogs.json'] = simplejson.dumps(turnlogs)
+	map_path = os.path.join(MAPSDIR, "map-%s.png" % game.pk)
+	if os.path.exists(map_path):
+		fd = open(map_path, 'rb')
+		members['map.png'] = fd.read()
+		fd.close()
+	return members
+
+def archive_game(game):
+	""" Writes the archive of a finished game and deletes its events and turn
+	logs. Returns the path of the archive. """
+	members = serialize_game(game)
+	if not os.path.isdir(ARCHIVE_DIR):
+		os.makedirs(ARCHIVE_DIR)
+	path = archive_path(game.pk)
+	## write to a temporary file first, so that an archive is never partial
+	tmp_path = "%s.tmp" % path
+	zf = zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED)
+	try:
+		for name in sorted(members.keys()):
+			if name.endswith('.png'):
+				## the map is already compressed
+				zf.writestr(zipfile.ZipInfo(name), members[name])
+			else:
+				zf.writestr(name, members[name])
+	finally:
+		zf.close()
+	os.rename(tmp_path, path)
+	delete_hot_rows(game)
+	return path
+
+def delete_hot_rows(game):
+	game.baseevent_set.all().delete()
+	game.compactevent_set.all().delete()
+	game.turnlog_set.all().delete()
+	game.liveevent_set.all().delete()
+delete_hot_rows = transaction.commit_on_success(delete_hot_rows)
+
+def read_member(game, name):
+	""" Returns the content of the member ``name`` of the archive of
+	``game``, or None if the game is not archived or the member does not
+	exist """
+	try:
+		zf = zipfile.ZipFile(archive_path(game.pk), 'r')
+	except IOError:
+		return None
+	try:
+		try:
+			return zf.read(name)
+		except KeyError:
+			return None
+	finally:
+		zf.close()
+
+def load_legacy_archive(game):
+	""" Returns the data of a version 1 archive, or None """
+	try:
+		fd = gzip.open(legacy_archive_path(game.pk), 'rb')
+	except IOError:
+		return None
+	try:
+		return simplejson.load(fd)
+	finally:
+		fd.close()
+
+def get_events(game):
+	""" Returns the list of archived events, newest first, with their output
+	in the active language, or None if the game is not archived. """
+	language = translation.get_language()
+	default = settings.LANGUAGE_CODE
+	for code in (language, default):
+		content = read_member(game, 'events-%s.json' % code)
+		if content is not None:
+			return simplejson.loads(content)
+	legacy = load_legacy_archive(game)
+	if legacy is None:
+		return None
+	events = []
+	for e in legacy['events']:
+		output = e['output'].get(language, e['output'].get(default, u""))
+		events.append({'year': e['year'],
+					'season': e['season'],
+					'phase': e['phase'],
+					'output': output})
+	return events
+
+def get_turnlogs(game):
+	""" Returns a list of unsaved TurnLog objects with the archived logs, or
+	None if the game is not archived """
+	from machiavelli.models import TurnLog
+	content = read_member(game, 'turnlogs.json')
+	if content is not None:
+		turnlogs = simplejson.loads(content)
+	else:
+		legacy = load_legacy_archive(game)
+		if legacy is None:
+			return None
+		turnlogs = legacy['turnlogs']
+	logs = []
+	for l in turnlogs:
+		logs.append(TurnLog(year=l['year'],
+							season=l['season'],
+							phase=l['phase'],
+							timestamp=datetime.strptime(l['timestamp'], TIMESTAMP_FORMAT),
+							log=l['log']))
+	return logs
+
+def get_map(game):
+	""" Returns the archived map image, or None """
+	content = read_member(game, 'map.png')
+	if content is not None:
+		return content
+	legacy = load_legacy_archive(game)
+	if legacy is None or legacy['map'] is None:
+		return None
+	return base64.b64decode(legacy['map'])
@@ -0,0 +1,306 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module checks the adjudication against a corpus of recorded board
+positions.
+
+Each case of the corpus is a JSON file in ``BENCHMARK_DIR`` with a board
+position at the beginning of an orders phase (the units, the control of the
+areas and the players, in the format of ``machiavelli.snapshots``), the
+orders given in that phase, the dice rolled, the events that the
+adjudication logged and a budget of database queries for each step of
+``Game.process_orders``. The budgets count queries instead of time, so that
+a case gives the same result in any host with the same ``TRACE_LEVEL`` (the
+trace of the adjudication makes its own queries).
+
+Some cases are built by hand to cover the rules of the adjudication
+(standoffs, convoys, sieges, conditioned invasions...). Other cases are
+recorded from real games with ``record_case``, that replays the turn with
+``machiavelli.replay`` and only saves it if the replay gives the recorded
+result. ``run_case`` loads a case in the replay database, that is built from
+the board fixtures, processes the orders and compares the events and the
+queries of each step with the case. A case without a budget for a step is
+not checked for it; ``update_budget`` sets the budgets of a case from a run.
+
+The events are compared in English, so the corpus does not depend on the
+language of the site.
+"""
+
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import simplejson, translation
+
+import machiavelli.dice as dice
+import machiavelli.replay as replay
+import machiavelli.snapshots as snapshots
+import machiavelli.timing as timing
+
+BENCHMARK_DIR = getattr(settings, 'BENCHMARK_DIR',
+					os.path.join(os.path.dirname(__file__), 'benchmarks'))
+## the budget of a step is the number of recorded queries multiplied by this
+## factor...
+BENCHMARK_BUDGET_FACTOR = getattr(settings, 'BENCHMARK_BUDGET_FACTOR', 1.5)
+## ...but at least this number of queries over the recorded ones
+BENCHMARK_BUDGET_SLACK = getattr(settings, 'BENCHMARK_BUDGET_SLACK', 5)
+
+## the board fixtures loaded in the benchmark database
+FIXTURES = ('countries', 'areas', 'scenarios')
+## id of the game used to run the cases
+GAME_ID = 1
+
+CASE_VERSION = 1
+
+ORDER_FIELDS = ('unit', 'code', 'destination', 'type', 'subunit', 'subcode',
+				'subdestination', 'subtype', 'player')
+CONFIGURATION_FIELDS = ('strategic', 'conquering', 'excommunication')
+
+def case_path(name):
+	return os.path.join(BENCHMARK_DIR, "%s.json" % name)
+
+def list_cases():
+	""" Returns the sorted names of the cases in the corpus """
+	if not os.path.isdir(BENCHMARK_DIR):
+		return []
+	names = [f[:-5] for f in os.listdir(BENCHMARK_DIR) if f.endswith('.json')]
+	names.sort()
+	return names
+
+def load_case(name):
+	fd = open(case_path(name), 'r')
+	try:
+		return simplejson.load(fd)
+	finally:
+		fd.close()
+
+def save_case(case):
+	if not os.path.isdir(BENCHMARK_DIR):
+		os.makedirs(BENCHMARK_DIR)
+	fd = open(case_path(case['name']), 'w')
+	try:
+		simplejson.dump(case, fd, indent=1, sort_keys=True, separators=(',', ': '))
+	finally:
+		fd.close()
+
+def step_queries(recorder):
+	""" Returns a dictionary with the queries made in each step """
+	steps = {}
+	for step, elapsed, queries in recorder.records:
+		steps[step] = steps.get(step, 0) + queries
+	return steps
+
+def make_budget(steps):
+	budget = {}
+	for step, queries in steps.items():
+		budget[step] = max(int(queries * BENCHMARK_BUDGET_FACTOR),
+						queries + BENCHMARK_BUDGET_SLACK)
+	return budget
+
+class CaseResult(object):
+	def __init__(self, name):
+		self.name = name
+		self.missing = []
+		self.unexpected = []
+		## list of tuples (step, queries, budget)
+		self.over_budget = []
+		self.steps = {}
+
+	def ok(self):
+		return not (self.missing or self.unexpected or self.over_budget)
+
+class CaseRecorder(replay.ReplayEngine):
+	""" Replays a turn of a game and keeps the position, the orders and the
+	queries of the steps """
+	def before_processing(self, game, rolls):
+		from machiavelli.models import Order
+		self.state = snapshots.capture(game)
+		self.orders = []
+		for values in Order.objects.filter(player__game=game).values_list(
+										'unit', 'code', 'destination__board_area__code',
+										'type', 'subunit', 'subcode',
+										'subdestination__board_area__code', 'subtype',
+										'player'):
+			self.orders.append(dict(zip(ORDER_FIELDS, values)))
+		self.rolls = rolls or ""
+
+	def process(self, game):
+		timing.start(game, force=True)
+		try:
+			game.process_orders()
+		finally:
+			self.recorder = timing.finish(save=False)
+
+def record_case(game, year, season, name):
+	""" Records the orders phase of (``year``, ``season``) in ``game`` as the
+	case ``name``. Returns the saved case. Raises ``ReplayError`` if the
+	replay does not give the recorded result. """
+	current = translation.get_language()
+	translation.activate('en')
+	try:
+		engine = CaseRecorder(game)
+		engine.setup()
+		result = engine.replay_turn(year, season)
+		if result is None:
+			raise replay.ReplayError("There are no orders in %s, season %s" % (year, season))
+		if not result.ok():
+			raise replay.ReplayError("The replay of %s, season %s does not match the recorded events" % (year, season))
+		engine.activate()
+		try:
+			from condottieri_events.models import game_events
+			from machiavelli.models import PHORDERS
+			events = game_events(engine.game).filter(year=year, season=season, phase=PHORDERS)
+			expected = replay.outcome(events)
+		finally:
+			engine.deactivate()
+	finally:
+		translation.activate(current)
+	config = game.configuration
+	case = {
+		'version': CASE_VERSION,
+		'name': name,
+		'source': game.slug,
+		'scenario': game.scenario.name,
+		'configuration': dict([(f, getattr(config, f)) for f in CONFIGURATION_FIELDS]),
+		'year': year,
+		'season': season,
+		'state': engine.state,
+		'orders': engine.orders,
+		'rolls': engine.rolls,
+		'expected': expected,
+		'budget': make_budget(step_queries(engine.recorder)),
+	}
+	save_case(case)
+	return case
+
+def setup_database():
+	""" Creates the tables of the replay database and loads the board
+	fixtures """
+	if not replay.REPLAY_DB in settings.DATABASES:
+		raise replay.ReplayError("The database '%s' is not defined" % replay.REPLAY_DB)
+	options = {'database': replay.REPLAY_DB, 'interactive': False, 'verbosity': 0}
+	if 'south' in settings.INSTALLED_APPS:
+		options['migrate_all'] = True
+	call_command('syncdb', **options)
+	call_command('loaddata', *FIXTURES, **{'database': replay.REPLAY_DB, 'verbosity': 0})
+
+class CaseRunner(replay.ReplayEngine):
+	""" Loads a case in the replay database and processes its orders """
+	def __init__(self, case):
+		self.case = case
+		self.source = None
+
+	def setup(self):
+		from machiavelli.models import (Game, GameArea, Player, Order, Area, Scenario,
+										PHORDERS, TIME_LIMITS)
+		case = self.case
+		Game.objects.filter(id=GAME_ID).delete()
+		scenario = Scenario.objects.get(name=case['scenario'])
+		users = {}
+		countries = {}
+		for id, values in case['state']['players'].items():
+			country = snapshots.player_values(values)['country']
+			countries[id] = country
+			if country is not None:
+				username = "benchmark-%s" % country
+				try:
+					users[id] = User.objects.get(username=username)
+				except User.DoesNotExist:
+					users[id] = User.objects.create_user(username, "%s@example.com" % username)
+		game = Game(id=GAME_ID, slug="benchmark", scenario=scenario,
+					created_by=users.values()[0], year=case['year'],
+					season=case['season'], phase=PHORDERS,
+					time_limit=TIME_LIMITS[0][0])
+		game.save()
+		config = game.configuration
+		for field, value in case['configuration'].items():
+			setattr(config, str(field), value)
+		config.save()
+		for id, country in countries.items():
+			Player(id=int(id), game=game, user=users.get(id), country_id=country,
+				done=True).save()
+		game.copy_country_data()
+		for a in Area.objects.filter(code__in=case['state']['areas'].keys()):
+			GameArea(game=game, board_area=a).save()
+		self.game = game
+		self.areas = dict([(a.board_area.code, a) for a in
+						game.gamearea_set.select_related('board_area')])
+		self.load_state(case['state'])
+		for o in case['orders']:
+			order = Order(unit_id=o['unit'], code=o['code'], type=o['type'],
+						subunit_id=o['subunit'], subcode=o['subcode'],
+						subtype=o['subtype'], player_id=o['player'], confirmed=True)
+			if o['destination']:
+				order.destination = self.areas[o['destination']]
+			if o['subdestination']:
+				order.subdestination = self.areas[o['subdestination']]
+			order.save()
+
+	def run(self):
+		""" Processes the orders of the case and returns a ``CaseResult`` """
+		from condottieri_events.models import game_events
+		from machiavelli.models import PHORDERS
+		case = self.case
+		result = CaseResult(case['name'])
+		current = translation.get_language()
+		translation.activate('en')
+		self.activate()
+		try:
+			self.setup()
+			dice.start(dice.DiceStream(replay=dice.decode(case['rolls'])))
+			timing.start(self.game, force=True)
+			try:
+				self.game.process_orders()
+			finally:
+				recorder = timing.finish(save=False)
+				dice.stop()
+			events = game_events(self.game).filter(year=case['year'],
+								season=case['season'], phase=PHORDERS)
+			got = replay.outcome(events)
+		finally:
+			self.deactivate()
+			translation.activate(current)
+		for e in case['expected']:
+			e = tuple(e)
+			if e in got:
+				got.remove(e)
+			else:
+				result.missing.append(e)
+		result.unexpected = got
+		result.steps = step_queries(recorder)
+		for step, budget in sorted(case['budget'].items()):
+			queries = result.steps.get(step, 0)
+			if queries > budget:
+				result.over_budget.append((step, queries, budget))
+		return result
+
+def run_case(name):
+	return CaseRunner(load_case(name)).run()
+
+def update_budget(name):
+	""" Runs the case ``name`` and saves the budgets of its steps from the
+	queries of the run. Returns the ``CaseResult``. The case is not changed
+	if the events do not match. """
+	case = load_case(name)
+	result = CaseRunner(case).run()
+	if not (result.missing or result.unexpected):
+		case['budget'] = make_budget(result.steps)
+		save_case(case)
+		result.over_budget = []
+	return result
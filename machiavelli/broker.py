@@ -0,0 +1,233 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module defines the publish/subscribe brokers that carry the live
+events of a game (a player ends the phase, the phase changes, the map is
+ready, a new whisper or letter arrives) to the ``live_events`` view.
+
+The broker is chosen with the setting ``MACHIAVELLI_BROKER``, that is the
+dotted path of a ``BaseBroker`` subclass. Two brokers are provided:
+
+* ``DatabaseBroker`` stores the events in the ``LiveEvent`` table, so it works
+  with any number of server processes. This is the default.
+
+* ``LocalBroker`` keeps the events in memory. It does not hit the database,
+  but it only works if the site is served by a single process.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q, Max
+from django.utils import simplejson
+from django.utils.importlib import import_module
+
+## seconds that a request waits for new events before returning
+LIVE_EVENTS_TIMEOUT = getattr(settings, 'LIVE_EVENTS_TIMEOUT', 20)
+## seconds between two queries of a polling broker. The interval doubles while
+## there are no events, up to LIVE_EVENTS_MAX_POLL seconds
+LIVE_EVENTS_POLL = getattr(settings, 'LIVE_EVENTS_POLL', 1)
+LIVE_EVENTS_MAX_POLL = getattr(settings, 'LIVE_EVENTS_MAX_POLL', 8)
+## seconds that a browser waits before asking again for the events of a
+## polling broker
+LIVE_EVENTS_RETRY = getattr(settings, 'LIVE_EVENTS_RETRY', 15)
+## seconds that an event is kept
+LIVE_EVENTS_TTL = getattr(settings, 'LIVE_EVENTS_TTL', 60*60)
+
+class BaseBroker(object):
+	""" Base class for the brokers. Events are dictionaries with the keys
+	``id``, ``kind`` and ``data``. Ids grow with each event, so that a client
+	only has to remember the last id it has received. """
+
+	## True if ``wait`` is woken up by the new events. Otherwise, it polls
+	## the storage of the events, and requests should not wait with it.
+	can_wait = False
+
+	def publish(self, game_id, kind, data=None, recipient_id=None):
+		""" Publishes an event for a game. If ``recipient_id`` is given, only
+		that user will receive the event. """
+		raise NotImplementedError
+
+	def fetch(self, game_id, last_id, user_id=None):
+		""" Returns a list with the events of the game newer than ``last_id``
+		that can be seen by the user ``user_id``. """
+		raise NotImplementedError
+
+	def last_id(self, game_id):
+		""" Returns the id of the last event of the game, or 0. """
+		raise NotImplementedError
+
+	def purge(self, before):
+		""" Deletes the events published before the datetime ``before`` """
+		raise NotImplementedError
+
+	def wait(self, game_id, last_id, user_id=None, timeout=LIVE_EVENTS_TIMEOUT):
+		""" Returns the new events, waiting up to ``timeout`` seconds if there
+		are none yet. """
+		deadline = time.time() + timeout
+		poll = LIVE_EVENTS_POLL
+		while True:
+			events = self.fetch(game_id, last_id, user_id)
+			if events or time.time() >= deadline:
+				return events
+			time.sleep(min(poll, max(deadline - time.time(), 0)))
+			poll = min(poll * 2, LIVE_EVENTS_MAX_POLL)
+
+class DatabaseBroker(BaseBroker):
+	""" Broker that stores the events in the ``LiveEvent`` table """
+
+	def publish(self, game_id, kind, data=None, recipient_id=None):
+		from machiavelli.models import LiveEvent
+		LiveEvent.objects.create(game_id=game_id,
+								kind=kind,
+								recipient_id=recipient_id,
+								data=simplejson.dumps(data))
+
+	def fetch(self, game_id, last_id, user_id=None):
+		from machiavelli.models import LiveEvent
+		events = LiveEvent.objects.filter(game__id=game_id, id__gt=last_id)
+		if user_id:
+			events = events.filter(Q(recipient__isnull=True) | Q(recipient__id=user_id))
+		else:
+			events = events.filter(recipient__isnull=True)
+		result = []
+		for e in events.values('id', 'kind', 'data'):
+			e['data'] = simplejson.loads(e['data'])
+			result.append(e)
+		return result
+
+	def last_id(self, game_id):
+		from machiavelli.models import LiveEvent
+		last = LiveEvent.objects.filter(game__id=game_id).aggregate(Max('id'))['id__max']
+		return last or 0
+
+	def purge(self, before):
+		from machiavelli.models import LiveEvent
+		LiveEvent.objects.filter(created_at__lt=before).delete()
+
+	def wait(self, game_id, last_id, user_id=None, timeout=LIVE_EVENTS_TIMEOUT):
+		deadline = time.time() + timeout
+		poll = LIVE_EVENTS_POLL
+		while True:
+			events = self.fetch(game_id, last_id, user_id)
+			if events or time.time() >= deadline:
+				return events
+			## close the transaction, so that the next query sees the events
+			## commited by other processes
+			if transaction.is_managed():
+				transaction.commit()
+			time.sleep(min(poll, max(deadline - time.time(), 0)))
+			poll = min(poll * 2, LIVE_EVENTS_MAX_POLL)
+
+class LocalBroker(BaseBroker):
+	""" Broker that keeps the last events of each game in memory. Waiting
+	requests are woken up as soon as an event is published. """
+
+	## maximum number of events kept for each game
+	max_events = 100
+	can_wait = True
+
+	def __init__(self):
+		self._events = {}
+		self._counter = 0
+		self._condition = threading.Condition()
+
+	def publish(self, game_id, kind, data=None, recipient_id=None):
+		self._condition.acquire()
+		try:
+			self._counter += 1
+			events = self._events.setdefault(game_id, [])
+			events.append((self._counter, kind, data, recipient_id, datetime.now()))
+			del events[:-self.max_events]
+			self._condition.notifyAll()
+		finally:
+			self._condition.release()
+
+	def _fetch(self, game_id, last_id, user_id):
+		result = []
+		for (id, kind, data, recipient_id, created_at) in self._events.get(game_id, []):
+			if id > last_id and recipient_id in (None, user_id):
+				result.append({'id': id, 'kind': kind, 'data': data})
+		return result
+
+	def fetch(self, game_id, last_id, user_id=None):
+		self._condition.acquire()
+		try:
+			return self._fetch(game_id, last_id, user_id)
+		finally:
+			self._condition.release()
+
+	def last_id(self, game_id):
+		self._condition.acquire()
+		try:
+			events = self._events.get(game_id, [])
+			if events:
+				return events[-1][0]
+			return 0
+		finally:
+			self._condition.release()
+
+	def purge(self, before):
+		self._condition.acquire()
+		try:
+			for game_id, events in self._events.items():
+				events[:] = [e for e in events if e[4] >= before]
+				if not events:
+					del self._events[game_id]
+		finally:
+			self._condition.release()
+
+	def wait(self, game_id, last_id, user_id=None, timeout=LIVE_EVENTS_TIMEOUT):
+		deadline = time.time() + timeout
+		self._condition.acquire()
+		try:
+			while True:
+				events = self._fetch(game_id, last_id, user_id)
+				remaining = deadline - time.time()
+				if events or remaining <= 0:
+					return events
+				self._condition.wait(remaining)
+		finally:
+			self._condition.release()
+
+_broker = None
+
+def get_broker():
+	""" Returns the broker defined in ``settings.MACHIAVELLI_BROKER`` """
+	global _broker
+	if _broker is None:
+		path = getattr(settings, 'MACHIAVELLI_BROKER', 'machiavelli.broker.DatabaseBroker')
+		module, attr = path.rsplit('.', 1)
+		try:
+			broker_class = getattr(import_module(module), attr)
+		except (ImportError, AttributeError), e:
+			raise ImproperlyConfigured("Error loading broker %s: %s" % (path, e))
+		_broker = broker_class()
+	return _broker
+
+def publish(game_id, kind, data=None, recipient_id=None):
+	""" Publishes an event with the configured broker """
+	get_broker().publish(game_id, kind, data, recipient_id)
+
+def purge_old_events():
+	""" Deletes the events older than ``LIVE_EVENTS_TTL`` seconds """
+	get_broker().purge(datetime.now() - timedelta(seconds=LIVE_EVENTS_TTL))
@@ -16,18 +16,127 @@
 ##
 ## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
 
-from random import random, randint
+""" This module rolls the dice of the game.
+
+While a turn is processed, ``Game.all_players_done`` activates a
+``DiceStream`` for the game. The stream is seeded with a value that depends on
+the game and the turn, so that processing the same turn again gives the same
+rolls, and every roll is recorded in order. A stream can also replay a list of
+recorded rolls, to reproduce the adjudication of a turn exactly.
+
+When no stream is active, the dice are rolled with the global ``random``
+module.
+"""
+
+import random
+import threading
 from math import pow
 
+from machiavelli.exceptions import DiceReplayError
+
+_state = threading.local()
+
+class DiceStream(object):
+	""" A stream of six-sided dice. Each die is recorded in ``rolls``.
+
+	``seed`` is an integer or a hexadecimal string, like the ones returned by
+	``turn_seed``. If ``replay`` is a list of rolls, the dice are taken from
+	it instead of being rolled. When the recorded rolls run out, a ``strict``
+	stream raises ``DiceReplayError``, and a non-strict stream goes on rolling
+	the dice that its seed would have given. ``turn`` is an optional tuple that
+	identifies the turn of the stream. """
+
+	def __init__(self, seed=None, replay=None, turn=None, strict=True):
+		self.seed = seed
+		self.turn = turn
+		if isinstance(seed, basestring):
+			## a string would be seeded with hash(), that depends on the
+			## platform and on the hash randomization of the interpreter
+			seed = long(seed, 16)
+		self.random = random.Random(seed)
+		self.replay = replay
+		self.strict = strict
+		self.rolls = []
+
+	def roll(self, n=1):
+		""" Returns a list with ``n`` dice """
+		## the generator is always used, so that a stream that runs out of
+		## recorded rolls goes on with the dice of its seed
+		dice = [self.random.randint(1, 6) for i in range(n)]
+		if self.replay is not None:
+			start = len(self.rolls)
+			recorded = self.replay[start:start + n]
+			if len(recorded) < n and self.strict:
+				raise DiceReplayError("Only %s recorded rolls, %s were asked" % (len(self.replay),
+																			start + n))
+			dice[:len(recorded)] = recorded
+		self.rolls.extend(dice)
+		return dice
+
+	def randrange(self, n):
+		""" Returns an integer in [0, n), using the dice of the stream. Each
+		value of the result takes one die, rerolling values that would give
+		a biased result. """
+		value = 0
+		size = 1
+		while size < n:
+			d = self.roll()[0] - 1
+			value = value * 6 + d
+			size *= 6
+			if size >= n and value >= size - size % n:
+				## biased value, start again
+				value = 0
+				size = 1
+		return value % n
+
+	def encode(self):
+		""" Returns the recorded rolls as a string, with one digit per die """
+		return "".join([str(d) for d in self.rolls])
+
+def decode(rolls):
+	""" Returns a list of dice from a string returned by ``DiceStream.encode`` """
+	return [int(d) for d in rolls]
+
+def turn_seed(game_id, year, season, phase):
+	""" Returns the seed of the dice of a turn. It depends on the secret key
+	of the site, so that the players cannot guess the dice. """
+	from django.conf import settings
+	from django.utils.hashcompat import md5_constructor
+	return md5_constructor("%s-%s-%s-%s-%s" % (settings.SECRET_KEY, game_id,
+										year, season, phase)).hexdigest()
+
+def start(stream):
+	""" Makes ``stream`` the source of the dice in this thread """
+	_state.stream = stream
+
+def stop():
+	""" Stops using the active stream and returns it """
+	stream = getattr(_state, 'stream', None)
+	_state.stream = None
+	return stream
+
+def get_stream():
+	return getattr(_state, 'stream', None)
+
+def roll_dice(n):
+	""" Returns a list with ``n`` dice """
+	stream = get_stream()
+	if stream is not None:
+		return stream.roll(n)
+	return [random.randint(1, 6) for i in range(n)]
+
 def roll_1d6():
-	return randint(1, 6)
+	return roll_dice(1)[0]
 
 def roll_2d6():
-	return randint(1, 6) + randint(1, 6)
+	return sum(roll_dice(2))
 
 def check_one_six(dice=1):
+	""" Returns True if at least one of ``dice`` dice is a six """
 	assert isinstance(dice, int)
 	assert dice > 0
-	prob = 1. - pow(5./6., dice)
-	rand = random()
-	return rand <= prob
+	stream = get_stream()
+	if stream is None:
+		prob = 1. - pow(5./6., dice)
+		return random.random() <= prob
+	return 6 in stream.roll(dice)
@@ -16,12 +16,25 @@
 ##
 ## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
 
-""" This module defines two 2-dimension arrays, taken from Machiavelli(R),
+""" This module defines three 2-dimension arrays, taken from Machiavelli(R),
 to get random natural disasters. 
 
-The arrays are ``FAMINE_TABLE`` and ``PLAGUE_TABLE``.
+The arrays are ``FAMINE_TABLE``, ``PLAGUE_TABLE`` and ``STORM_TABLE``.
+
+When the module is imported, each table is compiled into an inverted index,
+that gives the set of area codes affected by each row and each column. The
+first time that the area ids are needed, the codes are translated to the ids
+of the board areas, so that a disaster can be applied with a single query.
+The ids of the board areas are shared by all the scenarios. Codes that are not
+found in the board are reported in the log.
 """
 
+from django.conf import settings
+
+if "jogging" in settings.INSTALLED_APPS:
+	from jogging import logging
+else:
+	logging = None
 
 from machiavelli import dice
 
@@ -91,32 +104,81 @@ def get_column(year):
 	else:
 		return False
 
-def get_provinces(table):
-	""" Returns a list of province codes that will be affected by a natural
-	disaster in the current season.
-	"""
-
+TABLES = {
+	'plague': PLAGUE_TABLE,
+	'famine': FAMINE_TABLE,
+	'storm': STORM_TABLE,
+}
+
+def build_index(table):
+	""" Returns a tuple (rows, columns), where each item is a list with the
+	set of codes in each row or column of ``table`` """
+	rows = []
+	for row in table:
+		rows.append(frozenset([code for code in row if code != '']))
+	columns = []
+	for c in range(len(table[0])):
+		columns.append(frozenset([row[c] for row in table if row[c] != '']))
+	return rows, columns
+
+INDEX = {}
+for name, table in TABLES.items():
+	INDEX[name] = build_index(table)
+
+## index of area ids, built from INDEX the first time it is needed
+_AREA_INDEX = {}
+## codes in the tables that are not in the board
+UNKNOWN_CODES = set()
+
+def compile_area_index():
+	""" Translates the codes of ``INDEX`` into board area ids """
+	from machiavelli.models import Area
+	registry = dict(Area.objects.values_list('code', 'id'))
+	for name, (rows, columns) in INDEX.items():
+		area_rows = []
+		area_columns = []
+		for codes, ids in ((rows, area_rows), (columns, area_columns)):
+			for c in codes:
+				found = []
+				for code in c:
+					if code in registry:
+						found.append(registry[code])
+					else:
+						UNKNOWN_CODES.add(code)
+				ids.append(frozenset(found))
+		_AREA_INDEX[name] = (area_rows, area_columns)
+	if UNKNOWN_CODES and logging:
+		logging.info("Disaster tables have codes not found in the board: %s" % ", ".join(sorted(UNKNOWN_CODES)))
+
+def roll():
+	""" Returns a tuple (row, column) with the rolls of a season. Each of them
+	may be False if no row or column is affected. """
 	year = get_year()
-	row = get_row(year)
-	column = get_column(year)
-	provinces = []
-	if row:	
-		for p in table[row]:
-			provinces.append(p)
+	return get_row(year), get_column(year)
+
+def get_codes(name, row, column):
+	""" Returns the set of codes affected by the rolls ``row`` and ``column``
+	in the table ``name`` """
+	rows, columns = INDEX[name]
+	codes = set()
+	if row:
+		codes |= rows[row]
 	if column:
-		for r in table:
-			provinces.append(r[column])
-	return provinces
-
-def get_plague():
-	""" A proxy function to call ``get_provinces`` with ``PLAGUE_TABLE``. """
-	return get_provinces(PLAGUE_TABLE)
-
-def get_famine():
-	""" A proxy function to call ``get_provinces`` with ``FAMINE_TABLE``. """
-	return get_provinces(FAMINE_TABLE)
-
-def get_storms():
-	""" A proxy function to call ``get_provinces`` with ``STORM_TABLE``. """
-	return get_provinces(STORM_TABLE)
-
+		codes |= columns[column]
+	return codes
+
+def get_area_ids(name, row=None, column=None):
+	""" Returns the set of board area ids affected by the rolls ``row`` and
+	``column`` in the table ``name``. If no rolls are given, they are rolled
+	now. """
+	if row is None and column is None:
+		row, column = roll()
+	if not _AREA_INDEX:
+		compile_area_index()
+	rows, columns = _AREA_INDEX[name]
+	ids = set()
+	if row:
+		ids |= rows[row]
+	if column:
+		ids |= columns[column]
+	return ids
@@ -28,3 +28,12 @@ class WrongUnitCount(Error):
 
 	pass
 
+
+class DiceReplayError(Error):
+	""" Raised when a replayed dice stream does not match the rolls that are
+	asked for.
+
+	For instance, the processing of the turn asks for more rolls than the
+	recorded ones. """
+
+	pass
@@ -0,0 +1,194 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module resolves the expenses of a phase.
+
+``ExpenseResolver`` loads all the expenses of the game with one query and
+resolves them in this order:
+
+1. Unconfirmed expenses are undone and the money returned to the players.
+
+2. Famine reliefs, pacified rebellions and new rebellions are applied.
+
+3. Bribes whose cost plus the counter-bribes on the same unit is greater than
+   the ducats spent fail.
+
+4. For each bribed unit, the highest bribe succeeds. If several bribes have
+   the same value, one of them is chosen with a random source seeded with the
+   game and the turn (or with the dice stream of the turn, if it is active),
+   so that the result can be reproduced.
+
+5. Disbands, purchases and conversions to autonomous are written with one
+   query for each kind.
+"""
+
+import operator
+import random
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q
+
+if "jogging" in settings.INSTALLED_APPS:
+	from jogging import logging
+else:
+	logging = None
+
+if "condottieri_events" in settings.INSTALLED_APPS:
+	import machiavelli.signals as signals
+else:
+	signals = None
+
+from machiavelli.income import add_ducats
+import machiavelli.dice as dice
+
+BRIBES = (5, 6, 7, 8, 9)
+DISBAND = (5, 8)
+BUY = (6, 9)
+TO_AUTONOMOUS = (7,)
+
+class ExpenseResolver(object):
+	def __init__(self, game, seed=None):
+		self.game = game
+		## ties are decided with the dice stream of the turn, if there is one
+		self.stream = dice.get_stream()
+		if seed is None:
+			seed = long(dice.turn_seed(game.pk, game.year, game.season, game.phase), 16)
+		self.random = random.Random(seed)
+
+	def load(self):
+		""" Loads all the expenses of the game """
+		from machiavelli.models import Expense
+		self.expenses = list(Expense.objects.filter(player__game=self.game).select_related('player',
+					'player__country', 'area', 'area__board_area', 'unit', 'unit__area',
+					'unit__area__board_area', 'unit__player', 'unit__player__country').order_by('id'))
+
+	def resolve(self):
+		self.undo_unconfirmed()
+		confirmed = [e for e in self.expenses if e.confirmed]
+		if signals:
+			for e in confirmed:
+				signals.expense_paid.send(sender=e)
+		self.apply_area_expenses(confirmed)
+		chosen = self.choose_bribes(confirmed)
+		self.apply_bribes(chosen)
+		## finally, delete all the expenses
+		from machiavelli.models import Expense
+		Expense.objects.filter(player__game=self.game).delete()
+
+	def undo_unconfirmed(self):
+		""" Returns the money of the unconfirmed expenses and deletes them """
+		from machiavelli.models import Expense, Order, Player
+		unconfirmed = [e for e in self.expenses if not e.confirmed]
+		if not unconfirmed:
+			return
+		refunds = {}
+		orders = []
+		for e in unconfirmed:
+			refunds[e.player_id] = refunds.get(e.player_id, 0) + e.ducats
+			if e.type in BUY:
+				## delete the orders given to the unit the player tried to buy
+				orders.append(Q(player__id=e.player_id, unit__id=e.unit_id))
+			if logging:
+				msg = "Deleting expense in game %s: %s." % (self.game.id, e)
+				logging.info(msg)
+		if orders:
+			Order.objects.filter(reduce(operator.or_, orders)).delete()
+		add_ducats(Player, refunds.items())
+		Expense.objects.filter(id__in=[e.id for e in unconfirmed]).delete()
+
+	def apply_area_expenses(self, confirmed):
+		""" Applies famine reliefs and rebellions """
+		from machiavelli.models import GameArea, Rebellion
+		reliefs = [e.area_id for e in confirmed if e.type == 0]
+		if reliefs:
+			GameArea.objects.filter(id__in=reliefs).update(famine=False)
+		pacified = [e.area_id for e in confirmed if e.type == 1]
+		if pacified:
+			Rebellion.objects.filter(area__id__in=pacified).delete()
+		## new rebellions are saved one by one, because Rebellion.save checks
+		## if each one can be placed
+		for e in confirmed:
+			if e.type in (2, 3):
+				try:
+					rebellion = Rebellion(area=e.area)
+					rebellion.save()
+				except:
+					continue
+
+	def choose_bribes(self, confirmed):
+		""" Returns the list of successful bribes, one for each bribed unit """
+		from machiavelli.models import get_expense_cost
+		counter = {}
+		for e in confirmed:
+			if e.type == 4:
+				counter[e.unit_id] = counter.get(e.unit_id, 0) + e.ducats
+		by_unit = {}
+		for e in confirmed:
+			if not e.type in BRIBES:
+				continue
+			total_cost = get_expense_cost(e.type, e.unit) + counter.get(e.unit_id, 0)
+			if total_cost > e.ducats:
+				continue
+			by_unit.setdefault(e.unit_id, []).append(e)
+		chosen = []
+		for unit_id in sorted(by_unit.keys()):
+			bribes = by_unit[unit_id]
+			highest = max([b.ducats for b in bribes])
+			candidates = [b for b in bribes if b.ducats == highest]
+			if self.stream is not None:
+				chosen.append(candidates[self.stream.randrange(len(candidates))])
+			else:
+				chosen.append(self.random.choice(candidates))
+		return chosen
+
+	def apply_bribes(self, chosen):
+		from machiavelli.models import Player, Unit
+		## disband units
+		disbanded = [c.unit for c in chosen if c.type in DISBAND]
+		for u in disbanded:
+			u.log_disband()
+		if disbanded:
+			Unit.objects.filter(id__in=[u.id for u in disbanded]).delete()
+		## buy units
+		bought = {}
+		for c in chosen:
+			if c.type in BUY:
+				bought.setdefault(c.player_id, (c.player, []))[1].append(c.unit)
+		for player, units in bought.values():
+			Unit.objects.filter(id__in=[u.id for u in units]).update(player=player)
+			for u in units:
+				u.player = player
+				u.check_rebellion()
+				if signals:
+					signals.unit_changed_country.send(sender=u)
+		## turn garrisons into autonomous
+		autonomous = [c.unit for c in chosen if c.type in TO_AUTONOMOUS]
+		if autonomous:
+			for u in autonomous:
+				assert u.type == 'G'
+			try:
+				aplayer = Player.objects.get(game=self.game, user__isnull=True)
+			except ObjectDoesNotExist:
+				return
+			Unit.objects.filter(id__in=[u.id for u in autonomous]).update(player=aplayer, paid=True)
+			for u in autonomous:
+				u.player = aplayer
+				u.paid = True
+				if signals:
+					signals.unit_to_autonomous.send(sender=u)
@@ -0,0 +1,177 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module calculates the income of all the players in a game at once.
+
+``IncomeEngine`` loads the areas, units, rebellions and major cities of the
+game with one query each, calculates the income of every player, and adds the
+ducats to all the players with a single query.
+
+The income of a player is the sum of:
+
+* ``control``: the control income of the controlled areas without famine or
+  rebellion, plus the ducats of the major cities among them.
+
+* ``occupation``: one ducat for each army or fleet in an area that the player
+  does not control, unless it has famine.
+
+* ``garrisons``: the garrison income of the non-besieged garrisons in areas
+  that the player does not control (or that have famine or rebellion), plus
+  the ducats of the major cities among them.
+
+* ``variable``: the variable income of the country, and of the countries that
+  it has conquered.
+
+The income of each player is a dictionary with the ducats of each source:
+``control``, ``occupation``, ``garrisons`` and ``variable``.
+"""
+
+from django.db import connection, transaction
+
+import machiavelli.finances as finances
+
+SOURCES = ('control', 'occupation', 'garrisons', 'variable')
+
+def total(income):
+	""" Returns the total ducats of an income breakdown """
+	return sum([income[s] for s in SOURCES])
+
+class IncomeEngine(object):
+	def __init__(self, game):
+		self.game = game
+
+	def load(self):
+		""" Loads all the data needed to calculate the income """
+		from machiavelli.models import CityIncome, Rebellion, Unit
+		game = self.game
+		self.players = list(game.player_set.all())
+		for p in self.players:
+			p.game = game
+		## {gamearea id: (board area id, player id, famine)}
+		self.areas = {}
+		## {board area id: (code, control income, garrison income)}
+		self.board = {}
+		for (id, board_area, player, famine, code, control, garrison) in \
+			game.gamearea_set.values_list('id', 'board_area', 'player', 'famine',
+										'board_area__code',
+										'board_area__control_income',
+										'board_area__garrison_income'):
+			self.areas[id] = (board_area, player, famine)
+			self.board[board_area] = (code, control, garrison)
+		## {player id: set of gamearea ids with a rebellion against the player}
+		self.rebellions = {}
+		for player, area in Rebellion.objects.filter(area__game=game).values_list('player', 'area'):
+			self.rebellions.setdefault(player, set()).add(area)
+		## {player id: list of (type, gamearea id)}
+		self.units = {}
+		## board area ids of the cities under siege
+		self.sieges = set()
+		for player, type, area, besieging in Unit.objects.filter(player__game=game).values_list('player',
+																'type', 'area', 'besieging'):
+			self.units.setdefault(player, []).append((type, area))
+			if besieging:
+				self.sieges.add(self.areas[area][0])
+		self.majors = set(CityIncome.objects.filter(scenario=game.scenario).values_list('city', flat=True))
+		self.conquering = game.configuration.conquering
+
+	def _majors_income(self, board_ids, die):
+		v = 0
+		for a in board_ids:
+			if a in self.majors:
+				v += finances.get_ducats(self.board[a][0], die)
+		return v
+
+	def control_income(self, player, die):
+		rebellions = self.rebellions.get(player.id, ())
+		board_ids = set()
+		for id, (board_area, owner, famine) in self.areas.items():
+			if owner == player.id and not famine and not id in rebellions:
+				board_ids.add(board_area)
+		if not board_ids:
+			return 0
+		income = sum([self.board[a][1] for a in board_ids])
+		return income + self._majors_income(board_ids, die)
+
+	def occupation_income(self, player):
+		i = 0
+		for type, area in self.units.get(player.id, []):
+			board_area, owner, famine = self.areas[area]
+			if type != 'G' and not famine and owner != player.id:
+				i += 1
+		return i
+
+	def garrisons_income(self, player, die):
+		rebellions = self.rebellions.get(player.id, ())
+		board_ids = set()
+		for type, area in self.units.get(player.id, []):
+			if type != 'G':
+				continue
+			board_area, owner, famine = self.areas[area]
+			if owner != player.id or famine or area in rebellions:
+				board_ids.add(board_area)
+		board_ids -= self.sieges
+		if not board_ids:
+			return 0
+		income = sum([self.board[a][2] for a in board_ids])
+		return income + self._majors_income(board_ids, die)
+
+	def variable_income(self, player, die):
+		v = finances.get_ducats(player.static_name, die, player.double_income)
+		## the player gets the variable income of conquered players
+		if self.conquering:
+			for c in self.players:
+				if c.conqueror_id == player.id:
+					v += finances.get_ducats(c.static_name, die, c.double_income)
+		return v
+
+	def calculate(self, die):
+		""" Returns a dictionary {player: income} for all the active players """
+		incomes = {}
+		for p in self.players:
+			if p.user_id is None or p.eliminated:
+				continue
+			incomes[p] = {
+				'control': self.control_income(p, die),
+				'occupation': self.occupation_income(p),
+				'garrisons': self.garrisons_income(p, die),
+				'variable': self.variable_income(p, die),
+			}
+		return incomes
+
+	def apply(self, incomes):
+		""" Adds the income to the treasury of each player with one query """
+		ducats = [(p.id, total(i)) for p, i in incomes.items() if total(i) > 0]
+		return add_ducats(self.game.player_set.model, ducats)
+
+def add_ducats(player_model, ducats):
+	""" Adds ducats to several players with one query. ``ducats`` is a list of
+	tuples (player id, ducats). """
+	if not ducats:
+		return 0
+	qn = connection.ops.quote_name
+	cases = " ".join(["WHEN %s THEN %s" % (int(id), int(d)) for id, d in ducats])
+	cursor = connection.cursor()
+	cursor.execute("UPDATE %(t)s SET %(d)s = %(d)s + CASE %(id)s %(cases)s ELSE 0 END WHERE %(id)s IN (%(ids)s)" % {
+			't': qn(player_model._meta.db_table),
+			'd': qn('ducats'),
+			'id': qn('id'),
+			'cases': cases,
+			'ids': ", ".join([str(int(id)) for id, d in ducats])})
+	transaction.set_dirty()
+	return cursor.rowcount
+add_ducats = transaction.commit_on_success(add_ducats)
@@ -0,0 +1,360 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module creates synthetic games, played by simulated players, to
+measure how the site behaves with many games.
+
+The simulated players act through the same forms and model methods as the
+views: ``play_orders``, ``play_expenses``, ``play_reinforcements``,
+``play_finance_reinforcements``, ``play_retreats`` and ``confirm_orders``.
+Each order and expense is chosen at random and kept only if the form
+accepts it, so all of them are legal.
+
+The games are private and are created by the synthetic users, whose names
+start with ``LOADTEST_PREFIX`` and that are shared by all the synthetic games.
+``delete_games`` removes them.
+"""
+
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.forms.formsets import formset_factory
+
+from machiavelli import forms
+from machiavelli.models import *
+from machiavelli.timing import QueryCounter, start_counting, stop_counting, percentile
+
+LOADTEST_PREFIX = 'loadtest'
+## prefix of the slugs of the synthetic games
+SLUG_PREFIX = 'lt'
+
+BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+## probability that a simulated player spends ducats in an orders phase
+EXPENSE_PROBABILITY = 0.3
+## number of random expenses that a player tries before giving up
+EXPENSE_TRIES = 5
+
+class Sample(object):
+	""" Measures the wall time and the queries of a block of code """
+	def __init__(self):
+		self.counter = QueryCounter()
+
+	def __enter__(self):
+		start_counting(self.counter)
+		self.started = time.time()
+		return self
+
+	def __exit__(self, *args):
+		self.elapsed = int((time.time() - self.started) * 1000)
+		stop_counting(self.counter)
+		self.queries = self.counter.queries
+		return False
+
+class Report(object):
+	""" Stores the samples of each phase and action """
+	def __init__(self):
+		## (phase, action) -> list of (milliseconds, queries)
+		self.samples = {}
+
+	def add(self, phase, action, sample):
+		self.samples.setdefault((phase, action), []).append((sample.elapsed, sample.queries))
+
+	def rows(self):
+		""" Returns a list of tuples (phase, action, count, p50 ms, p90 ms,
+		p99 ms, max ms, p50 queries, p90 queries) """
+		rows = []
+		phases = dict(GAME_PHASES)
+		for (phase, action) in sorted(self.samples.keys()):
+			values = self.samples[(phase, action)]
+			e = sorted([v[0] for v in values])
+			q = sorted([v[1] for v in values])
+			rows.append((unicode(phases[phase]), action, len(e),
+						percentile(e, 50), percentile(e, 90), percentile(e, 99), e[-1],
+						percentile(q, 50), percentile(q, 90)))
+		return rows
+
+def get_users(count):
+	""" Returns ``count`` users for the synthetic games, creating them if
+	needed """
+	users = []
+	for i in range(count):
+		username = "%s-%s" % (LOADTEST_PREFIX, i)
+		try:
+			user = User.objects.get(username=username)
+		except User.DoesNotExist:
+			user = User.objects.create_user(username, "%s@example.com" % username)
+		users.append(user)
+	return users
+
+def base36(number):
+	digits = ''
+	while True:
+		number, digit = divmod(number, 36)
+		digits = BASE36[digit] + digits
+		if number == 0:
+			return digits
+
+def make_run_id(rnd):
+	""" Returns a short id for a run of the load test. It is made of the
+	current time in milliseconds and a random number, so that two runs
+	started at the same time get different ids. """
+	return "%s%s" % (base36(int(time.time() * 1000)), base36(rnd.randrange(36 ** 2)))
+
+def create_game(scenario, index, run_id, options={}):
+	""" Creates a game in ``scenario`` and fills it with synthetic players,
+	as ``create_game`` and ``join_game`` do. ``run_id`` is the id returned by
+	``make_run_id``. ``options`` are the values of the configuration fields. """
+	users = get_users(scenario.get_slots())
+	slug = "%s%s-%s" % (SLUG_PREFIX, run_id, index)
+	if len(slug) > Game._meta.get_field('slug').max_length:
+		raise ValueError("The slug %s is too long" % slug)
+	game = Game(slug=slug, scenario=scenario, created_by=users[0], private=True,
+				time_limit=TIME_LIMITS[0][0])
+	game.slots = scenario.get_slots() - 1
+	game.save()
+	Player(user=users[0], game=game).save()
+	config = game.configuration
+	for name, value in options.items():
+		setattr(config, name, value)
+	config.save()
+	for user in users[1:]:
+		Player(user=user, game=game).save()
+		game.player_joined()
+	return game
+
+def delete_games():
+	""" Deletes the synthetic games. Returns the number of deleted games """
+	games = Game.objects.filter(created_by__username__startswith="%s-" % LOADTEST_PREFIX)
+	count = games.count()
+	for game in games:
+		game.delete()
+	return count
+
+class SimulatedPlayer(object):
+	def __init__(self, player, rnd):
+		self.player = player
+		self.game = player.game
+		self.random = rnd
+
+	def play(self):
+		""" Takes the actions of the current phase and ends it """
+		if self.game.phase == PHREINFORCE:
+			if self.game.configuration.finances:
+				self.play_finance_reinforcements()
+			else:
+				self.play_reinforcements()
+		elif self.game.phase == PHORDERS:
+			self.play_orders()
+			if self.game.configuration.finances and self.random.random() < EXPENSE_PROBABILITY:
+				self.play_expenses()
+			self.confirm_orders()
+		elif self.game.phase == PHRETREATS:
+			self.play_retreats()
+
+	def play_reinforcements(self):
+		player = self.player
+		units_to_place = player.units_to_place()
+		if units_to_place > 0:
+			ReinforceForm = forms.make_reinforce_form(player)
+			areas = list(player.get_areas_for_new_units())
+			self.random.shuffle(areas)
+			data = {}
+			placed = 0
+			for area in areas:
+				if placed == units_to_place:
+					break
+				types = area.possible_reinforcements()
+				if not types:
+					continue
+				form = ReinforceForm(data={'type': self.random.choice(types), 'area': area.id})
+				if form.is_valid():
+					Unit(type=form.cleaned_data['type'], area=form.cleaned_data['area'],
+						player=player, placed=False).save()
+					placed += 1
+		elif units_to_place < 0:
+			DisbandForm = forms.make_disband_form(player)
+			units = list(player.unit_set.values_list('id', flat=True))
+			form = DisbandForm(data={'units': self.random.sample(units, -units_to_place)})
+			if form.is_valid():
+				for u in form.cleaned_data['units']:
+					u.paid = False
+					u.save()
+		Player.objects.get(id=player.pk).end_phase()
+
+	def play_finance_reinforcements(self):
+		player = self.player
+		## step 0: pay some of the units
+		UnitPaymentForm = forms.make_unit_payment_form(player)
+		units = list(player.unit_set.filter(placed=True))
+		self.random.shuffle(units)
+		paid = []
+		cost = 0
+		for u in units:
+			if cost + u.cost <= player.ducats:
+				paid.append(u.id)
+				cost += u.cost
+		form = UnitPaymentForm(data={'units': paid})
+		if form.is_valid():
+			cost = sum(u.cost for u in form.cleaned_data['units'])
+			for u in form.cleaned_data['units']:
+				u.paid = True
+				u.save()
+			player.ducats = player.ducats - cost
+		player.step = 1
+		player.save()
+		## step 1: buy new units with the remaining ducats
+		can_buy = player.ducats / 3
+		areas = list(player.get_areas_for_new_units(finances=True))
+		self.random.shuffle(areas)
+		ReinforceForm = forms.make_reinforce_form(player, finances=True)
+		total_cost = 0
+		for area in areas[:self.random.randint(0, min(can_buy, len(areas)))]:
+			types = area.possible_reinforcements()
+			if not types:
+				continue
+			form = ReinforceForm(data={'type': self.random.choice(types), 'area': area.id})
+			if form.is_valid():
+				new_unit = Unit(type=form.cleaned_data['type'], area=form.cleaned_data['area'],
+								player=player, placed=False)
+				new_unit.save()
+				total_cost += new_unit.cost
+		player.ducats = player.ducats - total_cost
+		player.save()
+		player.end_phase()
+
+	def order_candidates(self, form, unit):
+		""" Returns a list of possible order data for ``unit``, in random
+		order, always ending with a hold order """
+		candidates = []
+		for area in form.get_valid_destinations(unit):
+			candidates.append({'code': '-', 'destination': area.id})
+		if unit.area.board_area.has_city and unit.type in ('A', 'F'):
+			candidates.append({'code': 'B'})
+		for type, label in UNIT_TYPES:
+			if type != unit.type:
+				candidates.append({'code': '=', 'type': type})
+		neighbours = Unit.objects.filter(player__game=self.game,
+				area__board_area__borders=unit.area.board_area).select_related('area')
+		for other in neighbours:
+			candidates.append({'code': 'S', 'subunit': other.id, 'subcode': 'H'})
+		self.random.shuffle(candidates)
+		candidates.append({'code': 'H'})
+		return candidates
+
+	def play_orders(self):
+		player = self.player
+		OrderForm = forms.make_order_form(player)
+		for unit in player.unit_set.select_related('area__board_area'):
+			for data in self.order_candidates(OrderForm(player), unit):
+				data['unit'] = unit.id
+				form = OrderForm(player, data=data)
+				if form.is_valid():
+					form.save()
+					break
+
+	def play_expenses(self):
+		player = Player.objects.get(id=self.player.pk)
+		ExpenseForm = forms.make_expense_form(player)
+		ducats = [d for d, label in forms.make_ducats_list(player.ducats) if d > 0]
+		if not ducats:
+			return
+		areas = list(self.game.gamearea_set.values_list('id', flat=True))
+		units = list(Unit.objects.filter(player__game=self.game).values_list('id', flat=True))
+		for i in range(EXPENSE_TRIES):
+			type = self.random.choice(EXPENSE_TYPES)[0]
+			data = {'type': type, 'ducats': self.random.choice(ducats)}
+			if type in (0, 1, 2, 3):
+				data['area'] = self.random.choice(areas)
+			elif units:
+				data['unit'] = self.random.choice(units)
+			form = ExpenseForm(player, data=data)
+			if form.is_valid():
+				expense = form.save()
+				player.ducats = F('ducats') - expense.ducats
+				player.save()
+				break
+		self.player = Player.objects.get(id=player.pk)
+
+	def confirm_orders(self):
+		player = self.player
+		for order in player.order_set.all():
+			if order.is_possible():
+				order.confirm()
+		player.expense_set.all().update(confirmed=True)
+		player.end_phase()
+
+	def play_retreats(self):
+		player = self.player
+		for u in Unit.objects.filter(player=player).exclude(must_retreat__exact=''):
+			RetreatForm = forms.make_retreat_form(u)
+			areas = list(u.get_possible_retreats().values_list('id', flat=True))
+			data = {'%s-unitid' % u.id: u.id}
+			if areas:
+				data['%s-area' % u.id] = self.random.choice(areas)
+			form = RetreatForm(data, prefix=u.id)
+			if form.is_valid():
+				area = form.cleaned_data['area']
+				if isinstance(area, GameArea):
+					RetreatOrder(unit=u, area=area).save()
+				else:
+					RetreatOrder(unit=u).save()
+		player.end_phase()
+
+class LoadTest(object):
+	def __init__(self, seed=None):
+		self.random = random.Random(seed)
+		## the run id does not depend on the seed
+		self.run_id = make_run_id(random.Random())
+		self.report = Report()
+		self.games = []
+
+	def create_games(self, count, scenarios, options={}):
+		""" Creates ``count`` games, choosing the scenarios in turn """
+		for i in range(count):
+			scenario = scenarios[i % len(scenarios)]
+			game = create_game(scenario, i, self.run_id, options)
+			self.games.append(game.id)
+
+	def play_turn(self):
+		""" Plays the current phase of each game and processes it with
+		``check_finished_phase``. Returns the number of active games. """
+		active = 0
+		for game_id in self.games:
+			game = Game.objects.get(id=game_id)
+			if game.phase == PHINACTIVE:
+				continue
+			active += 1
+			phase = game.phase
+			with Sample() as sample:
+				for player in game.player_set.filter(user__isnull=False, done=False):
+					SimulatedPlayer(player, self.random).play()
+			self.report.add(phase, 'players', sample)
+			game = Game.objects.get(id=game_id)
+			with Sample() as sample:
+				game.check_finished_phase()
+			self.report.add(phase, 'processing', sample)
+		return active
+
+	def run(self, turns):
+		for i in range(turns):
+			if self.play_turn() == 0:
+				break
+		return self.report
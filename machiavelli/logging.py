@@ -18,42 +18,18 @@
 
 """ This module defines functions to log some info about the game flow.
 
-At the moment, only a XML snapshot of each turn status is saved. It's useful
-if an error happens and we have to restore a previous turn.
+At the moment, only a snapshot of each turn status is saved. It's useful
+if an error happens and we have to restore a previous turn. The snapshots are
+written by ``machiavelli.snapshots``.
 """
 
-import os
+import machiavelli.snapshots as snapshots
 
-from django.conf import settings
-
-SNAPSHOTS_DIR = os.path.join(settings.PROJECT_ROOT, 'machiavelli/media/machiavelli/maps/snapshots')
+SNAPSHOTS_DIR = snapshots.SNAPSHOTS_DIR
 
 def save_snapshot(game):
-	""" Saves a XML snapshot of the current status of ``game``. """
-
-	filename = "%s.snap" % game.id
+	""" Saves a snapshot of the current status of ``game``. """
 	try:
-		path = os.path.join(SNAPSHOTS_DIR, filename)
-		fd = open(path, mode='a')
-	except IOError, v:
+		snapshots.save_snapshot(game)
+	except (IOError, snapshots.SnapshotError), v:
 		print v
-		return
-	else:
-		fd.write("\n")
-		fd.write("<turn year=\"%s\" season=\"%s\">\n" % (game.year, game.season))
-		for player in game.player_set.all():
-			if player.country:
-				fd.write("<player country=\"%s\">\n" % (player.country))
-			else:
-				fd.write("<player>\n")
-			for unit in player.unit_set.all():
-				fd.write("<unit ")
-				fd.write("id=\"%(id)s\" type=\"%(type)s\" area=\"%(area)s\" besieging=\"%(bes)s\" />" %
-							{ 'id': unit.id,
-							  'type': unit.type,
-							  'area': unit.area.board_area.code,
-							  'bes': unit.besieging })
-				fd.write("\n")
-			fd.write("</player>\n")
-		fd.write("</turn>\n")
-		fd.close()
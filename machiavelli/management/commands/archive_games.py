@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.archive as archive
+
+AGE=7*24*60*60
+
+class Command(NoArgsCommand):
+	"""
+This script archives the finished games that ended more than AGE days ago,
+and deletes their events and turn logs from the database.
+	"""
+	help = 'This command archives the finished games that ended more than AGE days ago.'
+
+	def handle_noargs(self, **options):
+		age = timedelta(0, AGE)
+		threshold = datetime.now() - age
+		print "Archiving games that finished before %s" % threshold
+		games = models.Game.objects.filter(phase__exact=models.PHINACTIVE,
+									slots__exact=0,
+									finished__lt=threshold)
+		c = 0
+		for game in games:
+			if archive.is_archived(game):
+				continue
+			path = archive.archive_game(game)
+			print "Game %s archived in %s" % (game.slug, path)
+			c += 1
+		print "%s games archived" % c
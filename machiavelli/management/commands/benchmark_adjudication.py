@@ -0,0 +1,85 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.benchmark as benchmark
+import machiavelli.replay as replay
+
+class Command(NoArgsCommand):
+	"""
+This script runs the adjudication benchmark. Each case of the corpus is
+processed in the replay database, and the command fails if the events do not
+match the case or any step of process_orders makes more queries than the
+budget of the case.
+
+With --record, the orders phase of a game is added to the corpus. With
+--budget, the budgets of the cases are set from the queries of the run.
+	"""
+	help = 'This command checks the adjudication against the recorded board positions.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--case', dest='case', default=None,
+			help='Only run this case'),
+		make_option('--record', action='store_true', dest='record', default=False,
+			help='Record a new case from a game'),
+		make_option('--game', dest='game', default=None,
+			help='Slug of the game to record'),
+		make_option('--year', type='int', dest='year', default=None),
+		make_option('--season', type='int', dest='season', default=None),
+		make_option('--name', dest='name', default=None,
+			help='Name of the recorded case'),
+		make_option('--budget', action='store_true', dest='budget', default=False,
+			help='Set the budgets of the cases from this run'),
+	)
+
+	def handle_noargs(self, **options):
+		if options['record']:
+			self.record(options)
+			return
+		if options['case']:
+			names = [options['case']]
+		else:
+			names = benchmark.list_cases()
+		if not names:
+			raise CommandError("There are no cases in %s" % benchmark.BENCHMARK_DIR)
+		try:
+			benchmark.setup_database()
+		except replay.ReplayError, e:
+			raise CommandError(str(e))
+		failed = []
+		for name in names:
+			if options['budget']:
+				result = benchmark.update_budget(name)
+			else:
+				result = benchmark.run_case(name)
+			total = sum(result.steps.values())
+			if result.ok():
+				print "%s: ok (%s queries)" % (name, total)
+				continue
+			failed.append(name)
+			print "%s: FAILED (%s queries)" % (name, total)
+			for classname, text in result.missing:
+				print "  - %s: %s" % (classname, text)
+			for classname, text in result.unexpected:
+				print "  + %s: %s" % (classname, text)
+			for step, queries, budget in result.over_budget:
+				print "  %s made %s queries, the budget is %s" % (step, queries, budget)
+		if failed:
+			raise CommandError("%s of %s cases failed: %s" % (len(failed), len(names),
+															", ".join(failed)))
+
+	def record(self, options):
+		for option in ('game', 'year', 'season', 'name'):
+			if options[option] is None:
+				raise CommandError("--%s is required to record a case" % option)
+		try:
+			game = models.Game.objects.get(slug=options['game'])
+		except models.Game.DoesNotExist:
+			raise CommandError("Game %s does not exist" % options['game'])
+		try:
+			case = benchmark.record_case(game, options['year'], options['season'],
+										options['name'])
+		except replay.ReplayError, e:
+			raise CommandError(str(e))
+		print "Case %s recorded with %s orders and %s events" % (case['name'],
+										len(case['orders']), len(case['expected']))
@@ -0,0 +1,17 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+import machiavelli.disasters as disasters
+
+class Command(NoArgsCommand):
+	"""
+This script compiles the disaster tables into area ids and prints the codes
+in the tables that are not found in the board.
+	"""
+	help = 'This command prints the codes in the disaster tables that are not found in the board.'
+
+	def handle_noargs(self, **options):
+		disasters.compile_area_index()
+		if disasters.UNKNOWN_CODES:
+			print "Codes not found in the board: %s" % ", ".join(sorted(disasters.UNKNOWN_CODES))
+		else:
+			print "All the codes in the disaster tables are in the board"
@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+import machiavelli.broker as broker
+
+class Command(NoArgsCommand):
+	"""
+This script deletes all the live events that are older than LIVE_EVENTS_TTL
+seconds.
+	"""
+	help = 'This command deletes all the live events that are older than LIVE_EVENTS_TTL seconds.'
+
+	def handle_noargs(self, **options):
+		print "Deleting live events older than %s seconds" % broker.LIVE_EVENTS_TTL
+		broker.purge_old_events()
@@ -2,6 +2,8 @@ from datetime import datetime, timedelta
 
 from django.core.management.base import NoArgsCommand, CommandError
 
+from condottieri_common.purge import purge, report, PURGE_OPTIONS
+
 import jogging.models as jogging
 
 AGE=10*24*60*60
@@ -11,11 +13,13 @@ class Command(NoArgsCommand):
 This script deletes all log entries that are older than AGE days.
 	"""
 	help = 'This command deletes all log entries that are older than AGE days.'
+	option_list = NoArgsCommand.option_list + PURGE_OPTIONS
 
 	def handle_noargs(self, **options):
 		age = timedelta(0, AGE)
 		threshold = datetime.now() - age
 		print "Deleting logs that were added before %s" % threshold
 		old_logs = jogging.Log.objects.filter(datetime__lt=threshold)
-		print "%s logs will be deleted" % len(old_logs)
-		old_logs.delete()
+		total, deleted = purge(old_logs, "logs", options['chunk_size'],
+							options['dry_run'], options['archive'])
+		print report("logs", total, deleted, options['dry_run'])
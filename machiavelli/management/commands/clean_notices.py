@@ -2,6 +2,8 @@ from datetime import datetime, timedelta
 
 from django.core.management.base import NoArgsCommand, CommandError
 
+from condottieri_common.purge import purge, report, PURGE_OPTIONS
+
 from notification import models as notification
 
 AGE=10*24*60*60
@@ -11,11 +13,13 @@ class Command(NoArgsCommand):
 This script deletes all notices that are older than AGE days.
 	"""
 	help = 'This command deletes all notices that are older than AGE days.'
+	option_list = NoArgsCommand.option_list + PURGE_OPTIONS
 
 	def handle_noargs(self, **options):
 		age = timedelta(0, AGE)
 		threshold = datetime.now() - age
 		print "Deleting notices that were added before %s" % threshold
 		old_notices = notification.Notice.objects.filter(added__lt=threshold)
-		print "%s notices will be deleted" % len(old_notices)
-		old_notices.delete()
+		total, deleted = purge(old_notices, "notices", options['chunk_size'],
+							options['dry_run'], options['archive'])
+		print report("notices", total, deleted, options['dry_run'])
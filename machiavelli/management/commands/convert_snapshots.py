@@ -0,0 +1,42 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+import machiavelli.snapshots as snapshots
+
+class Command(NoArgsCommand):
+	"""
+This script converts the old XML snapshot files (<game id>.snap) to the
+binary snapshot format. Games that already have a binary snapshot file are
+skipped.
+	"""
+	help = 'This command converts the old XML snapshots to the binary format.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--delete', action='store_true', dest='delete', default=False,
+			help='Delete the XML files after converting them'),
+	)
+
+	def handle_noargs(self, **options):
+		if not os.path.isdir(snapshots.SNAPSHOTS_DIR):
+			print "No snapshots found"
+			return
+		c = 0
+		for filename in sorted(os.listdir(snapshots.SNAPSHOTS_DIR)):
+			name, ext = os.path.splitext(filename)
+			if ext != '.snap' or not name.isdigit():
+				continue
+			game_id = int(name)
+			if os.path.exists(snapshots.snapshot_path(game_id)):
+				print "Game %s already has a binary snapshot" % game_id
+				continue
+			try:
+				turns = snapshots.convert_xml(game_id)
+			except snapshots.SnapshotError, v:
+				print "Game %s can't be converted: %s" % (game_id, v)
+				continue
+			print "Game %s: %s turns converted" % (game_id, turns)
+			if options['delete']:
+				os.remove(os.path.join(snapshots.SNAPSHOTS_DIR, filename))
+			c += 1
+		print "%s files converted" % c
@@ -0,0 +1,50 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.loadtest as loadtest
+
+class Command(NoArgsCommand):
+	"""
+This script creates synthetic games with simulated players, plays them for a
+number of turns and prints the percentiles of the time and the number of
+queries of the players' actions and of the processing of each phase.
+	"""
+	help = 'This command creates and plays synthetic games to measure the site under load.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--games', type='int', dest='games', default=10,
+			help='Number of games to create'),
+		make_option('--turns', type='int', dest='turns', default=12,
+			help='Number of phases to play in each game'),
+		make_option('--scenario', dest='scenario', default=None,
+			help='Name of the scenario. By default, all the enabled scenarios are used'),
+		make_option('--finances', action='store_true', dest='finances', default=False,
+			help='Play with finances, famine, plague and storms'),
+		make_option('--seed', type='int', dest='seed', default=None),
+		make_option('--delete', action='store_true', dest='delete', default=False,
+			help='Delete the synthetic games and exit'),
+	)
+
+	def handle_noargs(self, **options):
+		if options['delete']:
+			print "%s games deleted" % loadtest.delete_games()
+			return
+		scenarios = models.Scenario.objects.filter(enabled=True)
+		if options['scenario']:
+			scenarios = scenarios.filter(name=options['scenario'])
+		scenarios = list(scenarios)
+		if not scenarios:
+			raise CommandError("No scenarios found")
+		config = {}
+		if options['finances']:
+			for name in ('finances', 'famine', 'plague', 'storms'):
+				config[name] = True
+		test = loadtest.LoadTest(options['seed'])
+		test.create_games(options['games'], scenarios, config)
+		print "%s games created" % len(test.games)
+		report = test.run(options['turns'])
+		print "%-24s %-10s %6s %8s %8s %8s %8s %6s %6s" % ("phase", "action", "count",
+			"p50 ms", "p90 ms", "p99 ms", "max ms", "p50 q", "p90 q")
+		for row in report.rows():
+			print "%-24s %-10s %6s %8s %8s %8s %8s %6s %6s" % row
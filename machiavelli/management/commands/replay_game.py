@@ -0,0 +1,57 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.replay as replay
+
+class Command(NoArgsCommand):
+	"""
+This script replays the orders phases of a game in the replay database, and
+compares the outcome of each turn with the recorded events. The game is not
+modified.
+	"""
+	help = 'This command replays a game and compares its outcome with the recorded events.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--game', dest='game', default=None,
+			help='Slug of the game'),
+		make_option('--fail-fast', action='store_true', dest='fail_fast', default=False,
+			help='Stop at the first turn that does not match'),
+	)
+
+	def handle_noargs(self, **options):
+		if not options['game']:
+			raise CommandError("A game must be given with --game")
+		try:
+			game = models.Game.objects.get(slug=options['game'])
+		except models.Game.DoesNotExist:
+			raise CommandError("Game %s does not exist" % options['game'])
+		engine = replay.ReplayEngine(game)
+		try:
+			engine.setup()
+		except replay.ReplayError, e:
+			raise CommandError(str(e))
+		failed = 0
+		total = 0
+		for year, season in engine.turns():
+			try:
+				result = engine.replay_turn(year, season)
+			except replay.ReplayError, e:
+				raise CommandError(str(e))
+			if result is None:
+				continue
+			total += result.elapsed
+			if result.ok():
+				print "%s %s: ok (%.3f s)" % (year, season, result.elapsed)
+			else:
+				failed += 1
+				print "%s %s: MISMATCH (%.3f s)" % (year, season, result.elapsed)
+				for classname, text in result.missing:
+					print "  - %s: %s" % (classname, text)
+				for classname, text in result.unexpected:
+					print "  + %s: %s" % (classname, text)
+			if result.skipped_orders:
+				print "  %s orders without unit" % result.skipped_orders
+			if failed and options['fail_fast']:
+				break
+		print "%s turns failed. Adjudication time: %.2f seconds" % (failed, total)
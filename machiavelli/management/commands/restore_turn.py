@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.restore as restore
+import machiavelli.snapshots as snapshots
+
+class Command(NoArgsCommand):
+	"""
+This script restores a game to a turn recorded in its snapshots. The game
+is put at the beginning of the season that follows the given year and season.
+	"""
+	help = 'This command restores a game to a turn recorded in its snapshots.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--game', dest='game', default=None,
+			help='Slug of the game'),
+		make_option('--year', type='int', dest='year', default=None),
+		make_option('--season', type='int', dest='season', default=None),
+		make_option('--list', action='store_true', dest='list', default=False,
+			help='List the recorded turns of the game'),
+	)
+
+	def handle_noargs(self, **options):
+		if not options['game']:
+			raise CommandError("A game must be given with --game")
+		try:
+			game = models.Game.objects.get(slug=options['game'])
+		except models.Game.DoesNotExist:
+			raise CommandError("Game %s does not exist" % options['game'])
+		if options['list']:
+			for year, season in snapshots.list_turns(game.id):
+				print "%s %s" % (year, season)
+			return
+		if options['year'] is None or options['season'] is None:
+			raise CommandError("--year and --season are required")
+		try:
+			counts, elapsed = restore.restore_turn(game, options['year'], options['season'])
+		except restore.RestoreError, e:
+			raise CommandError(str(e))
+		print "Game %s restored to year %s, season %s, phase %s" % (game.slug,
+							game.year, game.season, game.phase)
+		for name in sorted(counts.keys()):
+			print "%s: %s rows" % (name, counts[name])
+		print "Restored in %.2f seconds" % elapsed
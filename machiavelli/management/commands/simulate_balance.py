@@ -0,0 +1,74 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+import machiavelli.disasters as disasters
+import machiavelli.simulation as simulation
+
+class Command(NoArgsCommand):
+	"""
+This script simulates many seasons of disaster and income rolls, and prints
+for each area the probability of being hit by each disaster, and for each
+country the distribution of its variable income. If a scenario is given, it
+also prints the expected number of home areas of each country that are hit.
+	"""
+	help = 'This command simulates the disaster and income tables to check the balance of the game.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--seasons', type='int', dest='seasons', default=None,
+			help='Number of seasons to simulate (1000000 with NumPy, 100000 without it)'),
+		make_option('--seed', type='int', dest='seed', default=None,
+			help='Seed of the random numbers'),
+		make_option('--scenario', dest='scenario', default=None,
+			help='Name of a scenario, to group the areas by country'),
+	)
+
+	def handle_noargs(self, **options):
+		seasons = options['seasons']
+		if seasons is None:
+			if simulation.numpy is None:
+				seasons = 100000
+			else:
+				seasons = 1000000
+		if simulation.numpy is None:
+			print "NumPy is not installed. Using the pure Python simulation."
+		started = time.time()
+		hits = {}
+		print "Probability of each area being hit in a season (%s seasons)" % seasons
+		print "%-8s %-8s %10s %10s" % ("table", "area", "simulated", "exact")
+		for name in sorted(disasters.TABLES.keys()):
+			table = disasters.TABLES[name]
+			hits[name] = simulation.simulate_disasters(table, seasons, options['seed'])
+			exact = simulation.exact_disasters(table)
+			for code in sorted(hits[name].keys()):
+				print "%-8s %-8s %10.4f %10.4f" % (name, code, hits[name][code], exact[code])
+		print
+		print "Variable income per season"
+		for double in (False, True):
+			incomes = simulation.simulate_income(seasons, options['seed'], double)
+			print "%-10s %6s %6s %6s  %s" % ("row", "double", "mean", "dev", "distribution")
+			for row in sorted(incomes.keys()):
+				mean, deviation, dist = incomes[row]
+				dist = ", ".join(["%s: %.3f" % (v, p) for v, p in sorted(dist.items())])
+				print "%-10s %6s %6.2f %6.2f  %s" % (row, double, mean, deviation, dist)
+		if options['scenario']:
+			try:
+				scenario = models.Scenario.objects.get(name=options['scenario'])
+			except models.Scenario.DoesNotExist:
+				raise CommandError("Scenario %s does not exist" % options['scenario'])
+			print
+			print "Expected home areas hit per season in scenario %s" % scenario.name
+			print "%-20s %6s %8s %8s %8s" % ("country", "areas", "plague", "famine", "storm")
+			homes = {}
+			for country, code in models.Home.objects.filter(scenario=scenario,
+									is_home=True).values_list('country__static_name', 'area__code'):
+				homes.setdefault(country, []).append(code)
+			for country in sorted(homes.keys()):
+				codes = homes[country]
+				expected = []
+				for name in ('plague', 'famine', 'storm'):
+					expected.append(sum([hits[name].get(c, 0) for c in codes]))
+				print "%-20s %6s %8.3f %8.3f %8.3f" % tuple([country, len(codes)] + expected)
+		print
+		print "Simulated in %.1f seconds" % (time.time() - started)
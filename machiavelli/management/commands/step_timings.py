@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from machiavelli import models
+from machiavelli.timing import percentile
+
+class Command(NoArgsCommand):
+	"""
+This script prints, for each step of the processing of a phase, the
+percentiles of the time and the number of queries recorded in StepMetric.
+	"""
+	help = 'This command summarizes the time spent in each step of the phase processing.'
+	option_list = NoArgsCommand.option_list + (
+		make_option('--days', type='int', dest='days', default=30,
+			help='Only use the metrics recorded in the last DAYS days'),
+		make_option('--phase', type='int', dest='phase', default=None,
+			help='Only use the metrics of this phase'),
+	)
+
+	def handle_noargs(self, **options):
+		metrics = models.StepMetric.objects.filter(created_at__gte=datetime.now() - timedelta(days=options['days']))
+		if options['phase'] is not None:
+			metrics = metrics.filter(phase=options['phase'])
+		elapsed = {}
+		queries = {}
+		games = set()
+		for step, e, q, game_id in metrics.values_list('step', 'elapsed', 'queries', 'game'):
+			elapsed.setdefault(step, []).append(e)
+			queries.setdefault(step, []).append(q)
+			games.add(game_id)
+		if not elapsed:
+			print "No metrics found"
+			return
+		print "Metrics of %s games in the last %s days" % (len(games), options['days'])
+		print "%-28s %6s %8s %8s %8s %8s %6s %6s" % ("step", "count", "p50 ms", "p90 ms",
+			"p99 ms", "max ms", "p50 q", "p90 q")
+		## slowest steps first
+		steps = sorted(elapsed.keys(), key=lambda s: -sum(elapsed[s]))
+		for step in steps:
+			e = sorted(elapsed[step])
+			q = sorted(queries[step])
+			print "%-28s %6s %8s %8s %8s %8s %6s %6s" % (step, len(e),
+				percentile(e, 50), percentile(e, 90), percentile(e, 99), e[-1],
+				percentile(q, 50), percentile(q, 90))
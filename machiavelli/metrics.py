@@ -0,0 +1,148 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module keeps counters and histograms about the requests, the cache
+and the processing of the games, and renders them in the Prometheus text
+format for the ``metrics`` view.
+
+The values are kept in the memory of each server process, so each process
+must be scraped. They are filled by ``machiavelli.middleware.MetricsMiddleware``
+and by hooks in ``Game``.
+
+Set ``MACHIAVELLI_METRICS`` to False to disable the collection.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+METRICS_ENABLED = getattr(settings, 'MACHIAVELLI_METRICS', True)
+
+## upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+## histograms that do not measure seconds
+HISTOGRAM_BUCKETS = {
+	'machiavelli_request_queries': (1, 5, 10, 25, 50, 100, 250, 500, 1000),
+}
+
+HELP = {
+	'machiavelli_requests_total': 'Requests served, by view and status code',
+	'machiavelli_request_seconds': 'Time spent serving a request, by view',
+	'machiavelli_request_queries': 'Database queries made by a request, by view',
+	'machiavelli_cache_requests_total': 'Cache reads, by cache key group and result',
+	'machiavelli_phase_step_seconds': 'Time spent in each step of the phase processing, without its nested steps',
+	'machiavelli_phase_seconds': 'Time spent processing a phase',
+	'machiavelli_phase_processing_total': 'Phases processed, by phase and result',
+	'machiavelli_map_render_seconds': 'Time spent drawing a game map',
+}
+
+_lock = threading.Lock()
+## {(name, labels): value}
+_counters = {}
+## {(name, labels): [bucket counts..., sum, count]}
+_histograms = {}
+
+def _labels(labels):
+	if not labels:
+		return ()
+	return tuple(sorted(labels.items()))
+
+def inc(name, labels=None, value=1):
+	""" Increments a counter """
+	if not METRICS_ENABLED:
+		return
+	key = (name, _labels(labels))
+	_lock.acquire()
+	try:
+		_counters[key] = _counters.get(key, 0) + value
+	finally:
+		_lock.release()
+
+def observe(name, value, labels=None):
+	""" Adds a value to a histogram """
+	if not METRICS_ENABLED:
+		return
+	key = (name, _labels(labels))
+	_lock.acquire()
+	try:
+		buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+		h = _histograms.get(key)
+		if h is None:
+			h = _histograms[key] = [0] * (len(buckets) + 2)
+		for i, bound in enumerate(buckets):
+			if value <= bound:
+				h[i] += 1
+		h[-2] += value
+		h[-1] += 1
+	finally:
+		_lock.release()
+
+def cache_get(key, group):
+	""" Reads ``key`` from the cache, counting a hit or a miss for ``group`` """
+	value = cache.get(key)
+	if value is None:
+		inc('machiavelli_cache_requests_total', {'group': group, 'result': 'miss'})
+	else:
+		inc('machiavelli_cache_requests_total', {'group': group, 'result': 'hit'})
+	return value
+
+def _format_labels(labels, extra=()):
+	labels = list(labels) + list(extra)
+	if not labels:
+		return ''
+	items = []
+	for k, v in labels:
+		v = unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+		items.append(u'%s="%s"' % (k, v))
+	return u'{%s}' % u','.join(items)
+
+def _header(lines, name, kind, seen):
+	if name in seen:
+		return
+	seen.add(name)
+	if name in HELP:
+		lines.append(u"# HELP %s %s" % (name, HELP[name]))
+	lines.append(u"# TYPE %s %s" % (name, kind))
+
+def render(gauges=None):
+	""" Returns all the metrics in the Prometheus text format. ``gauges`` is
+	an optional dictionary of gauge values computed by the caller. """
+	_lock.acquire()
+	try:
+		counters = sorted(_counters.items())
+		histograms = sorted((k, list(v)) for k, v in _histograms.items())
+	finally:
+		_lock.release()
+	lines = []
+	seen = set()
+	for (name, labels), value in counters:
+		_header(lines, name, 'counter', seen)
+		lines.append(u"%s%s %s" % (name, _format_labels(labels), value))
+	for (name, labels), h in histograms:
+		_header(lines, name, 'histogram', seen)
+		for i, bound in enumerate(HISTOGRAM_BUCKETS.get(name, BUCKETS)):
+			lines.append(u"%s_bucket%s %s" % (name, _format_labels(labels, (('le', bound),)), h[i]))
+		lines.append(u"%s_bucket%s %s" % (name, _format_labels(labels, (('le', '+Inf'),)), h[-1]))
+		lines.append(u"%s_sum%s %s" % (name, _format_labels(labels), h[-2]))
+		lines.append(u"%s_count%s %s" % (name, _format_labels(labels), h[-1]))
+	if gauges:
+		for name, value in sorted(gauges.items()):
+			_header(lines, name, 'gauge', seen)
+			lines.append(u"%s %s" % (name, value))
+	return u"\n".join(lines) + u"\n"
@@ -1,5 +1,10 @@
+import time
+
 from django.db import connection
 
+import machiavelli.metrics as metrics
+import machiavelli.timing as timing
+
 class DatabaseConnectionMiddleware(object):
     """
     Middleware to ensure database connections are closed properly and handle reconnection.
@@ -16,6 +21,46 @@ class DatabaseConnectionMiddleware(object):
         connection.close()
         return None
 
+class MetricsMiddleware(object):
+    """
+    Middleware to count the requests, their latency and their queries per view.
+    """
+    def process_request(self, request):
+        if not metrics.METRICS_ENABLED:
+            return None
+        ## drop the counters left by a previous request of this thread that
+        ## did not end with process_response
+        timing.reset_counting()
+        request._metrics_started = time.time()
+        request._metrics_queries = timing.QueryCounter()
+        timing.start_counting(request._metrics_queries)
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = "%s.%s" % (view_func.__module__,
+                                           getattr(view_func, '__name__', view_func.__class__.__name__))
+        return None
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            return response
+        counter = request._metrics_queries
+        timing.stop_counting(counter)
+        view = getattr(request, '_metrics_view', 'unresolved')
+        metrics.inc('machiavelli_requests_total', {'view': view,
+                                                   'status': response.status_code})
+        metrics.observe('machiavelli_request_seconds', time.time() - started, {'view': view})
+        metrics.observe('machiavelli_request_queries', counter.queries, {'view': view})
+        return response
+
+    def process_exception(self, request, exception):
+        ## the response to the exception may not go through process_response
+        counter = getattr(request, '_metrics_queries', None)
+        if counter is not None:
+            timing.stop_counting(counter)
+        return None
+
 class TimezoneFixMiddleware(object):
     """
     Middleware to fix timezone object conversion issues with old Django/Pinax.
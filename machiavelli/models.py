@@ -24,10 +24,11 @@ Defines the core classes of the machiavelli game.
 ## stdlib
 import random
 import thread
+import time
 from datetime import datetime, timedelta
 
 ## django
-from django.db import models
+from django.db import models, connection, transaction
 from django.db.models import permalink, Q, F, Count, Sum, Avg
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.core.cache import cache
@@ -56,13 +57,19 @@ else:
 from machiavelli.fields import AutoTranslateField
 from machiavelli.graphics import make_map
 from machiavelli.logging import save_snapshot
+from machiavelli.trace import TurnTrace, render as render_trace
+import machiavelli.broker as broker
 import machiavelli.dice as dice
 import machiavelli.disasters as disasters
 import machiavelli.finances as finances
+from machiavelli.income import IncomeEngine, total as total_income
+from machiavelli.expenses import ExpenseResolver
+import machiavelli.timing as timing
+import machiavelli.metrics as metrics
 import machiavelli.exceptions as exceptions
 
 ## condottieri_profiles
-from condottieri_profiles.models import CondottieriProfile
+from condottieri_profiles.models import CondottieriProfile, karma_adjusted
 
 ## condottieri_events
 if "condottieri_events" in settings.INSTALLED_APPS:
@@ -136,6 +143,16 @@ KARMA_DEFAULT = getattr(settings, 'KARMA_DEFAULT', 100)
 KARMA_MAXIMUM = getattr(settings, 'KARMA_MAXIMUM', 200)
 BONUS_TIME = getattr(settings, 'BONUS_TIME', 0.2)
 
+## seconds that the state version of a game is kept in the cache
+STATE_VERSION_TIMEOUT = 7*24*60*60
+
+def touch_game_state(game_id):
+	""" Stores a new state version for the game with id ``game_id`` and
+	returns it. """
+	version = time.time()
+	cache.set("game-%s_state-version" % game_id, version, STATE_VERSION_TIMEOUT)
+	return version
+
 class Invasion(object):
 	""" This class is used in conflicts resolution for conditioned invasions.
 	Invasion objects are not persistent (i.e. not stored in the database).
@@ -418,7 +435,7 @@ class Game(models.Model):
 	
 	def player_list_ordered_by_cities(self):
 		key = "game-%s_player-list" % self.pk
-		result_list = cache.get(key)
+		result_list = metrics.cache_get(key, 'player_list')
 		if result_list is None:
 			from django.db import connection
 			cursor = connection.cursor()
@@ -462,7 +479,7 @@ class Game(models.Model):
 	def get_all_units(self):
 		""" Returns a queryset with all the units in the board. """
 		key = "game-%s_all-units" % self.pk
-		all_units = cache.get(key)
+		all_units = metrics.cache_get(key, 'all_units')
 		if all_units is None:
 			all_units = Unit.objects.select_related().filter(player__game=self).order_by('area__board_area__name')
 			cache.set(key, all_units)
@@ -471,21 +488,53 @@ class Game(models.Model):
 	def get_all_gameareas(self):
 		""" Returns a queryset with all the game areas in the board. """
 		key = "game-%s_all-areas" % self.pk
-		all_areas = cache.get(key)
+		all_areas = metrics.cache_get(key, 'all_areas')
 		if all_areas is None:
 			all_areas = self.gamearea_set.select_related().order_by('board_area__code')
 			cache.set(key, all_areas)
 		return all_areas
 
+	def get_state_version(self):
+		""" Returns the timestamp of the last change in the game state that
+		can be seen by the players. It is used to build ETags and
+		Last-Modified headers for the game pages. The version is kept in the
+		cache, so it is only consistent if all the processes share the cache
+		(e.g. memcached).
+		"""
+		key = "game-%s_state-version" % self.pk
+		version = metrics.cache_get(key, 'state_version')
+		if version is None:
+			## the cached value was lost, so the state is assumed to be new
+			version = touch_game_state(self.pk)
+		return version
+
+	def touch_state(self):
+		""" Marks the game state as changed """
+		return touch_game_state(self.pk)
+
+	def log_cache_prefix(self):
+		""" Returns the prefix of the cached pages of the game log """
+		return "game-%s" % self.pk
+
 	##------------------------
 	## map methods
 	##------------------------
 	
+	@timing.timed
 	def make_map(self):
+		started = time.time()
 		make_map(self)
+		metrics.observe('machiavelli_map_render_seconds', time.time() - started)
 		#thread.start_new_thread(make_map, (self,))
+		broker.publish(self.pk, "map_ready")
 		return True
 
+	def publish_phase(self):
+		""" Tells the clients watching the game that the phase has changed """
+		broker.publish(self.pk, "phase_changed", {'year': self.year,
+												'season': self.season,
+												'phase': self.phase})
+
 	def map_changed(self):
 		if self.map_outdated == False:
 			self.map_outdated = True
@@ -527,6 +576,8 @@ class Game(models.Model):
 			self.last_phase_change = datetime.now()
 			self.notify_players("game_started", {"game": self})
 		self.save()
+		if self.slots == 0:
+			self.publish_phase()
 		#if self.map_outdated == True:
 		#	self.make_map()
 	
@@ -681,6 +732,8 @@ class Game(models.Model):
 		done, a phase change is forced.
 		"""
 
+		## the karma changes of all the players are applied together
+		karma = {}
 		for p in self.player_set.all():
 			if p.done:
 				continue
@@ -710,7 +763,8 @@ class Game(models.Model):
 				elif self.phase == PHRETREATS:
 					## disband the units that should retreat
 					Unit.objects.filter(player=p).exclude(must_retreat__exact='').delete()
-				p.end_phase(forced=True)
+				p.end_phase(forced=True, karma=karma)
+		apply_karma(karma)
 		
 	def time_to_limit(self):
 		""" Calculates the time to the next phase change and returns it as a
@@ -796,6 +850,59 @@ class Game(models.Model):
 		GameArea.objects.filter(game=self).update(standoff=False)
 
 	def all_players_done(self):
+		""" Processes the phase. The events logged during the processing are
+		saved together when the results are ready, before the game is saved in
+		the next phase. They are saved even if the processing fails, because
+		the changes made before the failure are kept. The time spent in each
+		step is recorded by ``machiavelli.timing``, and the dice rolled are
+		recorded in a ``TurnDice``, also if the processing fails. When a
+		failed turn is processed again, its recorded dice are rolled again. """
+		if signals:
+			signals.phase_processing_started.send(sender=self)
+		timing.start(self)
+		phase = self.phase
+		stream = self.get_dice_stream(replay=True)
+		dice.start(stream)
+		try:
+			self._process_phase()
+		except:
+			dice.stop()
+			try:
+				TurnDice.objects.record(stream)
+			except:
+				if logging:
+					logging.info("Error recording the dice of game %s" % self.pk)
+			timing.finish(save=False)
+			metrics.inc('machiavelli_phase_processing_total', {'phase': phase, 'result': 'failed'})
+			if signals:
+				signals.phase_processing_failed.send(sender=self)
+			raise
+		dice.stop()
+		TurnDice.objects.record(stream)
+		timing.finish()
+		metrics.inc('machiavelli_phase_processing_total', {'phase': phase, 'result': 'ok'})
+		if signals:
+			signals.phase_processing_finished.send(sender=self)
+
+	def get_dice_stream(self, replay=False):
+		""" Returns the dice stream of the current turn. The seed only
+		depends on the game and the turn, so processing the turn again gives
+		the same dice. If ``replay`` is True, the recorded rolls of the turn
+		are replayed first, and the stream goes on with the dice of the seed
+		when they run out. """
+		turn = (self.pk, self.year, self.season, self.phase)
+		stream = dice.DiceStream(dice.turn_seed(*turn), turn=turn, strict=False)
+		if replay:
+			try:
+				recorded = TurnDice.objects.get(game=self, year=self.year,
+									season=self.season, phase=self.phase)
+			except ObjectDoesNotExist:
+				pass
+			else:
+				stream.replay = dice.decode(recorded.rolls)
+		return stream
+
+	def _process_phase(self):
 		end_season = False
 		if self.phase == PHINACTIVE:
 			return
@@ -857,6 +964,8 @@ class Game(models.Model):
 				if self.configuration.conquering:
 					self.check_conquerings()
 				if self.check_winner() == True:
+					if signals:
+						signals.phase_processed.send(sender=self)
 					self.make_map()
 					self.assign_scores()
 					self.game_over()
@@ -891,10 +1000,14 @@ class Game(models.Model):
 		self.phase = next_phase
 		self.last_phase_change = datetime.now()
 		#self.map_changed()
+		if signals:
+			signals.phase_processed.send(sender=self)
 		self.save()
+		self.publish_phase()
 		self.make_map()
 		self.notify_players("new_phase", {"game": self})
     
+	@timing.timed
 	def adjust_units(self):
 		""" Places new units and disbands the ones that are not paid """
 		to_disband = Unit.objects.filter(player__game=self, paid=False)
@@ -922,6 +1035,7 @@ class Game(models.Model):
 	##------------------------
 	## optional rules methods
 	##------------------------
+	@timing.timed
 	def check_conquerings(self):
 		if not self.configuration.conquering:
 			return
@@ -945,45 +1059,57 @@ class Game(models.Model):
 					## controllers[0] conquers p
 					p.set_conqueror(controllers[0])
 
+	@timing.timed
 	def mark_famine_areas(self):
 		if not self.configuration.famine:
 			return
-		codes = disasters.get_famine()
-		famine_areas = GameArea.objects.filter(game=self, board_area__code__in=codes)
+		ids = disasters.get_area_ids('famine')
+		if not ids:
+			return
+		famine_areas = list(GameArea.objects.filter(game=self, board_area__id__in=ids))
+		GameArea.objects.filter(id__in=[f.id for f in famine_areas]).update(famine=True)
 		for f in famine_areas:
-			f.famine=True
-			f.save()
+			f.famine = True
 			signals.famine_marker_placed.send(sender=f)
 	
+	@timing.timed
 	def mark_storm_areas(self):
 		if not self.configuration.storms:
 			return
-		codes = disasters.get_storms()
-		storm_areas = GameArea.objects.filter(game=self, board_area__code__in=codes)
+		ids = disasters.get_area_ids('storm')
+		if not ids:
+			return
+		storm_areas = list(GameArea.objects.filter(game=self, board_area__id__in=ids))
+		GameArea.objects.filter(id__in=[f.id for f in storm_areas]).update(storm=True)
 		for f in storm_areas:
-			f.storm=True
-			f.save()
+			f.storm = True
 			signals.storm_marker_placed.send(sender=f)
 	
+	@timing.timed
 	def kill_plague_units(self):
 		if not self.configuration.plague:
 			return
-		codes = disasters.get_plague()
-		plague_areas = GameArea.objects.filter(game=self, board_area__code__in=codes)
+		ids = disasters.get_area_ids('plague')
+		if not ids:
+			return
+		plague_areas = GameArea.objects.filter(game=self, board_area__id__in=ids)
+		from condottieri_events.models import DisasterEvent, event_exists
 		for p in plague_areas:
 			# Check if a plague event already exists for this area
-			from condottieri_events.models import DisasterEvent
-			existing_plague = DisasterEvent.objects.filter(
-				game=self,
-				area=p.board_area,
+			existing_plague = event_exists(DisasterEvent, self,
+				area_id=p.board_area_id,
 				message=1  # 1 is the message type for plague
-			).exists()
+			)
 			
 			if not existing_plague:
 				signals.plague_placed.send(sender=p)
-			for u in p.unit_set.all():
-				u.delete()
+		units = list(Unit.objects.filter(player__game=self, area__board_area__id__in=ids).select_related('player', 'player__country', 'area', 'area__board_area'))
+		for u in units:
+			u.log_disband()
+		if units:
+			Unit.objects.filter(id__in=[u.id for u in units]).delete()
 
+	@timing.timed
 	def assign_incomes(self):
 		""" Gets each player's income and add it to the player's treasury """
 		## get the column for variable income
@@ -991,16 +1117,23 @@ class Game(models.Model):
 		if logging:
 			msg = "Varible income: Got a %s in game %s" % (die, self)
 			logging.info(msg)
-		## get a list of the ids of the major cities that generate income
-		majors = CityIncome.objects.filter(scenario=self.scenario)
-		majors_ids = majors.values_list('city', flat=True)
-		##
-		players = self.player_set.filter(user__isnull=False, eliminated=False)
-		for p in players:
-			i = p.get_income(die, majors_ids)
+		engine = IncomeEngine(self)
+		engine.load()
+		incomes = engine.calculate(die)
+		engine.apply(incomes)
+		for p in engine.players:
+			if not p in incomes:
+				continue
+			breakdown = incomes[p]
+			i = total_income(breakdown)
 			if i > 0:
-				p.add_ducats(i)
+				if signals:
+					signals.income_raised.send(sender=p, ducats=i, breakdown=breakdown)
+				if logging:
+					msg = "Player %s raised %s ducats." % (p.pk, i)
+					logging.info(msg)
 
+	@timing.timed
 	def check_loans(self):
 		""" Check if any loans have exceeded their terms. If so, apply the
 		penalties. """
@@ -1016,62 +1149,19 @@ class Game(models.Model):
 				loan.player.assassinate()
 				loan.delete()
 	
+	@timing.timed
 	def process_expenses(self):
-		## undo unconfirmed expenses
-		invalid_expenses = Expense.objects.filter(player__game=self, confirmed=False)
-		for e in invalid_expenses:
-			e.undo()
-		## log expenses
-		if signals:
-			for e in Expense.objects.filter(player__game=self, confirmed=True):
-				signals.expense_paid.send(sender=e)
-		## then, process famine reliefs
-		for e in Expense.objects.filter(player__game=self, type=0):
-			e.area.famine = False
-			e.area.save()
-		## then, delete the rebellions
-		for e in Expense.objects.filter(player__game=self, type=1):
-			Rebellion.objects.filter(area=e.area).delete()
-		## then, place new rebellions
-		for e in Expense.objects.filter(player__game=self, type__in=(2,3)):
-			try:
-				rebellion = Rebellion(area=e.area)
-				rebellion.save()
-			except:
-				continue
-		## then, delete bribes that are countered
-		expenses = Expense.objects.filter(player__game=self)
-		for e in expenses:
-			if e.is_bribe():
-				## get the sum of counter-bribes
-				cb = Expense.objects.filter(player__game=self, type=4, unit=e.unit).aggregate(Sum('ducats'))
-				if not cb['ducats__sum']:
-					cb['ducats__sum'] = 0
-				total_cost = get_expense_cost(e.type, e.unit) + cb['ducats__sum']
-				if total_cost > e.ducats:
-					e.delete()
-		## then, resolve the bribes for each bribed unit
-		bribed_ids = Expense.objects.filter(unit__player__game=self, type__in=(5,6,7,8,9)).values_list('unit', flat=True).distinct()
-		chosen = []
-		## TODO: if two bribes have the same value, decide randomly between them
-		for i in bribed_ids:
-			bribes = Expense.objects.filter(type__in=(5,6,7,8,9), unit__id=i).order_by('-ducats')
-			chosen.append(bribes[0])
-		## all bribes in 'chosen' are successful, and executed
-		for c in chosen:
-			if c.type in (5, 8): #disband unit
-				c.unit.delete()
-			elif c.type in (6, 9): #buy unit
-				c.unit.change_player(c.player)
-			elif c.type == 7: #to autonomous
-				c.unit.to_autonomous()
-		## finally, delete all the expenses
-		Expense.objects.filter(player__game=self).delete()
+		""" Resolves all the expenses of the phase. Ties between bribes are
+		decided randomly, with a seed that depends on the turn. """
+		resolver = ExpenseResolver(self)
+		resolver.load()
+		resolver.resolve()
 
 	def get_rebellions(self):
 		""" Returns a queryset with all the rebellions in this game """
 		return Rebellion.objects.filter(area__game=self)
 
+	@timing.timed
 	def process_assassinations(self):
 		""" Resolves all the assassination attempts """
 		attempts = Assassination.objects.filter(killer__game=self)
@@ -1123,44 +1213,45 @@ class Game(models.Model):
 			conflict_areas.append(area)
 		return conflict_areas
 
-	def filter_supports(self):
+	@timing.timed
+	def filter_supports(self, trace):
 		""" Checks which Units with support orders are being attacked and delete their
 		orders.
 		"""
 
-		info = u"Step 2: Cancel supports from units under attack.\n"
+		trace.step(u"Step 2: Cancel supports from units under attack.\n")
 		support_orders = Order.objects.filter(unit__player__game=self, code__exact='S')
 		for s in support_orders:
-			info += u"Checking order %s.\n" % s
+			trace.note(u"Checking order %s.\n", s)
 			if s.unit.type != 'G' and s.unit.area in self.get_conflict_areas():
 				attacks = Order.objects.filter(~Q(unit__player=s.unit.player) &
 												((Q(code__exact='-') & Q(destination=s.unit.area)) |
 												(Q(code__exact='=') & Q(unit__area=s.unit.area) &
 												Q(unit__type__exact='G'))))
 				if len(attacks) > 0:
-					info += u"Supporting unit is being attacked.\n"
+					trace.note(u"Supporting unit is being attacked.\n")
 					for a in attacks:
 						if (s.subcode == '-' and s.subdestination == a.unit.area) or \
 						(s.subcode == '=' and s.subtype in ['A','F'] and s.subunit.area == a.unit.area):
-							info += u"Support is not broken.\n"
+							trace.note(u"Support is not broken.\n")
 							continue
 						else:
-							info += u"Attack from %s breaks support.\n" % a.unit
+							trace.note(u"Attack from %s breaks support.\n", a.unit)
 							if signals:
 								signals.support_broken.send(sender=s.unit)
 							else:
 								self.log_event(UnitEvent, type=s.unit.type, area=s.unit.area.board_area, message=0)
 							s.delete()
 							break
-		return info
 
-	def filter_convoys(self):
+	@timing.timed
+	def filter_convoys(self, trace):
 		""" Checks which Units with C orders are being attacked. Checks if they
 		are going to be defeated, and if so, delete the C order. However, it
 		doesn't resolve the conflict
 		"""
 
-		info = u"Step 3: Cancel convoys by fleets that will be dislodged.\n"
+		trace.step(u"Step 3: Cancel convoys by fleets that will be dislodged.\n")
 		## find units attacking fleets
 		sea_attackers = Unit.objects.filter(Q(player__game=self),
 											(Q(order__code__exact='-') &
@@ -1186,60 +1277,60 @@ class Game(models.Model):
 				## no attacked convoying fleet is found 
 				continue
 			else:
-				info += u"Convoying %s is being attacked by %s.\n" % (defender, s)
+				trace.note(u"Convoying %s is being attacked by %s.\n", defender, s)
 				a_strength = Unit.objects.get_with_strength(self, id=s.id).strength
 				d_strength = Unit.objects.get_with_strength(self, id=defender.id).strength
 				if a_strength > d_strength:
 					d_order = defender.get_order()
 					if d_order:
-						info += u"%s can't convoy.\n" % defender
+						trace.note(u"%s can't convoy.\n", defender)
 						defender.delete_order()
 					else:
 						continue
-		return info
 	
-	def filter_unreachable_attacks(self):
+	@timing.timed
+	def filter_unreachable_attacks(self, trace):
 		""" Delete the orders of units trying to go to non-adjacent areas and not
 		having a convoy line.
 		"""
 
-		info = u"Step 4: Cancel attacks to unreachable areas.\n"
+		trace.step(u"Step 4: Cancel attacks to unreachable areas.\n")
 		attackers = Order.objects.filter(unit__player__game=self, code__exact='-')
 		for o in attackers:
 			is_fleet = (o.unit.type == 'F')
 			if not o.unit.area.board_area.is_adjacent(o.destination.board_area, is_fleet):
 				if is_fleet:
-					info += u"Impossible attack: %s.\n" % o
+					trace.note(u"Impossible attack: %s.\n", o)
 					o.delete()
 				else:
 					if not o.find_convoy_line():
-						info += u"Impossible attack: %s.\n" % o
+						trace.note(u"Impossible attack: %s.\n", o)
 						o.delete()
-		return info
 	
-	def resolve_auto_garrisons(self):
+	@timing.timed
+	def resolve_auto_garrisons(self, trace):
 		""" Units with '= G' orders in areas without a garrison, convert into garrison.
 		"""
 
-		info = u"Step 1: Garrisoning units.\n"
+		trace.step(u"Step 1: Garrisoning units.\n")
 		garrisoning = Unit.objects.filter(player__game=self,
 									order__code__exact='=',
 									order__type__exact='G')
 		for g in garrisoning:
-			info += u"%s tries to convert into garrison.\n" % g
+			trace.note(u"%s tries to convert into garrison.\n", g)
 			try:
 				defender = Unit.objects.get(player__game=self,
 										type__exact='G',
 										area=g.area)
 			except:
-				info += u"Success!\n"
+				trace.note(u"Success!\n")
 				g.convert('G')
 				g.delete_order()
 			else:
-				info += u"Fail: there is a garrison in the city.\n"
-		return info
+				trace.note(u"Fail: there is a garrison in the city.\n")
 
-	def resolve_conflicts(self):
+	@timing.timed
+	def resolve_conflicts(self, trace):
 		""" Conflict: When two or more units want to occupy the same area.
 		
 		This method takes all the units and decides which unit occupies each conflict
@@ -1248,7 +1339,7 @@ class Game(models.Model):
 
 		## units sorted (reverse) by a temporary strength attribute
 		## strength = 1 means unit without supports
-		info = u"Step 5: Process conflicts.\n"
+		trace.step(u"Step 5: Process conflicts.\n")
 		units = Unit.objects.list_with_strength(self)
 		conditioned_invasions = []
 		conditioned_origins = []
@@ -1260,10 +1351,10 @@ class Game(models.Model):
 			## they will not move
 			u_order = u.get_order()
 			if not u_order:
-				info += u"%s has no orders.\n" % u
+				trace.note(u"%s has no orders.\n", u)
 				continue
 			else:
-				info += u"%s was ordered: %s.\n" % (u, u_order)
+				trace.note(u"%s was ordered: %s.\n", u, u_order)
 				if finances and u_order.code == 'H':
 					## the unit counts for removing a rebellion
 					holding.append(u)
@@ -1271,16 +1362,16 @@ class Game(models.Model):
 					continue
 			##################
 			s = u.strength
-			info += u"Total strength = %s.\n" % s
+			trace.note(u"Total strength = %s.\n", s)
 			## rivals and defender are the units trying to enter into or stay
 			## in the same area as 'u'
 			rivals = u_order.get_rivals()
 			defender = u_order.get_defender()
-			info += u"Unit has %s rivals.\n" % len(rivals)
+			trace.note(u"Unit has %s rivals.\n", len(rivals))
 			conflict_area = u.get_attacked_area()
 			##
 			if conflict_area.standoff:
-				info += u"Trying to enter a standoff area.\n"
+				trace.note(u"Trying to enter a standoff area.\n")
 				#u.delete_order()
 				continue
 			else:
@@ -1290,19 +1381,19 @@ class Game(models.Model):
 			## if not, check for defenders
 			for r in rivals:
 				strength = Unit.objects.get_with_strength(self, id=r.id).strength
-				info += u"Rival %s has strength %s.\n" % (r, strength)
+				trace.note(u"Rival %s has strength %s.\n", r, strength)
 				if strength >= s: #in fact, strength cannot be greater
-					info += u"Rival wins.\n"
+					trace.note(u"Rival wins.\n")
 					standoff = True
 					exit
 				else:
 					## the rival is defeated and loses its orders
-					info += u"Deleting order of %s.\n" % r
+					trace.note(u"Deleting order of %s.\n", r)
 					r.delete_order()
 			## if there is a standoff, delete the order and all rivals' orders
 			if standoff:
 				conflict_area.mark_as_standoff()
-				info += u"Standoff in %s.\n" % conflict_area
+				trace.note(u"Standoff in %s.\n", conflict_area)
 				for r in rivals:
 					r.delete_order()
 				u.delete_order()
@@ -1316,11 +1407,11 @@ class Game(models.Model):
 					## a 'friend enemy' is always as strong as the invading unit
 					if defender.player == u.player:
 						strength = s
-						info += u"Defender is a friend.\n"
+						trace.note(u"Defender is a friend.\n")
 					else:
 						strength = Unit.objects.get_with_strength(self,
 														id=defender.id).strength
-					info += u"Defender %s has strength %s.\n" % (defender, strength)
+					trace.note(u"Defender %s has strength %s.\n", defender, strength)
 					## if attacker is not as strong as defender
 					if strength >= s:
 						## if the defender is trying to exchange areas with
@@ -1328,14 +1419,14 @@ class Game(models.Model):
 						## area
 						if defender.get_attacked_area() == u.area:			
 							defender.area.mark_as_standoff()
-							info += u"Trying to exchange areas.\n"
-							info += u"Standoff in %s.\n" % defender.area
+							trace.note(u"Trying to exchange areas.\n")
+							trace.note(u"Standoff in %s.\n", defender.area)
 						else:
 						## the invasion is conditioned to the defender leaving
-							info += u"%s's movement is conditioned.\n" % u
+							trace.note(u"%s's movement is conditioned.\n", u)
 							inv = Invasion(u, defender.area)
 							if u_order.code == '-':
-								info += u"%s might get empty.\n" % u.area
+								trace.note(u"%s might get empty.\n", u.area)
 								conditioned_origins.append(u.area)
 							elif u_order.code == '=':
 								inv.conversion = u_order.type
@@ -1347,26 +1438,26 @@ class Game(models.Model):
 						defender.save()
 						if u_order.code == '-':
 							u.invade_area(defender.area)
-							info += u"Invading %s.\n" % defender.area
+							trace.note(u"Invading %s.\n", defender.area)
 						elif u_order.code == '=':
-							info += u"Converting into %s.\n" % u_order.type
+							trace.note(u"Converting into %s.\n", u_order.type)
 							u.convert(u_order.type)
 						defender.delete_order()
 				## no defender means either that the area is empty *OR*
 				## that there is a unit trying to leave the area
 				else:
-					info += u"There is no defender.\n"
+					trace.note(u"There is no defender.\n")
 					try:
 						unit_leaving = Unit.objects.get(type__in=['A','F'],
 												area=conflict_area)
 					except ObjectDoesNotExist:
 						## if the province is empty, invade it
-						info += u"Province is empty.\n"
+						trace.note(u"Province is empty.\n")
 						if u_order.code == '-':
-							info += u"Invading %s.\n" % conflict_area
+							trace.note(u"Invading %s.\n", conflict_area)
 							u.invade_area(conflict_area)
 						elif u_order.code == '=':
-							info += u"Converting into %s.\n" % u_order.type
+							trace.note(u"Converting into %s.\n", u_order.type)
 							u.convert(u_order.type)
 					else:
 						## if the area is not empty, and the unit in province
@@ -1374,22 +1465,22 @@ class Game(models.Model):
 						## it invades the area, and the unit in the province
 						## must retreat (if it invades another area, it mustnt).
 						if unit_leaving.player != u.player and u.strength > 1:
-							info += u"There is a unit in %s, but attacker is supported.\n" % conflict_area
+							trace.note(u"There is a unit in %s, but attacker is supported.\n", conflict_area)
 							unit_leaving.must_retreat = u.area.board_area.code
 							unit_leaving.save()
 							if u_order.code == '-':
 								u.invade_area(unit_leaving.area)
-								info += u"Invading %s.\n" % unit_leaving.area
+								trace.note(u"Invading %s.\n", unit_leaving.area)
 							elif u_order.code == '=':
-								info += u"Converting into %s.\n" % u_order.type
+								trace.note(u"Converting into %s.\n", u_order.type)
 								u.convert(u_order.type)
 						## if the area is not empty, the invasion is conditioned
 						else:
-							info += u"Area is not empty and attacker isn't supported, or there is a friend\n"
-							info += u"%s movement is conditioned.\n" % u
+							trace.note(u"Area is not empty and attacker isn't supported, or there is a friend\n")
+							trace.note(u"%s movement is conditioned.\n", u)
 							inv = Invasion(u, conflict_area)
 							if u_order.code == '-':
-								info += u"%s might get empty.\n" % u.area
+								trace.note(u"%s might get empty.\n", u.area)
 								conditioned_origins.append(u.area)
 							elif u_order.code == '=':
 								inv.conversion = u_order.type
@@ -1402,11 +1493,11 @@ class Game(models.Model):
 		## to now empty areas
 		try_empty = True
 		while try_empty:
-			info += u"Looking for possible, conditioned invasions.\n"
+			trace.note(u"Looking for possible, conditioned invasions.\n")
 			try_empty = False
 			for ci in conditioned_invasions:
 				if ci.area.province_is_empty():
-					info += u"Found empty area in %s.\n" % ci.area
+					trace.note(u"Found empty area in %s.\n", ci.area)
 					if ci.unit.area in conditioned_origins:
 						conditioned_origins.remove(ci.unit.area)
 					if ci.conversion == '':
@@ -1420,13 +1511,13 @@ class Game(models.Model):
 		## cannot be made
 		try_impossible = True
 		while try_impossible:
-			info += u"Looking for impossible, conditioned.\n"
+			trace.note(u"Looking for impossible, conditioned.\n")
 			try_impossible = False
 			for ci in conditioned_invasions:
 				if not ci.area in conditioned_origins:
 					## the unit is trying to invade an area with a stationary
 					## unit
-					info += u"Found impossible invasion in %s.\n" % ci.area
+					trace.note(u"Found impossible invasion in %s.\n", ci.area)
 					ci.area.mark_as_standoff()
 					conditioned_invasions.remove(ci)
 					if ci.unit.area in conditioned_origins:
@@ -1435,13 +1526,13 @@ class Game(models.Model):
 					break
 		## at this point, if there are any conditioned_invasions, they form
 		## closed circuits, so all of them should be carried out
-		info += u"Resolving closed circuits.\n"
+		trace.note(u"Resolving closed circuits.\n")
 		for ci in conditioned_invasions:
 			if ci.conversion == '':
-				info += u"%s invades %s.\n" % (ci.unit, ci.area)
+				trace.note(u"%s invades %s.\n", ci.unit, ci.area)
 				ci.unit.invade_area(ci.area)
 			else:
-				info += u"%s converts into %s.\n" % (ci.unit, ci.conversion)
+				trace.note(u"%s converts into %s.\n", ci.unit, ci.conversion)
 				ci.unit.convert(ci.conversion)
 		## units in 'holding' that don't need to retreat, can put rebellions down
 		for h in holding:
@@ -1450,30 +1541,30 @@ class Game(models.Model):
 			else:
 				reb = h.area.has_rebellion(h.player, same=True)
 				if reb:
-					info += u"Rebellion in %s is put down.\n" % h.area
+					trace.note(u"Rebellion in %s is put down.\n", h.area)
 					reb.delete()
 		
-		info += u"End of conflicts processing"
-		return info
+		trace.note(u"End of conflicts processing")
 
-	def resolve_sieges(self):
+	@timing.timed
+	def resolve_sieges(self, trace):
 		## get units that are besieging but do not besiege a second time
-		info = u"Step 6: Process sieges.\n"
+		trace.step(u"Step 6: Process sieges.\n")
 		broken = Unit.objects.filter(Q(player__game=self,
 									besieging__exact=True),
 									~Q(order__code__exact='B'))
 		for b in broken:
-			info += u"Siege of %s is discontinued.\n" % b
+			trace.note(u"Siege of %s is discontinued.\n", b)
 			b.besieging = False
 			b.save()		
 		## get besieging units
 		besiegers = Unit.objects.filter(player__game=self,
 										order__code__exact='B')
 		for b in besiegers:
-			info += u"%s besieges " % b
+			trace.note(u"%s besieges ", b)
 			mode = ''
 			if b.player.assassinated:
-				info += u"\n%s belongs to an assassinated player.\n" % b
+				trace.note(u"\n%s belongs to an assassinated player.\n", b)
 				continue
 			try:
 				defender = Unit.objects.get(player__game=self,
@@ -1483,10 +1574,10 @@ class Game(models.Model):
 				reb = b.area.has_rebellion(b.player, same=True)
 				if reb and reb.garrisoned:
 					mode = 'rebellion'
-					info += u"a rebellion "
+					trace.note(u"a rebellion ")
 				else:
 					ok = False
-					info += u"Besieging an empty city. Ignoring.\n"
+					trace.note(u"Besieging an empty city. Ignoring.\n")
 					b.besieging = False
 					b.save()
 					continue
@@ -1494,11 +1585,11 @@ class Game(models.Model):
 				mode = 'garrison'
 			if mode != '':
 				if b.besieging:
-					info += u"for second time.\n"
+					trace.note(u"for second time.\n")
 					b.besieging = False
-					info += u"Siege is successful. "
+					trace.note(u"Siege is successful. ")
 					if mode == 'garrison':
-						info += u"Garrison disbanded.\n" 
+						trace.note(u"Garrison disbanded.\n")
 						if signals:
 							signals.unit_surrendered.send(sender=defender)
 						else:
@@ -1507,18 +1598,18 @@ class Game(models.Model):
 												message=2)
 						defender.delete()
 					elif mode == 'rebellion':
-						info += u"Rebellion is put down.\n"
+						trace.note(u"Rebellion is put down.\n")
 						reb.delete()
 					b.save()
 				else:
-					info += u"for first time.\n"
+					trace.note(u"for first time.\n")
 					b.besieging = True
 					if signals:
 						signals.siege_started.send(sender=b)
 					else:
 						self.log_event(UnitEvent, type=b.type, area=b.area.board_area, message=3)
 					if mode == 'garrison' and defender.player.assassinated:
-						info += u"Player is assassinated. Garrison surrenders\n"
+						trace.note(u"Player is assassinated. Garrison surrenders\n")
 						if signals:
 							signals.unit_surrendered.send(sender=defender)
 						else:
@@ -1529,18 +1620,17 @@ class Game(models.Model):
 						b.besieging = False	
 					b.save()
 			b.delete_order()
-		return info
 	
-	def announce_retreats(self):
-		info = u"Step 7: Retreats\n"
+	@timing.timed
+	def announce_retreats(self, trace):
+		trace.step(u"Step 7: Retreats\n")
 		retreating = Unit.objects.filter(player__game=self).exclude(must_retreat__exact='')
 		for u in retreating:
-			info += u"%s must retreat.\n" % u
+			trace.note(u"%s must retreat.\n", u)
 			if signals:
 				signals.forced_to_retreat.send(sender=u)
 			else:
 				self.log_event(UnitEvent, type=u.type, area=u.area.board_area, message=1)
-		return info
 
 	def preprocess_orders(self):
 		"""
@@ -1565,41 +1655,46 @@ class Game(models.Model):
 				if signals:
 					signals.order_placed.send(sender=o)
 	
+	@timing.timed
 	def process_orders(self):
 		""" Run a batch of methods in the correct order to process all the orders.
 		"""
 
 		self.preprocess_orders()
-		info = u"Processing orders in game %s\n" % self.slug
-		info += u"------------------------------\n\n"
+		trace = TurnTrace()
+		trace.step(u"Processing orders in game %s\n", self.slug)
+		trace.step(u"------------------------------\n\n")
 		## resolve =G that are not opposed
-		info += self.resolve_auto_garrisons()
-		info += u"\n"
+		self.resolve_auto_garrisons(trace)
+		trace.step(u"\n")
 		## delete supports from units in conflict areas
-		info += self.filter_supports()
-		info += u"\n"
+		self.filter_supports(trace)
+		trace.step(u"\n")
 		## delete convoys that will be invaded
-		info += self.filter_convoys()
-		info += u"\n"
+		self.filter_convoys(trace)
+		trace.step(u"\n")
 		## delete attacks to areas that are not reachable
-		info += self.filter_unreachable_attacks()
-		info += u"\n"
+		self.filter_unreachable_attacks(trace)
+		trace.step(u"\n")
 		## process conflicts
-		info += self.resolve_conflicts()
-		info += u"\n"
+		self.resolve_conflicts(trace)
+		trace.step(u"\n")
 		## resolve sieges
-		info += self.resolve_sieges()
-		info += u"\n"
-		info += self.announce_retreats()
-		info += u"--- END ---\n"
+		self.resolve_sieges(trace)
+		trace.step(u"\n")
+		self.announce_retreats(trace)
+		trace.step(u"--- END ---\n")
+		if not trace.is_enabled():
+			return
 		if logging:
-			logging.info(info)
+			logging.info(u"Orders processed in game %s (%s trace records)" % (self.slug, len(trace.records)))
 		turn_log = TurnLog(game=self, year=self.year,
 							season=self.season,
 							phase=self.phase,
-							log=info)
+							log=trace.encode())
 		turn_log.save()
 
+	@timing.timed
 	def process_retreats(self):
 		""" From the saved RetreaOrders, process the retreats. """
 
@@ -1619,6 +1714,7 @@ class Game(models.Model):
 				unit.retreat(order.area)
 				order.delete()
 	
+	@timing.timed
 	def update_controls(self):
 		""" Checks which GameAreas have been controlled by a Player and update them.
 		"""
@@ -1666,45 +1762,65 @@ class Game(models.Model):
 				return True
 		return False
 		
+	@timing.timed
 	def assign_scores(self):
+		""" Creates the Scores of the players and adds their points to the
+		profiles. Players with the same number of cities get the same score.
+		"""
+		if self._insert_scores() and signals:
+			signals.scores_assigned.send(sender=self)
+
+	def _insert_scores(self):
+		""" Inserts the Scores and updates the profiles in a single
+		transaction. Returns the number of scores. """
+		cities = dict(GameArea.objects.filter(game=self,
+							board_area__has_city=True,
+							player__isnull=False).order_by().values_list('player').annotate(Count('id')))
 		qual = []
-		for p in self.player_set.filter(user__isnull=False):
-			qual.append((p, p.number_of_cities()))
+		for p in self.player_set.filter(user__isnull=False).values('id', 'user', 'country'):
+			qual.append((p, cities.get(p['id'], 0)))
 		## sort the players by their number of cities, less cities go first
 		qual.sort(cmp=lambda x,y: cmp(x[1], y[1]), reverse=False)
 		zeros = len(qual) - len(SCORES)
 		assignation = SCORES + [0] * zeros
+		rows = []
 		for s in assignation:
-			try:
-				q = qual.pop()
-			except:
-				exit
-			else:
-				# add the number of cities to the score
-				score = Score(user=q[0].user, game=q[0].game,
-							country=q[0].country,
-							points = s + q[1],
-							cities = q[1])
-				score.save()
-				## add the points to the profile total_score
-				score.user.get_profile().total_score += score.points
-				score.user.get_profile().save()
-				## highest score = last score
-				while qual != [] and qual[-1][1] == q[1]:
-					tied = qual.pop()
-					score = Score(user=tied[0].user, game=tied[0].game,
-								country=tied[0].country,
-								points = s + tied[1],
-								cities = tied[1])
-					score.save()
-					## add the points to the profile total_score
-					score.user.get_profile().total_score += score.points
-					score.user.get_profile().save()
+			if qual == []:
+				break
+			q = qual.pop()
+			rows.append((q[0], s + q[1], q[1]))
+			## highest score = last score
+			while qual != [] and qual[-1][1] == q[1]:
+				tied = qual.pop()
+				rows.append((tied[0], s + tied[1], tied[1]))
+		if rows == []:
+			return 0
+		now = connection.ops.value_to_db_datetime(datetime.now())
+		qn = connection.ops.quote_name
+		sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(Score._meta.db_table),
+				", ".join([qn(c) for c in ('user_id', 'game_id', 'country_id',
+											'points', 'cities', 'position',
+											'created_at')]),
+				", ".join(["%s"] * 7))
+		values = [(p['user'], self.pk, p['country'], points, c, 0, now) for p, points, c in rows]
+		cursor = connection.cursor()
+		cursor.executemany(sql, values)
+		## add the points to the profiles total_score, with one query for each
+		## different number of points
+		users_by_points = {}
+		for p, points, c in rows:
+			users_by_points.setdefault(points, []).append(p['user'])
+		for points, users in users_by_points.items():
+			CondottieriProfile.objects.filter(user__id__in=users).update(total_score=F('total_score') + points)
+		transaction.set_dirty()
+		return len(rows)
+	_insert_scores = transaction.commit_on_success(_insert_scores)
 
 	def game_over(self):
 		self.phase = PHINACTIVE
 		self.finished = datetime.now()
 		self.save()
+		self.publish_phase()
 		if signals:
 			signals.game_finished.send(sender=self)
 		self.notify_players("game_over", {"game": self})
@@ -1725,6 +1841,7 @@ class Game(models.Model):
 	## notification methods
 	##------------------------
 
+	@timing.timed
 	def notify_players(self, label, extra_context={}, on_site=True):
 		if notification:
 			users = User.objects.filter(player__game=self,
@@ -1867,6 +1984,21 @@ class GameArea(models.Model):
 		return False
 			
 
+def add_karma(karma, user_id, k, reason):
+	""" Adds a karma change for the profile of a user to ``karma``, a
+	dictionary {(k, reason): [user ids]}. If ``karma`` is None, the change is
+	applied at once. """
+	if karma is None:
+		CondottieriProfile.objects.adjust_user_karma([user_id], k, reason)
+	else:
+		karma.setdefault((k, reason), []).append(user_id)
+
+def apply_karma(karma):
+	""" Applies the karma changes collected by ``add_karma``, with one query
+	for each change """
+	for (k, reason), user_ids in karma.items():
+		CondottieriProfile.objects.adjust_user_karma(user_ids, k, reason)
+
 def check_min_karma(sender, instance=None, **kwargs):
 	if isinstance(instance, CondottieriProfile):
 		if instance.karma < settings.KARMA_TO_JOIN:		
@@ -1881,6 +2013,11 @@ def check_min_karma(sender, instance=None, **kwargs):
 	
 models.signals.post_save.connect(check_min_karma, sender=CondottieriProfile)
 
+def check_min_karma_adjusted(sender, **kwargs):
+	check_min_karma(CondottieriProfile, instance=sender)
+
+karma_adjusted.connect(check_min_karma_adjusted)
+
 
 class Score(models.Model):
 	""" This class defines the scores that a user got in a finished game. """
@@ -2170,20 +2307,23 @@ class Player(models.Model):
 		else:
 			return True
 
-	def end_phase(self, forced=False):
+	def end_phase(self, forced=False, karma=None):
+		""" Marks the player as done. ``karma`` is an optional dictionary
+		that collects the karma changes (see ``add_karma``), so that they
+		are applied once for all the players of the phase. """
 		self.done = True
 		self.step = 0
 		self.save()
+		broker.publish(self.game_id, "player_done", {'player': self.pk})
 		if not forced:
 			if not self.game.fast and self.game.check_bonus_time():
 				## get a karma bonus
-				#self.user.stats.adjust_karma(1)
-				self.user.get_profile().adjust_karma(1)
+				add_karma(karma, self.user_id, 1, 'bonus_time')
 			## delete possible revolutions
 			Revolution.objects.filter(government=self).delete()
 			msg = "Player %s ended phase" % self.pk
 		else:
-			self.force_phase_change()
+			self.force_phase_change(karma)
 			msg = "Player %s forced to end phase" % self.pk
 		#self.game.check_next_phase()
 		if logging:
@@ -2266,10 +2406,10 @@ class Player(models.Model):
 			return 'safe_time'
 		return 'unsafe_time'
 	
-	def force_phase_change(self):
+	def force_phase_change(self, karma=None):
 		## the player didn't take his actions, so he loses karma
 		if not self.game.fast:
-			self.user.get_profile().adjust_karma(-10)
+			add_karma(karma, self.user_id, -10, 'forced_phase')
 		## if there is a revolution with an overthrowing player, change users
 		try:
 			rev = Revolution.objects.get(government=self)
@@ -2302,7 +2442,7 @@ class Player(models.Model):
 				self.user = rev.opposition
 				self.save()
 				rev.delete()
-				self.user.get_profile().adjust_karma(10)
+				add_karma(karma, self.user_id, 10, 'overthrow')
 
 	def unread_count(self):
 		""" Gets the number of unread received letters """
@@ -2313,84 +2453,6 @@ class Player(models.Model):
 			return 0
 	
 	
-	##
-	## Income calculation
-	##
-	def get_control_income(self, die, majors_ids, rebellion_ids):
-		""" Gets the sum of the control income of all controlled AND empty
-		provinces. Note that provinces affected by plague don't genearate
-		any income"""
-		gamearea_ids = self.gamearea_set.filter(famine=False).exclude(id__in=rebellion_ids).values_list('board_area', flat=True)
-		income = Area.objects.filter(id__in = gamearea_ids).aggregate(Sum('control_income'))
-
-		i =  income['control_income__sum']
-		if i is None:
-			return 0
-		
-		v = 0
-		for a in majors_ids:
-			if a in gamearea_ids:
-				city = Area.objects.get(id=a)
-				v += finances.get_ducats(city.code, die)
-
-		return income['control_income__sum'] + v
-
-	def get_occupation_income(self):
-		""" Gets the sum of the income of all the armies and fleets in not controlled areas """
-		units = self.unit_set.exclude(type="G").exclude(area__famine=True)
-		units = units.filter(~Q(area__player=self) | Q(area__player__isnull=True))
-
-		i = units.count()
-		if i > 0:
-			return i
-		return 0
-
-	def get_garrisons_income(self, die, majors_ids, rebellion_ids):
-		""" Gets the sum of the income of all the non-besieged garrisons in non-controlled areas
-		"""
-		## get garrisons in non-controlled areas
-		cond = ~Q(area__player=self)
-		cond |= Q(area__player__isnull=True)
-		cond |= (Q(area__player=self, area__famine=True))
-		cond |= (Q(area__player=self, area__id__in=rebellion_ids))
-		garrisons = self.unit_set.filter(type="G")
-		garrisons = garrisons.filter(cond)
-		garrisons = garrisons.values_list('area__board_area__id', flat=True)
-		if len(garrisons) > 0:
-			## get ids of gameareas where garrisons are under siege
-			sieges = Unit.objects.filter(player__game=self.game, besieging=True)
-			sieges = sieges.values_list('area__board_area__id', flat=True)
-			## get the income
-			income = Area.objects.filter(id__in=garrisons).exclude(id__in=sieges)
-			if income.count() > 0:
-				v = 0
-				for a in income:
-					if a.id in majors_ids:
-						v += finances.get_ducats(a.code, die)
-				income = income.aggregate(Sum('garrison_income'))
-				return income['garrison_income__sum'] + v
-		return 0
-
-	def get_variable_income(self, die):
-		""" Gets the variable income for the country """
-		v = finances.get_ducats(self.static_name, die, self.double_income)
-		## the player gets the variable income of conquered players
-		if self.game.configuration.conquering:
-			conquered = self.game.player_set.filter(conqueror=self)
-			for c in conquered:
-				v += finances.get_ducats(c.static_name, die, c.double_income)
-
-		return v
-
-	def get_income(self, die, majors_ids):
-		""" Gets the total income in one turn """
-		rebellion_ids = Rebellion.objects.filter(player=self).values_list('area', flat=True)
-		income = self.get_control_income(die, majors_ids, rebellion_ids)
-		income += self.get_occupation_income()
-		income += self.get_garrisons_income(die, majors_ids, rebellion_ids)
-		income += self.get_variable_income(die)
-		return income
-
 	def add_ducats(self, d):
 		""" Adds d to the ducats field of the player."""
 		self.ducats = F('ducats') + d
@@ -2467,8 +2529,8 @@ class UnitManager(models.Manager):
 		return u
 
 	def list_with_strength(self, game):
-		from django.db import connection
-		cursor = connection.cursor()
+		from django.db import connections
+		cursor = connections[self.db].cursor()
 		cursor.execute("SELECT u.id, \
 							u.type, \
 							u.area_id, \
@@ -2580,12 +2642,15 @@ class Unit(models.Model):
 		self.save()
 
 	def delete(self):
+		self.log_disband()
+		super(Unit, self).delete()
+
+	def log_disband(self):
 		if signals:
 			signals.unit_disbanded.send(sender=self)
 		else:
 			self.player.game.log_event(DisbandEvent, country=self.player.country,
 								type=self.type, area=self.area.board_area)
-		super(Unit, self).delete()
 	
 	def __unicode__(self):
 		return _("%(type)s in %(area)s") % {'type': self.get_type_display(), 'area': self.area}
@@ -3129,7 +3194,78 @@ class TurnLog(models.Model):
 		ordering = ['-timestamp',]
 
 	def __unicode__(self):
-		return self.log
+		return self.get_text()
+
+	def get_text(self):
+		""" Returns the log as text. Compressed traces are rendered here. """
+		return render_trace(self.log)
+
+class LiveEvent(models.Model):
+	""" A LiveEvent is a notice, stored by ``broker.DatabaseBroker``, that
+	something has changed in a game and that the clients must be updated.
+	"""
+
+	game = models.ForeignKey(Game)
+	kind = models.CharField(max_length=20)
+	## if recipient is set, only this user will get the event
+	recipient = models.ForeignKey(User, blank=True, null=True)
+	data = models.TextField(default="", blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		ordering = ['id',]
+
+	def __unicode__(self):
+		return "%s (%s)" % (self.kind, self.game_id)
+
+class TurnDiceManager(models.Manager):
+	def record(self, stream):
+		""" Saves the seed and the rolls of a stream returned by
+		``Game.get_dice_stream`` """
+		game_id, year, season, phase = stream.turn
+		self.filter(game__id=game_id, year=year, season=season, phase=phase).delete()
+		return self.create(game_id=game_id, year=year, season=season, phase=phase,
+						seed=stream.seed, rolls=stream.encode())
+
+class TurnDice(models.Model):
+	""" A TurnDice stores the seed and all the dice rolled, in order, while
+	a turn was processed.
+	"""
+
+	game = models.ForeignKey(Game)
+	year = models.PositiveIntegerField()
+	season = models.PositiveIntegerField(choices=SEASONS)
+	phase = models.PositiveIntegerField(choices=GAME_PHASES)
+	seed = models.CharField(max_length=32)
+	## one digit for each die
+	rolls = models.TextField(default="", blank=True)
+
+	objects = TurnDiceManager()
+
+	class Meta:
+		unique_together = (('game', 'year', 'season', 'phase'),)
+
+	def __unicode__(self):
+		return "%s %s %s %s: %s dice" % (self.game_id, self.year, self.season,
+										self.phase, len(self.rolls))
+
+class StepMetric(models.Model):
+	""" A StepMetric is the time (in milliseconds) and the number of queries
+	spent in a step of the processing of a phase. They are recorded by
+	``machiavelli.timing``.
+	"""
+
+	game = models.ForeignKey(Game)
+	year = models.PositiveIntegerField()
+	season = models.PositiveIntegerField(choices=SEASONS)
+	phase = models.PositiveIntegerField(choices=GAME_PHASES)
+	step = models.CharField(max_length=30, db_index=True)
+	elapsed = models.PositiveIntegerField()
+	queries = models.PositiveIntegerField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __unicode__(self):
+		return "%s: %s ms, %s queries" % (self.step, self.elapsed, self.queries)
 
 class Configuration(models.Model):
 	""" Defines the configuration options for each game. 
@@ -3411,6 +3547,12 @@ def whisper_order(sender, instance, **kw):
 
 models.signals.pre_save.connect(whisper_order, sender=Whisper)
 
+def publish_new_whisper(sender, instance, created, **kw):
+	if isinstance(instance, Whisper) and created:
+		broker.publish(instance.game_id, "whisper", {'order': instance.order})
+
+models.signals.post_save.connect(publish_new_whisper, sender=Whisper)
+
 class Invitation(models.Model):
 	""" A private game accepts only users that have been invited by the creator
 	of the game. """
@@ -3433,3 +3575,46 @@ def notify_new_invitation(sender, instance, created, **kw):
 
 models.signals.post_save.connect(notify_new_invitation, sender=Invitation)
 
+def touch_state_on_change(sender, instance, **kw):
+	""" Updates the state version of the game that ``instance`` belongs to,
+	so that the cached game pages are not considered fresh anymore. """
+	try:
+		if isinstance(instance, Game):
+			game_id = instance.pk
+		elif isinstance(instance, (Player, Whisper, GameArea)):
+			game_id = instance.game_id
+		elif isinstance(instance, Order):
+			if instance.player_id:
+				game_id = instance.player.game_id
+			else:
+				game_id = instance.unit.player.game_id
+		elif isinstance(instance, (Expense, Unit, Loan)):
+			game_id = instance.player.game_id
+		elif isinstance(instance, Revolution):
+			game_id = instance.government.game_id
+		elif isinstance(instance, Assassination):
+			game_id = instance.killer.game_id
+		else:
+			return
+	except ObjectDoesNotExist:
+		## the related objects are being deleted with the game
+		return
+	touch_game_state(game_id)
+
+models.signals.post_save.connect(touch_state_on_change, sender=Game)
+models.signals.post_save.connect(touch_state_on_change, sender=Player)
+models.signals.post_save.connect(touch_state_on_change, sender=Order)
+models.signals.post_delete.connect(touch_state_on_change, sender=Order)
+models.signals.post_save.connect(touch_state_on_change, sender=Expense)
+models.signals.post_delete.connect(touch_state_on_change, sender=Expense)
+models.signals.post_save.connect(touch_state_on_change, sender=Unit)
+models.signals.post_delete.connect(touch_state_on_change, sender=Unit)
+models.signals.post_save.connect(touch_state_on_change, sender=GameArea)
+models.signals.post_save.connect(touch_state_on_change, sender=Revolution)
+models.signals.post_delete.connect(touch_state_on_change, sender=Revolution)
+models.signals.post_save.connect(touch_state_on_change, sender=Assassination)
+models.signals.post_delete.connect(touch_state_on_change, sender=Assassination)
+models.signals.post_save.connect(touch_state_on_change, sender=Loan)
+models.signals.post_delete.connect(touch_state_on_change, sender=Loan)
+models.signals.post_delete.connect(touch_state_on_change, sender=Expense)
+models.signals.post_save.connect(touch_state_on_change, sender=Whisper)
@@ -0,0 +1,332 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module replays the adjudication of a recorded game, without
+touching the game in the database.
+
+The replay runs the same ``Game.process_orders`` code in a separate database,
+that should be an in-memory SQLite database. It needs these settings::
+
+	DATABASES['replay'] = {
+		'ENGINE': 'django.db.backends.sqlite3',
+		'NAME': ':memory:',
+	}
+	DATABASE_ROUTERS = ['machiavelli.replay.ReplayRouter']
+
+While a replay is active in a thread, ``ReplayRouter`` sends all the queries
+of that thread to the replay database.
+
+For each orders phase of the game, the engine:
+
+1. Loads the state at the beginning of the season from the snapshot of the
+   previous season (or from the scenario setup, for the first season), and
+   applies the units placed and disbanded in the reinforcements phase.
+
+2. Creates the orders from the ``OrderEvent`` of the phase, and the dice
+   stream from the ``TurnDice`` of the phase.
+
+3. Runs ``Game.process_orders`` and compares the events that it logs with the
+   recorded events of the phase.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+
+import machiavelli.dice as dice
+import machiavelli.snapshots as snapshots
+
+REPLAY_DB = getattr(settings, 'REPLAY_DATABASE', 'replay')
+
+## events logged by process_orders, and the messages of UnitEvent that
+## process_orders logs
+ADJUDICATION_EVENTS = ('MovementEvent', 'ConversionEvent', 'StandoffEvent', 'UnitEvent')
+ADJUDICATION_UNIT_MESSAGES = (0, 1, 2, 3)
+
+_state = threading.local()
+
+class ReplayRouter(object):
+	""" Sends the queries to the replay database while a replay is active.
+	Related objects of an instance are read from the database of the
+	instance, so that the recorded events can still be read. """
+	def _db(self, hints):
+		if not getattr(_state, 'active', False):
+			return None
+		instance = hints.get('instance')
+		if instance is not None and instance._state.db:
+			return instance._state.db
+		return REPLAY_DB
+
+	def db_for_read(self, model, **hints):
+		return self._db(hints)
+
+	def db_for_write(self, model, **hints):
+		return self._db(hints)
+
+class ReplayError(Exception):
+	pass
+
+class TurnResult(object):
+	def __init__(self, year, season):
+		self.year = year
+		self.season = season
+		self.missing = []
+		self.unexpected = []
+		self.skipped_orders = 0
+		self.elapsed = 0
+
+	def ok(self):
+		return not self.missing and not self.unexpected
+
+def copy_rows(queryset):
+	""" Copies the rows of ``queryset`` from the default database to the
+	replay database """
+	for obj in queryset.using(DEFAULT_DB_ALIAS):
+		obj.save(using=REPLAY_DB, force_insert=True)
+
+def outcome(events):
+	""" Returns a sorted list of (classname, text) with the adjudication
+	events in ``events`` """
+	result = []
+	for e in events:
+		if not e.classname in ADJUDICATION_EVENTS:
+			continue
+		concrete = e.get_concrete()
+		if e.classname == 'UnitEvent' and not concrete.message in ADJUDICATION_UNIT_MESSAGES:
+			continue
+		result.append((e.classname, unicode(concrete)))
+	result.sort()
+	return result
+
+class ReplayEngine(object):
+	def __init__(self, game):
+		""" ``game`` is a Game read from the default database """
+		self.source = game
+
+	def setup(self):
+		""" Creates the tables in the replay database and copies the board,
+		the scenario and the players of the game """
+		from django.contrib.auth.models import User
+		from machiavelli import models
+		if not REPLAY_DB in settings.DATABASES:
+			raise ReplayError("The database '%s' is not defined" % REPLAY_DB)
+		options = {'database': REPLAY_DB, 'interactive': False, 'verbosity': 0}
+		if 'south' in settings.INSTALLED_APPS:
+			options['migrate_all'] = True
+		call_command('syncdb', **options)
+		game = self.source
+		for model in (models.Country, models.SpecialUnit, models.Area, models.Scenario):
+			copy_rows(model.objects.all())
+		copy_rows(models.Area.borders.through.objects.all())
+		for model in (models.Home, models.Setup, models.Treasury, models.CityIncome,
+					models.DisabledArea):
+			copy_rows(model.objects.filter(scenario=game.scenario))
+		copy_rows(User.objects.filter(player__game=game))
+		copy_rows(models.Game.objects.filter(id=game.id))
+		copy_rows(models.Configuration.objects.filter(game=game))
+		copy_rows(models.Player.objects.filter(game=game))
+		self.activate()
+		try:
+			self.game = models.Game.objects.get(id=game.id)
+			self.game.create_game_board()
+			self.areas = dict([(a.board_area.code, a) for a in
+							self.game.gamearea_set.select_related('board_area')])
+			self.players = list(self.game.player_set.all())
+		finally:
+			self.deactivate()
+
+	def activate(self):
+		_state.active = True
+
+	def deactivate(self):
+		_state.active = False
+
+	def _player_of_country(self, country_id):
+		for p in self.players:
+			if p.country_id == country_id:
+				return p
+		return None
+
+	def load_initial_state(self):
+		""" Places the units of the scenario setup and the home control markers """
+		from machiavelli.models import Unit
+		self.game.home_control_markers()
+		for p in self.players:
+			if p.user_id is not None:
+				p.place_initial_units()
+		autonomous = self._player_of_country(None)
+		for s in self.game.get_autonomous_setups():
+			if s.unit_type and s.area.code in self.areas:
+				Unit(type='G', area=self.areas[s.area.code], player=autonomous).save()
+
+	def load_state(self, state):
+		""" Replaces the units and the control of the areas with ``state`` """
+		from machiavelli.models import Unit, GameArea, Player
+		Unit.objects.filter(player__game=self.game).delete()
+		for id, (player, type, code, besieging, must_retreat, placed, paid, cost,
+				power, loyalty) in state['units'].items():
+			if player is None:
+				raise ReplayError("The snapshot has units without player")
+			Unit(id=int(id), type=type, area=self.areas[code], player_id=player,
+				besieging=besieging, must_retreat=must_retreat, placed=placed,
+				paid=paid, cost=cost, power=power, loyalty=loyalty).save()
+		for code, (player, famine, storm) in state['areas'].items():
+			if code in self.areas:
+				GameArea.objects.filter(id=self.areas[code].id).update(player=player,
+									famine=famine, storm=storm, standoff=False)
+		for id, values in state['players'].items():
+			values = snapshots.player_values(values)
+			del values['country']
+			Player.objects.filter(id=int(id)).update(**values)
+
+	def _find_unit(self, country_id, type, area):
+		from machiavelli.models import Unit
+		units = Unit.objects.filter(player__game=self.game, type=type,
+								area=self.areas[area.code])
+		for u in units:
+			if u.player.country_id == country_id:
+				return u
+		if len(units) == 1:
+			## the unit may have been bought by other country
+			return units[0]
+		return None
+
+	def apply_reinforcements(self, events):
+		""" Places and disbands the units recorded in the reinforcements
+		phase """
+		from machiavelli.models import Unit
+		for e in events:
+			concrete = e.get_concrete()
+			if e.classname == 'NewUnitEvent':
+				player = self._player_of_country(concrete.country_id)
+				Unit(type=concrete.type, area=self.areas[concrete.area.code],
+					player=player).save()
+			elif e.classname == 'DisbandEvent':
+				unit = self._find_unit(concrete.country_id, concrete.type, concrete.area)
+				if unit:
+					super(Unit, unit).delete()
+
+	def create_orders(self, events, result):
+		""" Creates the orders recorded in the ``OrderEvent`` of the phase """
+		from machiavelli.models import Order
+		for e in events:
+			if e.classname != 'OrderEvent':
+				continue
+			o = e.get_concrete()
+			unit = self._find_unit(o.country_id, o.type, o.origin)
+			if unit is None:
+				result.skipped_orders += 1
+				continue
+			subunit = None
+			if o.suborigin_id:
+				subunit = self._find_unit(None, o.subtype, o.suborigin)
+			order = Order(unit=unit, code=o.code, type=o.conversion,
+						subunit=subunit, subcode=o.subcode, subtype=o.subconversion,
+						player=self._player_of_country(o.country_id), confirmed=True)
+			if o.destination_id:
+				order.destination = self.areas[o.destination.code]
+			if o.subdestination_id:
+				order.subdestination = self.areas[o.subdestination.code]
+			order.save()
+
+	def before_processing(self, game, rolls):
+		""" Called when the board and the orders of a turn are ready, before
+		processing the orders """
+		pass
+
+	def process(self, game):
+		game.process_orders()
+
+	def replay_turn(self, year, season):
+		""" Replays the orders phase of (``year``, ``season``) and returns a
+		``TurnResult`` """
+		from machiavelli.models import PHREINFORCE, PHORDERS, TurnDice
+		from condottieri_events.models import game_events
+		result = TurnResult(year, season)
+		recorded = list(game_events(self.source).using(DEFAULT_DB_ALIAS).filter(year=year,
+												season=season).order_by('id'))
+		orders = [e for e in recorded if e.phase == PHORDERS]
+		if not [e for e in orders if e.classname == 'OrderEvent']:
+			return None
+		expected = outcome(orders)
+		try:
+			rolls = TurnDice.objects.using(DEFAULT_DB_ALIAS).get(game=self.source,
+								year=year, season=season, phase=PHORDERS).rolls
+		except TurnDice.DoesNotExist:
+			rolls = None
+		if season == 1:
+			previous = (year - 1, 3)
+		else:
+			previous = (year, season - 1)
+		state = snapshots.load_state(self.source.id, *previous)
+		self.activate()
+		try:
+			if state is None:
+				if (year, season) != (self.source.scenario.start_year, 1):
+					raise ReplayError("There is no snapshot of %s, season %s" % previous)
+				self.load_initial_state()
+			else:
+				self.load_state(state)
+			self.apply_reinforcements([e for e in recorded if e.phase == PHREINFORCE])
+			game = self.game
+			game.year, game.season, game.phase = year, season, PHORDERS
+			game.save()
+			self.create_orders(orders, result)
+			if rolls is not None:
+				dice.start(dice.DiceStream(replay=dice.decode(rolls)))
+			self.before_processing(game, rolls)
+			started = time.time()
+			try:
+				self.process(game)
+			finally:
+				dice.stop()
+			result.elapsed = time.time() - started
+			replayed = list(game_events(game).filter(year=year, season=season,
+												phase=PHORDERS))
+			got = outcome(replayed)
+		finally:
+			self.deactivate()
+		for e in expected:
+			if e in got:
+				got.remove(e)
+			else:
+				result.missing.append(e)
+		result.unexpected = got
+		return result
+
+	def turns(self):
+		""" Returns a sorted list of (year, season) with the recorded orders
+		phases """
+		from machiavelli.models import PHORDERS
+		from condottieri_events.models import game_events
+		turns = game_events(self.source).using(DEFAULT_DB_ALIAS).filter(phase=PHORDERS,
+						classname='OrderEvent').values_list('year', 'season').distinct()
+		return sorted(set(turns))
+
+	def run(self):
+		""" Replays all the recorded turns. Returns a list of ``TurnResult`` """
+		self.setup()
+		results = []
+		for year, season in self.turns():
+			result = self.replay_turn(year, season)
+			if result is not None:
+				results.append(result)
+		return results
@@ -0,0 +1,142 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module restores a game to a turn recorded in its snapshots.
+
+Restoring the snapshot of (year, season) puts the game at the beginning of the
+following season, with the units, the control of the areas and the players
+as they were. All the orders, retreat orders, expenses and assassinations
+are deleted, and the flags of the players that only last one season are
+reset. Everything is done in a single transaction, with bulk queries. The
+state version of the game and the cached log pages of the seasons that will
+be played again are cleared.
+"""
+
+from datetime import datetime
+import time
+
+from django.db import connection, transaction
+
+import condottieri_events.paginator as events_paginator
+import machiavelli.snapshots as snapshots
+
+class RestoreError(Exception):
+	pass
+
+def next_season(year, season):
+	if season == 3:
+		return year + 1, 1
+	return year, season + 1
+
+def _restore(game, state, year, season):
+	""" Writes ``state`` in the database and puts the game at the beginning of
+	the season that follows (``year``, ``season``). Returns a dictionary with
+	the number of rows changed in each table. """
+	from machiavelli.models import Unit, GameArea, Player, Order, RetreatOrder, \
+		Expense, Assassination, Rebellion, PHREINFORCE, PHORDERS
+	counts = {}
+	## clear the actions of the players
+	for name, queryset in (('orders', Order.objects.filter(unit__player__game=game)),
+						('retreat orders', RetreatOrder.objects.filter(unit__player__game=game)),
+						('expenses', Expense.objects.filter(player__game=game)),
+						('assassinations', Assassination.objects.filter(killer__game=game))):
+		counts[name] = queryset.count()
+		queryset.delete()
+	## recreate the units
+	areas = dict(game.gamearea_set.values_list('board_area__code', 'id'))
+	units = Unit.objects.filter(player__game=game)
+	counts['units deleted'] = units.count()
+	units.delete()
+	rows = []
+	for id, (player, type, code, besieging, must_retreat, placed, paid, cost,
+			power, loyalty) in state['units'].items():
+		if player is None or not code in areas:
+			raise RestoreError("Unit %s can't be restored" % id)
+		rows.append((int(id), type, areas[code], player, besieging, must_retreat,
+					placed, paid, cost, power, loyalty))
+	if rows:
+		qn = connection.ops.quote_name
+		columns = ('id', 'type', 'area_id', 'player_id', 'besieging', 'must_retreat',
+				'placed', 'paid', 'cost', 'power', 'loyalty')
+		cursor = connection.cursor()
+		cursor.executemany("INSERT INTO %s (%s) VALUES (%s)" % (qn(Unit._meta.db_table),
+					", ".join([qn(c) for c in columns]), ", ".join(["%s"] * len(columns))),
+					rows)
+		transaction.set_dirty()
+	counts['units created'] = len(rows)
+	## restore the control of the areas, with one query for each combination
+	## of values
+	if state['areas']:
+		groups = {}
+		for code, (player, famine, storm) in state['areas'].items():
+			groups.setdefault((player, famine, storm), []).append(code)
+		counts['areas'] = 0
+		for (player, famine, storm), codes in groups.items():
+			counts['areas'] += GameArea.objects.filter(game=game,
+									board_area__code__in=codes).update(player=player,
+									famine=famine, storm=storm, standoff=False)
+		## rebellions against players that no longer control the area
+		rebellions = Rebellion.objects.filter(area__game=game)
+		for reb in rebellions.select_related('area'):
+			if reb.area.player_id != reb.player_id:
+				reb.delete()
+	## restore the players, and reset the flags that only last one season
+	counts['players'] = game.player_set.update(done=False, assassinated=False,
+									has_sentenced=False, step=0)
+	for id, values in state['players'].items():
+		values = snapshots.player_values(values)
+		del values['country']
+		Player.objects.filter(id=int(id), game=game).update(**values)
+	## put the game in the next season
+	game.year, game.season = next_season(year, season)
+	game.phase = PHORDERS
+	if game.season == 1:
+		## as in Game.all_players_done, spring begins with the reinforcements
+		## if playing with finances, or if any player has units to place
+		if game.configuration.finances:
+			game.phase = PHREINFORCE
+		else:
+			for p in game.player_set.all():
+				if p.units_to_place() != 0:
+					game.phase = PHREINFORCE
+					break
+	game.last_phase_change = datetime.now()
+	game.save()
+	game.touch_state()
+	return counts
+_restore = transaction.commit_on_success(_restore)
+
+def restore_turn(game, year, season):
+	""" Restores the snapshot of (``year``, ``season``). Returns a tuple with
+	the dictionary of changed rows and the seconds that it took. """
+	started = time.time()
+	state = snapshots.load_state(game.id, year, season)
+	if state is None:
+		raise RestoreError("There is no snapshot of %s, season %s" % (year, season))
+	current = (game.year, game.season)
+	counts = _restore(game, state, year, season)
+	## the seasons after the restored one will be played again, so their
+	## cached log pages are no longer valid
+	events_paginator.clear_cache(game.log_cache_prefix(), next_season(year, season), current)
+	game.clear_phase_cache()
+	game.reset_players_cache()
+	## the pages rendered while the restore was running may have been cached
+	## with the version set inside the transaction
+	game.touch_state()
+	game.make_map()
+	return counts, time.time() - started
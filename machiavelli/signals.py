@@ -53,7 +53,18 @@ plague_placed = Signal(providing_args=[])
 rebellion_started = Signal(providing_args=[])
 country_excommunicated = Signal(providing_args=[])
 country_forgiven = Signal(providing_args=[])
-income_raised = Signal(providing_args=["ducats"])
+income_raised = Signal(providing_args=["ducats", "breakdown"])
 expense_paid = Signal(providing_args=[])
 player_assassinated = Signal(providing_args=[])
 game_finished = Signal(providing_args=[])
+## these signals are sent by Game when the phase is processed after all the
+## players are done
+phase_processing_started = Signal(providing_args=[])
+phase_processing_finished = Signal(providing_args=[])
+phase_processing_failed = Signal(providing_args=[])
+## phase_processed is sent by Game when the results of the phase are ready,
+## before the game is saved in the next phase and the change is published
+phase_processed = Signal(providing_args=[])
+## scores_assigned is sent by Game when the scores are inserted in bulk, since
+## no post_save signal is sent for them
+scores_assigned = Signal(providing_args=[])
@@ -0,0 +1,157 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module simulates the random rules of the game, to check the balance
+of the disaster tables in ``machiavelli.disasters`` and the income table in
+``machiavelli.finances``.
+
+The simulation rolls the dice exactly as ``disasters.roll`` and
+``Game.assign_incomes`` do. Note that, as in ``disasters.get_codes``, a row
+or column roll of 0 (a 2 in the dice) does not affect any area, but the other
+roll of the same season still does.
+
+If NumPy is installed, the seasons are simulated in vectorized arrays, and
+millions of seasons take a few seconds. Otherwise, a slower pure Python
+simulation is used.
+"""
+
+import random
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from machiavelli import disasters, finances
+
+## year rolls that select a row and a column
+ROW_YEARS = (2, 3, 6)
+COLUMN_YEARS = (4, 5, 6)
+
+def table_index(table):
+	""" Returns a dictionary {code: (rows, columns)} with the indexes of the
+	rows and columns where each code appears in ``table`` """
+	index = {}
+	for r, row in enumerate(table):
+		for c, code in enumerate(row):
+			if code == '':
+				continue
+			rows, columns = index.setdefault(code, (set(), set()))
+			rows.add(r)
+			columns.add(c)
+	return index
+
+def exact_disasters(table):
+	""" Returns a dictionary {code: probability} with the exact probability
+	of each area being hit in a season, for comparison """
+	index = table_index(table)
+	hits = dict([(code, 0.) for code in index.keys()])
+	## probability of each result of 2d6 - 2
+	p2d6 = [0.] * 11
+	for a in range(1, 7):
+		for b in range(1, 7):
+			p2d6[a + b - 2] += 1. / 36
+	for year in range(1, 7):
+		rows = year in ROW_YEARS and range(0, 11) or [None]
+		columns = year in COLUMN_YEARS and range(0, 11) or [None]
+		for r in rows:
+			for c in columns:
+				p = 1. / 6
+				if r is not None:
+					p *= p2d6[r]
+				if c is not None:
+					p *= p2d6[c]
+				## a roll of 0 does not hit any area
+				for code, (code_rows, code_columns) in index.items():
+					if (r and r in code_rows) or (c and c in code_columns):
+						hits[code] += p
+	return hits
+
+def _roll_2d6(rng, n):
+	return rng.randint(1, 7, n) + rng.randint(1, 7, n) - 2
+
+def simulate_disasters(table, seasons, seed=None):
+	""" Returns a dictionary {code: probability} with the frequency of each
+	area being hit in ``seasons`` simulated seasons """
+	index = table_index(table)
+	if numpy is None:
+		return _simulate_disasters_python(index, seasons, seed)
+	rng = numpy.random.RandomState(seed)
+	year = rng.randint(1, 7, seasons)
+	row = _roll_2d6(rng, seasons)
+	column = _roll_2d6(rng, seasons)
+	row_active = numpy.in1d(year, ROW_YEARS) & (row != 0)
+	column_active = numpy.in1d(year, COLUMN_YEARS) & (column != 0)
+	hits = {}
+	for code, (rows, columns) in index.items():
+		hit = (row_active & numpy.in1d(row, list(rows))) | \
+			(column_active & numpy.in1d(column, list(columns)))
+		hits[code] = hit.mean()
+	return hits
+
+def _simulate_disasters_python(index, seasons, seed):
+	rng = random.Random(seed)
+	counts = dict([(code, 0) for code in index.keys()])
+	for i in xrange(seasons):
+		year = rng.randint(1, 6)
+		row = rng.randint(1, 6) + rng.randint(1, 6) - 2
+		column = rng.randint(1, 6) + rng.randint(1, 6) - 2
+		if not (year in ROW_YEARS and row):
+			row = None
+		if not (year in COLUMN_YEARS and column):
+			column = None
+		if row is None and column is None:
+			continue
+		for code, (rows, columns) in index.items():
+			if row in rows or column in columns:
+				counts[code] += 1
+	return dict([(code, float(c) / seasons) for code, c in counts.items()])
+
+def simulate_income(seasons, seed=None, double=False):
+	""" Returns a dictionary {row: (mean, deviation, {ducats: probability})}
+	with the variable income of each country or city in ``finances.INCOME_TABLE`` """
+	result = {}
+	if numpy is not None:
+		rng = numpy.random.RandomState(seed)
+		die = rng.randint(1, 7, seasons)
+		for name in finances.INCOME_TABLE.keys():
+			values = numpy.array([finances.get_ducats(name, d, double) for d in range(7)])
+			ducats = values[die]
+			counts = numpy.bincount(ducats)
+			dist = {}
+			for v, c in enumerate(counts):
+				if c:
+					dist[v] = float(c) / seasons
+			result[name] = (ducats.mean(), ducats.std(), dist)
+		return result
+	rng = random.Random(seed)
+	dice = [rng.randint(1, 6) for i in xrange(seasons)]
+	for name in finances.INCOME_TABLE.keys():
+		counts = {}
+		total = 0
+		squares = 0
+		for d in dice:
+			v = finances.get_ducats(name, d, double)
+			counts[v] = counts.get(v, 0) + 1
+			total += v
+			squares += v * v
+		mean = float(total) / seasons
+		deviation = max(float(squares) / seasons - mean * mean, 0) ** 0.5
+		dist = dict([(v, float(c) / seasons) for v, c in counts.items()])
+		result[name] = (mean, deviation, dist)
+	return result
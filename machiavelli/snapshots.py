@@ -0,0 +1,381 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module saves a snapshot of the state of a game when each season
+ends, so that a previous turn can be restored if an error happens. The
+snapshot of (year, season) is the state at the beginning of the next season.
+
+The snapshots of a game are kept in a binary file, ``<game id>.snp``, that
+has this layout::
+
+	magic ("MSNP" and a version byte)
+	record 1
+	record 2
+	...
+	record n
+	index
+	trailer (number of index entries, offset of the index, "MIDX")
+
+Each record is a header (length of the data, year, season and kind) followed
+by the zlib compressed JSON data. A record of kind ``FULL`` has the whole
+state of the game. A record of kind ``DELTA`` only has what changed since the
+previous record. A full record is written every ``KEYFRAME_INTERVAL`` records,
+so that reading any turn only needs a few records. The index has an entry
+for each record, with its year, season, offset and the offset of its full
+record, so that any turn can be read without reading the whole file.
+
+A new turn is appended after the trailer, with a new index and trailer, so
+the file is never rewritten and the previous index stays valid until the new
+one is complete. The old indexes are left in the file, but they are not read
+again. The file is only rewritten when a turn that was already recorded is
+replaced.
+
+A state is a dictionary with three sections:
+
+* ``units``: {unit id: [player id, type, area code, besieging, must retreat, placed, paid, cost, power, loyalty]}
+
+* ``areas``: {area code: [player id, famine, storm]}
+
+* ``players``: {player id: [country id, ducats, eliminated, conqueror id,
+  excommunicated, is excommunicated, pope excommunicated, double income,
+  defaulted]} (``PLAYER_FIELDS``). Older snapshots only have the first four
+  fields, and the others take the values in ``PLAYER_DEFAULTS``.
+
+The old XML snapshots (``<game id>.snap``) can be converted with
+``convert_xml``. They only have the units, so the other sections of the
+converted states are empty.
+"""
+
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.utils import simplejson
+
+SNAPSHOTS_DIR = os.path.join(settings.PROJECT_ROOT, 'machiavelli/media/machiavelli/maps/snapshots')
+
+MAGIC = "MSNP\x01"
+INDEX_MAGIC = "MIDX"
+## length, year, season, kind
+RECORD_HEADER = struct.Struct(">IHBB")
+## year, season, offset, offset of the full record
+INDEX_ENTRY = struct.Struct(">HBII")
+## number of entries, offset of the index, magic
+TRAILER = struct.Struct(">II4s")
+
+FULL = 0
+DELTA = 1
+
+KEYFRAME_INTERVAL = getattr(settings, 'SNAPSHOT_KEYFRAME_INTERVAL', 10)
+
+SECTIONS = ('units', 'areas', 'players')
+UNIT_FIELDS = ('player', 'type', 'area__board_area__code', 'besieging', 'must_retreat',
+				'placed', 'paid', 'cost', 'power', 'loyalty')
+AREA_FIELDS = ('player', 'famine', 'storm')
+PLAYER_FIELDS = ('country', 'ducats', 'eliminated', 'conqueror', 'excommunicated',
+				'is_excommunicated', 'pope_excommunicated', 'double_income', 'defaulted')
+## values of the player fields that were not captured by older snapshots
+PLAYER_DEFAULTS = {
+	'excommunicated': None,
+	'is_excommunicated': False,
+	'pope_excommunicated': False,
+	'double_income': False,
+	'defaulted': False,
+}
+
+class SnapshotError(Exception):
+	pass
+
+def snapshot_path(game_id):
+	return os.path.join(SNAPSHOTS_DIR, "%s.snp" % game_id)
+
+def empty_state():
+	return dict([(s, {}) for s in SECTIONS])
+
+def player_values(values):
+	""" Returns a dictionary with the fields of a player in a state """
+	result = dict(PLAYER_DEFAULTS)
+	result.update(zip(PLAYER_FIELDS, values))
+	return result
+
+def capture(game):
+	""" Returns the current state of ``game``, with one query for each section """
+	from machiavelli.models import Unit
+	state = empty_state()
+	for row in Unit.objects.filter(player__game=game).values_list('id', *UNIT_FIELDS):
+		state['units'][str(row[0])] = list(row[1:])
+	for row in game.gamearea_set.values_list('board_area__code', *AREA_FIELDS):
+		state['areas'][row[0]] = list(row[1:])
+	for row in game.player_set.values_list('id', *PLAYER_FIELDS):
+		state['players'][str(row[0])] = list(row[1:])
+	return state
+
+def diff(old, new):
+	""" Returns the changes from state ``old`` to state ``new`` """
+	delta = {}
+	for s in SECTIONS:
+		changed = {}
+		for k, v in new[s].items():
+			if old[s].get(k) != v:
+				changed[k] = v
+		removed = [k for k in old[s].keys() if not k in new[s]]
+		delta[s] = {'set': changed, 'del': removed}
+	return delta
+
+def patch(state, delta):
+	""" Returns a new state with ``delta`` applied to ``state`` """
+	new = {}
+	for s in SECTIONS:
+		section = dict(state[s])
+		section.update(delta[s]['set'])
+		for k in delta[s]['del']:
+			section.pop(k, None)
+		new[s] = section
+	return new
+
+def read_index(fd):
+	""" Returns the list of index entries and the offset of the index """
+	fd.seek(0, 2)
+	size = fd.tell()
+	if size < len(MAGIC) + TRAILER.size:
+		raise SnapshotError("File is too short")
+	fd.seek(0)
+	if fd.read(len(MAGIC)) != MAGIC:
+		raise SnapshotError("Not a snapshot file")
+	fd.seek(size - TRAILER.size)
+	count, offset, magic = TRAILER.unpack(fd.read(TRAILER.size))
+	if magic != INDEX_MAGIC:
+		raise SnapshotError("The index of the file is damaged")
+	fd.seek(offset)
+	data = fd.read(count * INDEX_ENTRY.size)
+	index = []
+	for i in range(count):
+		index.append(INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size))
+	return index, offset
+
+def write_index(fd, index, offset):
+	fd.seek(offset)
+	fd.write("".join([INDEX_ENTRY.pack(*e) for e in index]))
+	fd.write(TRAILER.pack(len(index), offset, INDEX_MAGIC))
+	fd.truncate()
+
+def read_record(fd, offset):
+	""" Returns a tuple (year, season, kind, data) with the record at ``offset`` """
+	fd.seek(offset)
+	length, year, season, kind = RECORD_HEADER.unpack(fd.read(RECORD_HEADER.size))
+	data = simplejson.loads(zlib.decompress(fd.read(length)))
+	return year, season, kind, data
+
+def write_record(fd, offset, year, season, kind, data):
+	""" Writes a record at ``offset`` and returns the offset after it """
+	payload = zlib.compress(simplejson.dumps(data, separators=(',', ':')))
+	fd.seek(offset)
+	fd.write(RECORD_HEADER.pack(len(payload), year, season, kind))
+	fd.write(payload)
+	return offset + RECORD_HEADER.size + len(payload)
+
+def _read_state(fd, index, position):
+	""" Returns the state of the index entry at ``position`` """
+	year, season, offset, key_offset = index[position]
+	state = None
+	for e in index[:position + 1]:
+		if e[2] < key_offset:
+			continue
+		y, s, kind, data = read_record(fd, e[2])
+		if kind == FULL:
+			state = data
+		else:
+			state = patch(state, data)
+	return state
+
+def list_turns(game_id):
+	""" Returns a list of (year, season) tuples with the recorded turns """
+	path = snapshot_path(game_id)
+	if not os.path.exists(path):
+		return []
+	fd = open(path, 'rb')
+	try:
+		index, offset = read_index(fd)
+	finally:
+		fd.close()
+	return [(e[0], e[1]) for e in index]
+
+def load_state(game_id, year, season):
+	""" Returns the state of the game at the end of (``year``, ``season``),
+	or None if it was not recorded """
+	path = snapshot_path(game_id)
+	if not os.path.exists(path):
+		return None
+	fd = open(path, 'rb')
+	try:
+		index, offset = read_index(fd)
+		for position, e in enumerate(index):
+			if e[0] == year and e[1] == season:
+				return _read_state(fd, index, position)
+	finally:
+		fd.close()
+	return None
+
+def _copy(src, dst, length):
+	""" Copies the first ``length`` bytes of ``src`` to ``dst`` """
+	src.seek(0)
+	while length > 0:
+		chunk = src.read(min(length, 65536))
+		if not chunk:
+			raise SnapshotError("File is too short")
+		dst.write(chunk)
+		length -= len(chunk)
+
+def append_state(game_id, year, season, state):
+	""" Adds the state of a turn to the snapshot file of the game. If the turn
+	was already recorded (because the game was restored to a previous turn)
+	it and all the following turns are replaced.
+
+	A new turn is appended to the end of the file, and the file is truncated
+	to its old size if an error happens while writing. When turns are
+	replaced, the new file is written to a temporary file that replaces the
+	old one when it is complete. An error while writing never leaves a file
+	without a valid index. """
+	path = snapshot_path(game_id)
+	if os.path.exists(path):
+		fd = open(path, 'r+b')
+		index, end = read_index(fd)
+	else:
+		if not os.path.isdir(SNAPSHOTS_DIR):
+			os.makedirs(SNAPSHOTS_DIR)
+		fd = None
+		index, end = [], len(MAGIC)
+	try:
+		replace = False
+		for position, e in enumerate(index):
+			if (e[0], e[1]) >= (year, season):
+				end = e[2]
+				index = index[:position]
+				replace = True
+				break
+		if index and len(index) % KEYFRAME_INTERVAL != 0:
+			previous = _read_state(fd, index, len(index) - 1)
+			key_offset = index[-1][3]
+			kind, data = DELTA, diff(previous, state)
+		else:
+			key_offset = None
+			kind, data = FULL, state
+		if fd is not None and not replace:
+			_append(fd, index, year, season, kind, data, key_offset)
+			return
+		if key_offset is None:
+			key_offset = end
+		index.append((year, season, end, key_offset))
+		handle, tmp_path = tempfile.mkstemp(dir=SNAPSHOTS_DIR, suffix='.tmp')
+		out = os.fdopen(handle, 'wb')
+		try:
+			if fd is None:
+				out.write(MAGIC)
+			else:
+				_copy(fd, out, end)
+			end = write_record(out, end, year, season, kind, data)
+			write_index(out, index, end)
+			out.flush()
+			os.fsync(out.fileno())
+		except:
+			out.close()
+			os.remove(tmp_path)
+			raise
+		out.close()
+	finally:
+		if fd is not None:
+			fd.close()
+	## mkstemp creates the file only readable by its owner
+	os.chmod(tmp_path, 0644)
+	os.rename(tmp_path, path)
+
+def _append(fd, index, year, season, kind, data, key_offset):
+	""" Writes a record, the new index and the trailer at the end of ``fd``.
+	The previous index is kept, so that the file is restored by truncating
+	it to its old size if the write fails. """
+	fd.seek(0, 2)
+	size = fd.tell()
+	if key_offset is None:
+		key_offset = size
+	try:
+		end = write_record(fd, size, year, season, kind, data)
+		write_index(fd, index + [(year, season, size, key_offset)], end)
+		fd.flush()
+		os.fsync(fd.fileno())
+	except:
+		fd.truncate(size)
+		raise
+
+def save_snapshot(game):
+	""" Saves a snapshot of the current state of ``game`` """
+	append_state(game.id, game.year, game.season, capture(game))
+
+TURN_RE = re.compile(r'<turn year="(\d+)" season="(\d+)">(.*?)</turn>', re.S)
+PLAYER_RE = re.compile(r'<player(?: country="([^"]*)")?>(.*?)</player>', re.S)
+UNIT_RE = re.compile(r'<unit id="(\d+)" type="(\w)" area="([^"]*)" besieging="(\w+)" />')
+
+def game_players(game_id):
+	""" Returns a dictionary {country name: player id} with the players of a
+	game, as they were written in the old XML snapshots. The player without a
+	country (the autonomous units) has an empty name. """
+	from machiavelli.models import Player
+	players = {}
+	for id, country in Player.objects.filter(game__id=game_id).values_list('id',
+																'country__name'):
+		players[country or u''] = id
+	return players
+
+def parse_xml(data, players):
+	""" Returns a list of (year, season, state) tuples from the text of an old
+	XML snapshot file. ``players`` is a dictionary {country name: player id}
+	to set the player of the units. Raises ``SnapshotError`` if a country has
+	no player, before any turn is converted. """
+	turns = []
+	for year, season, body in TURN_RE.findall(data):
+		state = empty_state()
+		for country, units in PLAYER_RE.findall(body):
+			country = country.decode('utf-8')
+			try:
+				player_id = players[country]
+			except KeyError:
+				raise SnapshotError("There is no player for '%s' in %s, season %s" %
+									(country, year, season))
+			for id, type, area, besieging in UNIT_RE.findall(units):
+				state['units'][id] = [player_id, type, area, besieging == 'True',
+									'', True, True, 3, 1, 1]
+		turns.append((int(year), int(season), state))
+	return turns
+
+def convert_xml(game_id, players=None):
+	""" Converts the old XML snapshot file of a game to the new format.
+	Returns the number of turns converted. The units are given to the players
+	of the game, unless ``players`` maps the country names to other ids. """
+	if players is None:
+		players = game_players(game_id)
+	path = os.path.join(SNAPSHOTS_DIR, "%s.snap" % game_id)
+	fd = open(path, 'r')
+	try:
+		turns = parse_xml(fd.read(), players)
+	finally:
+		fd.close()
+	for year, season, state in turns:
+		append_state(game_id, year, season, state)
+	return len(turns)
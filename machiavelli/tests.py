@@ -0,0 +1,40 @@
+"""
+Tests of the adjudication. Each test runs a case of the benchmark corpus (see
+``machiavelli.benchmark``) in the replay database and checks that the events
+logged by ``Game.process_orders`` are the expected ones.
+"""
+
+from django.test import TestCase
+
+import machiavelli.benchmark as benchmark
+
+class AdjudicationTest(TestCase):
+	## the cases are run in the replay database
+	multi_db = True
+
+	def setUp(self):
+		benchmark.setup_database()
+
+	def run_case(self, name):
+		result = benchmark.run_case(name)
+		self.failIf(result.missing, "Missing events in %s: %s" % (name, result.missing))
+		self.failIf(result.unexpected, "Unexpected events in %s: %s" % (name, result.unexpected))
+		self.failIf(result.over_budget, "Steps over budget in %s: %s" % (name, result.over_budget))
+
+	def test_standoff(self):
+		self.run_case('standoff')
+
+	def test_convoy(self):
+		self.run_case('convoy')
+
+	def test_siege(self):
+		self.run_case('siege')
+
+	def test_friend_enemy(self):
+		self.run_case('friend-enemy')
+
+	def test_conditioned_invasion(self):
+		self.run_case('conditioned-invasion')
+
+	def test_closed_circuit(self):
+		self.run_case('closed-circuit')
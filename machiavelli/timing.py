@@ -0,0 +1,212 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module measures the steps of the processing of a phase.
+
+``Game.all_players_done`` starts a ``StepRecorder`` before processing the
+phase. Each ``Game`` method decorated with ``timed`` adds a record with its
+wall time (in milliseconds) and the number of database queries that it made.
+A step only counts its own time and queries: the ones of the ``timed`` steps
+called from it are in their own records, so the records of a phase can be
+added. The ``TOTAL`` record measures the whole phase. When the phase ends,
+the records are saved as ``StepMetric`` rows.
+
+Outside the processing of a phase, ``timed`` methods only check a thread local
+variable, so the cost of the instrumentation is negligible.
+
+Set ``STEP_TIMING`` to False to disable the instrumentation.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+import machiavelli.metrics as metrics
+
+STEP_TIMING = getattr(settings, 'STEP_TIMING', True)
+
+## name of the record that measures the whole phase
+TOTAL = 'total'
+
+_state = threading.local()
+
+class CountingCursor(object):
+	""" Wraps a database cursor and counts the queries executed with it in
+	each of the active counters """
+	def __init__(self, cursor, counters):
+		self.cursor = cursor
+		self.counters = counters
+
+	def _count(self):
+		for c in self.counters:
+			c.queries += 1
+
+	def execute(self, sql, params=()):
+		self._count()
+		return self.cursor.execute(sql, params)
+
+	def executemany(self, sql, param_list):
+		self._count()
+		return self.cursor.executemany(sql, param_list)
+
+	def __getattr__(self, attr):
+		return getattr(self.cursor, attr)
+
+	def __iter__(self):
+		return iter(self.cursor)
+
+def _install_counter():
+	""" Replaces the ``cursor`` method of each database connection, so that
+	the cursors used in a thread with active counters are counted. """
+	for alias in connections:
+		_install_connection_counter(connections[alias])
+
+def _install_connection_counter(conn):
+	if getattr(conn, '_step_counter_installed', False):
+		return
+	original_cursor = conn.cursor
+	def cursor():
+		c = original_cursor()
+		counters = getattr(_state, 'counters', None)
+		if not counters:
+			return c
+		return CountingCursor(c, list(counters))
+	conn.cursor = cursor
+	conn._step_counter_installed = True
+
+class QueryCounter(object):
+	""" Counts the queries made in the current thread between ``start_counting``
+	and ``stop_counting`` """
+	def __init__(self):
+		self.queries = 0
+
+def start_counting(counter):
+	_install_counter()
+	if getattr(_state, 'counters', None) is None:
+		_state.counters = []
+	_state.counters.append(counter)
+
+def stop_counting(counter):
+	counters = getattr(_state, 'counters', None)
+	if counters and counter in counters:
+		counters.remove(counter)
+
+def reset_counting():
+	""" Stops all the counters of the current thread """
+	_state.counters = []
+
+class StepRecorder(QueryCounter):
+	def __init__(self, game):
+		self.game_id = game.id
+		self.year = game.year
+		self.season = game.season
+		self.phase = game.phase
+		self.queries = 0
+		## list of tuples (step, milliseconds, queries)
+		self.records = []
+		## [milliseconds, queries] of the steps nested in each running step
+		self.nested = []
+		self.started = time.time()
+
+	def add(self, step, started, queries):
+		elapsed = int((time.time() - started) * 1000)
+		self.records.append((step, elapsed, self.queries - queries))
+
+	def enter(self):
+		""" Starts a step that can have nested steps """
+		self.nested.append([0, 0])
+
+	def leave(self, step, started, queries):
+		""" Records a step started with ``enter``, without the time and
+		queries of its nested steps, and adds its totals to the enclosing
+		step """
+		elapsed = (time.time() - started) * 1000
+		queries = self.queries - queries
+		nested_elapsed, nested_queries = self.nested.pop()
+		if self.nested:
+			self.nested[-1][0] += elapsed
+			self.nested[-1][1] += queries
+		self.records.append((step, max(int(elapsed - nested_elapsed), 0),
+							queries - nested_queries))
+
+	def save(self):
+		from machiavelli.models import StepMetric
+		for step, elapsed, queries in self.records:
+			StepMetric.objects.create(game_id=self.game_id,
+									year=self.year,
+									season=self.season,
+									phase=self.phase,
+									step=step,
+									elapsed=elapsed,
+									queries=queries)
+	save = transaction.commit_on_success(save)
+
+def start(game, force=False):
+	""" Starts recording the steps of the phase of ``game``. If ``force`` is
+	True, the steps are recorded even if ``STEP_TIMING`` is False. """
+	if not STEP_TIMING and not force:
+		return
+	_state.recorder = StepRecorder(game)
+	start_counting(_state.recorder)
+
+def finish(save=True):
+	""" Stops recording and saves the records, unless ``save`` is False.
+	Returns the recorder, or None if the steps were not being recorded. """
+	recorder = getattr(_state, 'recorder', None)
+	if recorder is None:
+		return None
+	_state.recorder = None
+	stop_counting(recorder)
+	if save:
+		recorder.add(TOTAL, recorder.started, 0)
+		recorder.save()
+		for step, elapsed, queries in recorder.records:
+			if step == TOTAL:
+				metrics.observe('machiavelli_phase_seconds', elapsed / 1000.0,
+								{'phase': recorder.phase})
+			else:
+				metrics.observe('machiavelli_phase_step_seconds', elapsed / 1000.0,
+								{'step': step, 'phase': recorder.phase})
+	return recorder
+
+def timed(func):
+	""" Decorator that records a step for each call to ``func`` """
+	step = func.__name__
+	def wrapper(*args, **kwargs):
+		recorder = getattr(_state, 'recorder', None)
+		if recorder is None:
+			return func(*args, **kwargs)
+		started = time.time()
+		queries = recorder.queries
+		recorder.enter()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			recorder.leave(step, started, queries)
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+	return wrapper
+
+def percentile(values, p):
+	""" Returns the percentile ``p`` (0-100) of a sorted list of values """
+	if not values:
+		return None
+	index = int(round((len(values) - 1) * p / 100.0))
+	return values[index]
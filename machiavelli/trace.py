@@ -0,0 +1,89 @@
+## Copyright (c) 2010 by Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+## This program is free software: you can redistribute it and/or modify it
+## under the terms of the GNU Affero General Public License as published by the
+## Free Software Foundation, either version 3 of the License, or (at your option
+## any later version.
+##
+## This program is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+## FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License
+## for more details.
+##
+## You should have received a copy of the GNU Affero General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/agpl.txt>.
+##
+## This license is also included in the file COPYING
+##
+## AUTHOR: Jose Antonio Martin <jantonio.martin AT gmail DOT com>
+
+""" This module records the processing of the orders in a turn.
+
+Instead of building a text, each step and decision is saved as a record with
+a message template and its arguments. The records are stored compressed in
+``TurnLog.log`` and they are only rendered as text when the log is shown.
+
+The amount of detail is set with ``TURN_TRACE_LEVEL``:
+
+* ``TRACE_OFF``: nothing is recorded, and no TurnLog is saved.
+
+* ``TRACE_STEPS``: only the beginning of each step is recorded.
+
+* ``TRACE_FULL``: every decision is recorded. This is the default.
+"""
+
+import base64
+import zlib
+
+from django.conf import settings
+from django.utils import simplejson
+
+TRACE_OFF = 0
+TRACE_STEPS = 1
+TRACE_FULL = 2
+
+TRACE_LEVEL = getattr(settings, 'TURN_TRACE_LEVEL', TRACE_FULL)
+
+## prefix of the compressed logs, to tell them from the old plain text logs
+PREFIX = u"z:"
+
+class TurnTrace(object):
+	def __init__(self, level=TRACE_LEVEL):
+		self.level = level
+		self.records = []
+
+	def _record(self, level, template, args):
+		if self.level >= level:
+			self.records.append((template, [unicode(a) for a in args]))
+
+	def step(self, template, *args):
+		""" Records the beginning of a step """
+		self._record(TRACE_STEPS, template, args)
+
+	def note(self, template, *args):
+		""" Records a decision inside a step """
+		self._record(TRACE_FULL, template, args)
+
+	def is_enabled(self):
+		return self.level > TRACE_OFF
+
+	def encode(self):
+		""" Returns the records as a compressed string """
+		data = simplejson.dumps(self.records, separators=(',', ':'))
+		return PREFIX + base64.b64encode(zlib.compress(data.encode('utf-8')))
+
+def decode(log):
+	""" Returns the list of records in a compressed log """
+	data = zlib.decompress(base64.b64decode(log[len(PREFIX):]))
+	return simplejson.loads(data.decode('utf-8'))
+
+def render(log):
+	""" Returns the text of a log, that can be compressed or plain text """
+	if not log.startswith(PREFIX):
+		return log
+	text = []
+	for template, args in decode(log):
+		if args:
+			text.append(template % tuple(args))
+		else:
+			text.append(template)
+	return u"".join(text)
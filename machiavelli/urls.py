@@ -22,6 +22,7 @@ urlpatterns = patterns('machiavelli.views',
 	url(r'^ranking/(?P<key>[-\w]+)/(?P<val>[-\w]+)$', 'ranking', name='ranking'),
 	url(r'^overthrow/(?P<revolution_id>\d+)', 'overthrow', name='overthrow'),
 	url(r'^new_game$', 'create_game', name='new-game'),
+	url(r'^metrics$', 'metrics_view', name='metrics'),
 	url(r'^game/(?P<slug>[-\w]+)/invite$', 'invite_users', name='invite-users'),
 	url(r'^game/(?P<slug>[-\w]+)/join$', 'join_game', name='join-game'),
 	url(r'^game/(?P<slug>[-\w]+)/public$', 'make_public', name='make-public'),
@@ -29,6 +30,8 @@ urlpatterns = patterns('machiavelli.views',
 	url(r'^game/(?P<slug>[-\w]+)/log$', 'logs_by_game', name='game-log'),
 	url(r'^game/(?P<slug>[-\w]+)/turn$', 'turn_log_list', name='turn-log-list'),
 	url(r'^game/(?P<slug>[-\w]+)/results$', 'game_results', name='game-results'),
+	url(r'^game/(?P<slug>[-\w]+)/map$', 'game_map', name='game-map'),
+	url(r'^game/(?P<slug>[-\w]+)/events$', 'live_events', name='game-events'),
 	url(r'^game/(?P<slug>[-\w]+)/excommunicate/(?P<player_id>\d+)', 'excommunicate', name='excommunicate'),
 	url(r'^game/(?P<slug>[-\w]+)/forgive/(?P<player_id>\d+)', 'forgive_excommunication', name='forgive-excommunication'),
 	url(r'^game/(?P<slug>[-\w]+)/lend/(?P<player_id>\d+)', 'give_money', name='lend'),
@@ -19,6 +19,8 @@
 """ Django views definitions for machiavelli application. """
 
 ## stdlib
+import os
+import time
 from datetime import datetime
 from math import ceil
 
@@ -30,10 +32,14 @@ from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, ValidationError
 from django.forms.formsets import formset_factory
 from django.forms.models import modelformset_factory
+from django.db import transaction
 from django.db.models import Q, F, Sum
 from django.db.models.query import QuerySet
 from django.core.cache import cache
 from django.views.decorators.cache import never_cache, cache_page
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
+from django.utils.hashcompat import md5_constructor
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
@@ -42,16 +48,23 @@ from django.contrib import messages
 
 ## machiavelli
 from machiavelli.models import *
+from machiavelli.graphics import MAPSDIR
+import machiavelli.broker as broker
+import machiavelli.archive as archive
+import machiavelli.metrics as metrics
 import machiavelli.forms as forms
 
 ## condottieri_common
-from condottieri_common.models import Server
+from condottieri_common.models import Server, RankingEntry, RANKING_FAME
+from condottieri_common.paginator import KeysetPaginator, InvalidKey
+import condottieri_common.rank_index as rank_index
 
 ## condottieri_profiles
 from condottieri_profiles.models import CondottieriProfile
 
 ## condottieri_events
 import condottieri_events.paginator as events_paginator
+from condottieri_events.models import game_events
 
 ## clones detection
 if 'clones' in settings.INSTALLED_APPS:
@@ -75,25 +88,25 @@ from machiavelli.models import Unit
 
 def sidebar_context(request):
 	context = {}
-	activity = cache.get('sidebar_activity')
+	activity = metrics.cache_get('sidebar_activity', 'sidebar')
 	if not activity:
 		activity = Player.objects.values("user").distinct().count()
 		cache.set('sidebar_activity', activity)
-	top_users = cache.get('sidebar_top_users')
+	top_users = metrics.cache_get('sidebar_top_users', 'sidebar')
 	if not top_users:
 		top_users = CondottieriProfile.objects.all().order_by('-weighted_score').select_related('user')[:5]
 		cache.set('sidebar_top_users', top_users)
+	server = Server.objects.get()
+	ranking_last_update = server.ranking_last_update
 	if request.user.is_authenticated():
-		if not request.user.get_profile() in top_users:
-			my_score = request.user.get_profile().weighted_score
-			my_position = CondottieriProfile.objects.filter(weighted_score__gt=my_score).count() + 1
+		profile = request.user.get_profile()
+		if not profile in top_users:
+			my_position = rank_index.get_position(profile.weighted_score, ranking_last_update)
 			context.update({'my_position': my_position,})
-	latest_gossip = cache.get('latest_gossip')
+	latest_gossip = metrics.cache_get('latest_gossip', 'sidebar')
 	if not latest_gossip:
 		latest_gossip = Whisper.objects.all()[:5]
 		cache.set('latest_gossip', latest_gossip)
-	server = Server.objects.get()
-	ranking_last_update = server.ranking_last_update
 	context.update({ 'activity': activity,
 				'top_users': top_users,
 				'whispers': latest_gossip,
@@ -250,6 +263,96 @@ def pending_games(request):
 							context,
 							context_instance=RequestContext(request))	
 
+##-------------------------
+## conditional GET helpers
+##-------------------------
+
+## game pages show the time left to the next phase change, so they are
+## considered fresh only during a slice of CONDITIONAL_GET_SLICE seconds
+CONDITIONAL_GET_SLICE = getattr(settings, 'CONDITIONAL_GET_SLICE', 5*60)
+## the state versions are kept in the cache, so the game pages can only be
+## validated if the cache is shared by all the server processes. The locmem
+## and dummy backends are private to each process.
+GAME_STATE_CONDITIONAL_GET = getattr(settings, 'GAME_STATE_CONDITIONAL_GET',
+	not settings.CACHE_BACKEND.split(':', 1)[0] in ('locmem', 'dummy'))
+
+def get_game_state(request, slug):
+	""" Returns the state version of the game with the given slug, or None
+	if the game does not exist or the conditional GET of game pages is
+	disabled. The value is kept in the request, so that the database is hit
+	only once. """
+	if not GAME_STATE_CONDITIONAL_GET:
+		return None
+	if not hasattr(request, '_game_state'):
+		request._game_state = None
+		try:
+			game_id = Game.objects.filter(slug=slug).values_list('id', flat=True)[0]
+		except IndexError:
+			pass
+		else:
+			request._game_state = Game(id=game_id).get_state_version()
+	return request._game_state
+
+def game_state_last_modified(request, slug='', **kwargs):
+	""" Returns the datetime of the last change in a game page """
+	version = get_game_state(request, slug)
+	if version is None:
+		return None
+	time_slice = int(time.time() / CONDITIONAL_GET_SLICE) * CONDITIONAL_GET_SLICE
+	return datetime.fromtimestamp(max(version, time_slice))
+
+def game_state_etag(request, slug='', **kwargs):
+	""" Returns an ETag for a game page. The page is different for each user
+	and language, and for each pending message of the messages framework. """
+	version = get_game_state(request, slug)
+	if version is None:
+		return None
+	time_slice = int(time.time() / CONDITIONAL_GET_SLICE)
+	if request.user.is_authenticated():
+		user_id = request.user.pk
+	else:
+		user_id = 0
+	key = "%s-%r-%s-%s-%s-%s" % (slug, version, time_slice, user_id,
+							getattr(request, 'LANGUAGE_CODE', ''),
+							len(messages.get_messages(request)))
+	return md5_constructor(key).hexdigest()
+
+game_state_condition = condition(etag_func=game_state_etag,
+								last_modified_func=game_state_last_modified)
+
+def get_map_stat(request, slug):
+	""" Returns a tuple (path, stat) for the current map image of the game,
+	or None if there is no map. """
+	if not hasattr(request, '_map_stat'):
+		request._map_stat = None
+		try:
+			game = Game.objects.filter(slug=slug).values('id', 'slots', 'scenario')[0]
+		except IndexError:
+			return None
+		if game['slots'] > 0:
+			filename = "scenario-%s.png" % game['scenario']
+		else:
+			filename = "map-%s.png" % game['id']
+		path = os.path.join(MAPSDIR, filename)
+		try:
+			request._map_stat = (path, os.stat(path))
+		except OSError:
+			pass
+	return request._map_stat
+
+def game_map_last_modified(request, slug='', **kwargs):
+	map_stat = get_map_stat(request, slug)
+	if map_stat is None:
+		return None
+	return datetime.fromtimestamp(map_stat[1].st_mtime)
+
+def game_map_etag(request, slug='', **kwargs):
+	map_stat = get_map_stat(request, slug)
+	if map_stat is None:
+		return None
+	path, st = map_stat
+	return "%s-%s-%s" % (os.path.basename(path), int(st.st_mtime), st.st_size)
+
 def base_context(request, game, player):
 	context = {
 		'user': request.user,
@@ -258,10 +361,11 @@ def base_context(request, game, player):
 		'player': player,
 		'player_list': game.player_list_ordered_by_cities(),
 		'show_users': game.visible,
+		'last_event_id': broker.get_broker().last_id(game.id),
 		}
 	if game.slots > 0:
 		context['player_list'] = game.player_set.filter(user__isnull=False)
-	log = game.baseevent_set.all()
+	log = game_events(game)
 	if player:
 		context['done'] = player.done
 		if game.configuration.finances:
@@ -330,14 +434,16 @@ def undo_actions(request, slug=''):
 				player.order_set.update(confirmed=False)
 				player.expense_set.update(confirmed=False)
 				if game.check_bonus_time():
-					profile.adjust_karma( -1 )
+					profile.adjust_karma(-1, 'undo_actions')
 				player.save()
+				broker.publish(game.id, "player_undone", {'player': player.pk})
 				messages.success(request, _("Your actions are now unconfirmed. You'll have to confirm then again."))
 
 	return redirect('show-game', slug=slug)
 
 @never_cache
 #@login_required
+@game_state_condition
 def play_game(request, slug='', **kwargs):
 	game = get_object_or_404(Game, slug=slug)
 	if game.slots == 0 and game.phase == PHINACTIVE:
@@ -726,6 +832,7 @@ def undo_expense(request, slug='', expense_id=''):
 
 #@login_required
 #@cache_page(60 * 60)
+@game_state_condition
 def game_results(request, slug=''):
 	game = get_object_or_404(Game, slug=slug)
 	if game.phase != PHINACTIVE:
@@ -735,15 +842,109 @@ def game_results(request, slug=''):
 				'map' : game.get_map_url(),
 				'players': scores,
 				'show_log': False,}
-	log = game.baseevent_set.all()
-	if len(log) > 0:
+	if archive.is_archived(game) or game_events(game).exists():
 		context['show_log'] = True
 	return render_to_response('machiavelli/game_results.html',
 							context,
 							context_instance=RequestContext(request))
 
+@condition(etag_func=game_map_etag, last_modified_func=game_map_last_modified)
+def game_map(request, slug=''):
+	""" Returns the current map image of the game. The browser must always
+	revalidate it, so that a 304 response is sent while the map is the same.
+	"""
+	map_stat = get_map_stat(request, slug)
+	if map_stat is None:
+		## the map of an archived game may have been removed from disk
+		game = get_object_or_404(Game, slug=slug)
+		content = archive.get_map(game)
+		if content:
+			return HttpResponse(content, mimetype='image/png')
+		raise Http404
+	try:
+		fd = open(map_stat[0], 'rb')
+	except IOError:
+		raise Http404
+	else:
+		content = fd.read()
+		fd.close()
+	response = HttpResponse(content, mimetype='image/png')
+	patch_cache_control(response, max_age=0, must_revalidate=True)
+	return response
+
+@never_cache
+@transaction.commit_manually
+def live_events(request, slug=''):
+	""" Returns the live events of a game that are newer than the last event
+	id known by the client. If the broker can wait for the events without
+	polling, the request waits for them if there are none yet. Otherwise,
+	it returns at once, so that it does not keep a server process busy.
+
+	If the request comes from an ``EventSource``, the events are sent as a
+	``text/event-stream`` and the browser reconnects when the response ends,
+	after a long ``retry`` if the broker polls. Otherwise, the events are
+	returned as a JSON list.
+	"""
+	try:
+		game_id = Game.objects.filter(slug=slug).values_list('id', flat=True)[0]
+	except IndexError:
+		transaction.rollback()
+		raise Http404
+	if request.user.is_authenticated():
+		user_id = request.user.pk
+	else:
+		user_id = None
+	last_id = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('last', ''))
+	live_broker = broker.get_broker()
+	try:
+		last_id = int(last_id)
+	except ValueError:
+		## the client does not know any event yet, so it only needs the last id
+		events = []
+		last_id = live_broker.last_id(game_id)
+	else:
+		if live_broker.can_wait:
+			events = live_broker.wait(game_id, last_id, user_id)
+		else:
+			events = live_broker.fetch(game_id, last_id, user_id)
+	transaction.commit()
+	if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+		if live_broker.can_wait:
+			retry = broker.LIVE_EVENTS_POLL
+		else:
+			retry = broker.LIVE_EVENTS_RETRY
+		lines = [u"retry: %s\n" % (retry * 1000)]
+		if events:
+			for e in events:
+				lines.append(u"id: %(id)s\nevent: %(kind)s\ndata: %(data)s\n\n" % {
+							'id': e['id'],
+							'kind': e['kind'],
+							'data': simplejson.dumps(e['data']),})
+		else:
+			lines.append(u"id: %s\n\n" % last_id)
+		return HttpResponse(u"".join(lines), mimetype='text/event-stream')
+	response = {'last': last_id, 'events': events}
+	if events:
+		response['last'] = events[-1]['id']
+	return HttpResponse(simplejson.dumps(response), mimetype='application/json')
+
+@never_cache
+def metrics_view(request):
+	""" Returns the metrics of this process in the Prometheus text format.
+	Only the addresses in ``INTERNAL_IPS`` can read them. """
+	if not request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS:
+		raise Http404
+	gauges = {
+		'machiavelli_active_games': Game.objects.filter(slots=0).exclude(phase=PHINACTIVE).count(),
+		'machiavelli_live_events': LiveEvent.objects.count(),
+	}
+	if notification:
+		gauges['machiavelli_notice_queue_batches'] = notification.NoticeQueueBatch.objects.count()
+	return HttpResponse(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @never_cache
 #@login_required
+@game_state_condition
 def logs_by_game(request, slug=''):
 	game = get_object_or_404(Game, slug=slug)
 	try:
@@ -751,10 +952,20 @@ def logs_by_game(request, slug=''):
 	except:
 		player = Player.objects.none()
 	context = base_context(request, game, player)
-	log_list = game.baseevent_set.exclude(year__exact=game.year,
-										season__exact=game.season,
-										phase__exact=game.phase)
-	paginator = events_paginator.SeasonPaginator(log_list)
+	archived_events = archive.get_events(game)
+	if archived_events is not None:
+		paginator = events_paginator.ArchiveSeasonPaginator(archived_events)
+	else:
+		log_list = game_events(game).exclude(year__exact=game.year,
+											season__exact=game.season,
+											phase__exact=game.phase)
+		if game.phase == PHINACTIVE and game.finished:
+			open_season = None
+		else:
+			open_season = (game.year, game.season)
+		paginator = events_paginator.SeasonPaginator(log_list,
+											cache_prefix=game.log_cache_prefix(),
+											open_season=open_season)
 	try:
 		year = int(request.GET.get('year'))
 	except TypeError:
@@ -1050,19 +1261,30 @@ def show_scenario(request, scenario_id):
 							context_instance=RequestContext(request))
 
 
+def get_ranking_page(request, entries, queryset):
+	""" Returns a page of a materialized ranking, with the ranked objects of
+	``queryset`` in its object_list. """
+	paginator = KeysetPaginator(entries, 10)
+	try:
+		page = paginator.page(after=request.GET.get('after'),
+							before=request.GET.get('before'))
+	except InvalidKey:
+		raise Http404
+	objects = queryset.in_bulk([e.object_id for e in page.entries])
+	page.object_list = []
+	for e in page.entries:
+		if e.object_id in objects:
+			obj = objects[e.object_id]
+			obj.rank = e.rank
+			page.object_list.append(obj)
+	return page
+
 #@login_required
 #@cache_page(30 * 60)
 def hall_of_fame(request):
-	profiles_list = CondottieriProfile.objects.all().order_by('-weighted_score')
-	paginator = Paginator(profiles_list, 10)
-	try:
-		page = int(request.GET.get('page', '1'))
-	except ValueError:
-		page = 1
-	try:
-		profiles = paginator.page(page)
-	except (EmptyPage, InvalidPage):
-		profiles = paginator.page(paginator.num_pages)
+	entries = RankingEntry.objects.filter(kind=RANKING_FAME, group_id=0)
+	profiles = get_ranking_page(request, entries,
+							CondottieriProfile.objects.select_related('user'))
 	context = {'profiles': profiles}
 	return render_to_response('machiavelli/hall_of_fame.html',
 							context,
@@ -1071,31 +1293,25 @@ def hall_of_fame(request):
 def ranking(request, key='', val=''):
 	""" Gets the qualification, ordered by scores, for a given parameter. """
 	
-	scores = Score.objects.all().order_by('-points')
 	if key == 'user': # by user
 		user = get_object_or_404(User, username=val)
-		scores = scores.filter(user=user)
+		group_id = user.id
 		title = _("Ranking for the user") + ' ' + val
 	elif key == 'scenario': # by scenario
 		scenario = get_object_or_404(Scenario, name=val)
-		scores = scores.filter(game__scenario=scenario)
+		group_id = scenario.id
 		title = _("Ranking for the scenario") + ' ' + val
 	elif key == 'country': # by country
 		country = get_object_or_404(Country, css_class=val)
-		scores = scores.filter(country=country)
+		group_id = country.id
 		title = _("Ranking for the country") + ' ' + country.name
 	else:
 		raise Http404
 
-	paginator = Paginator(scores, 10)
-	try:
-		page = int(request.GET.get('page', '1'))
-	except ValueError:
-		page = 1
-	try:
-		qualification = paginator.page(page)
-	except (EmptyPage, InvalidPage):
-		qualification = paginator.page(paginator.num_pages)
+	## key is one of the ranking kinds
+	entries = RankingEntry.objects.filter(kind=key, group_id=group_id)
+	qualification = get_ranking_page(request, entries,
+					Score.objects.select_related('user', 'country', 'game__scenario'))
 	context = {
 		'qualification': qualification,
 		'key': key,
@@ -1108,9 +1324,12 @@ def ranking(request, key='', val=''):
 
 @login_required
 #@cache_page(60 * 60) # cache 1 hour
+@game_state_condition
 def turn_log_list(request, slug=''):
 	game = get_object_or_404(Game, slug=slug)
-	log_list = game.turnlog_set.all()
+	log_list = archive.get_turnlogs(game)
+	if log_list is None:
+		log_list = game.turnlog_set.all()
 	paginator = Paginator(log_list, 1)
 	try:
 		page = int(request.GET.get('page', '1'))
@@ -1303,6 +1522,7 @@ def whisper_list(request, slug):
 							context_instance=RequestContext(request))
 
 @login_required
+@game_state_condition
 def get_valid_destinations(request, slug):
 	"""AJAX view to get valid destinations for a unit based on order type"""
 	game = get_object_or_404(Game, slug=slug)
@@ -1382,6 +1602,7 @@ def get_valid_destinations(request, slug):
 	return HttpResponse(simplejson.dumps({'destinations': destinations}), mimetype='application/json')
 
 @login_required
+@game_state_condition
 def get_valid_support_destinations(request, slug):
 
     """AJAX view to get valid destinations for support orders and convoy destinations"""
@@ -1500,6 +1721,7 @@ def get_valid_support_destinations(request, slug):
     return HttpResponse(simplejson.dumps(response_data), mimetype='application/json')
 
 @login_required
+@game_state_condition
 def get_area_info(request, slug):
 
 	"""AJAX view to get area information for a unit"""
@@ -1655,6 +1877,7 @@ def get_supportable_units_query(game, unit, valid_areas=None):
     return supportable_units
 
 @login_required
+@game_state_condition
 def get_supportable_units(request, slug):
 
     """AJAX view to get valid units that can be supported by a unit"""